@@ -137,7 +137,7 @@ class IdeaIDEInContainer(ContainerTests, test_ide.IdeaIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "idea")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=IIC")
+                                                        "products", "releases?code=IIC&latest=true")
 
     # This actually tests the code in BaseJetBrains
     def test_install_with_changed_download_page(self):
@@ -162,7 +162,7 @@ class IdeaUltimateIDEInContainer(ContainerTests, test_ide.IdeaUltimateIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "idea-ultimate")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=IIU")
+                                                        "products", "releases?code=IIU&latest=true")
 
 
 class PyCharmIDEInContainer(ContainerTests, test_ide.PyCharmIDETests):
@@ -178,7 +178,7 @@ class PyCharmIDEInContainer(ContainerTests, test_ide.PyCharmIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "pycharm")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=PCC")
+                                                        "products", "releases?code=PCC&latest=true")
 
 
 class PyCharmEducationalIDEInContainer(ContainerTests, test_ide.PyCharmEducationalIDETests):
@@ -194,7 +194,7 @@ class PyCharmEducationalIDEInContainer(ContainerTests, test_ide.PyCharmEducation
         self.installed_path = os.path.join(self.install_base_path, "ide", "pycharm-educational")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=PCE")
+                                                        "products", "releases?code=PCE&latest=true")
 
 
 class PyCharmProfessionalIDEInContainer(ContainerTests, test_ide.PyCharmProfessionalIDETests):
@@ -210,7 +210,7 @@ class PyCharmProfessionalIDEInContainer(ContainerTests, test_ide.PyCharmProfessi
         self.installed_path = os.path.join(self.install_base_path, "ide", "pycharm-professional")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=PCP")
+                                                        "products", "releases?code=PCP&latest=true")
 
 
 class RubyMineIDEInContainer(ContainerTests, test_ide.RubyMineIDETests):
@@ -227,7 +227,7 @@ class RubyMineIDEInContainer(ContainerTests, test_ide.RubyMineIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "rubymine")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=RM")
+                                                        "products", "releases?code=RM&latest=true")
 
 
 class WebStormIDEInContainer(ContainerTests, test_ide.WebStormIDETests):
@@ -243,7 +243,7 @@ class WebStormIDEInContainer(ContainerTests, test_ide.WebStormIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "webstorm")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=WS")
+                                                        "products", "releases?code=WS&latest=true")
 
 
 class CLionIDEInContainer(ContainerTests, test_ide.CLionIDETests):
@@ -259,7 +259,7 @@ class CLionIDEInContainer(ContainerTests, test_ide.CLionIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "clion")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=CL")
+                                                        "products", "releases?code=CL&latest=true")
 
 
 class DataGripIDEInContainer(ContainerTests, test_ide.DataGripIDETests):
@@ -275,7 +275,7 @@ class DataGripIDEInContainer(ContainerTests, test_ide.DataGripIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "datagrip")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=DG")
+                                                        "products", "releases?code=DG&latest=true")
 
 
 class PhpStormIDEInContainer(ContainerTests, test_ide.PhpStormIDETests):
@@ -291,7 +291,7 @@ class PhpStormIDEInContainer(ContainerTests, test_ide.PhpStormIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "phpstorm")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=PS")
+                                                        "products", "releases?code=PS&latest=true")
 
 
 class GoLandIDEInContainer(ContainerTests, test_ide.GoLandIDETests):
@@ -307,7 +307,7 @@ class GoLandIDEInContainer(ContainerTests, test_ide.GoLandIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "goland")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=GO")
+                                                        "products", "releases?code=GO&latest=true")
 
 
 class RiderIDEInContainer(ContainerTests, test_ide.RiderIDETests):
@@ -325,7 +325,7 @@ class RiderIDEInContainer(ContainerTests, test_ide.RiderIDETests):
         self.installed_path = os.path.join(self.install_base_path, "ide", "rider")
         self.bad_download_page_file_path = os.path.join(get_data_dir(),
                                                         "server-content", "data.services.jetbrains.com",
-                                                        "products", "releases?code=RD")
+                                                        "products", "releases?code=RD&latest=true")
 
 
 class NetBeansInContainer(ContainerTests, test_ide.NetBeansTests):
@@ -23,11 +23,15 @@ from . import ContainerTests
 import os
 from ..large import test_swift
 from ..tools import get_data_dir, UMAKE
+from umake.settings import UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE
 
 
 class SwiftInContainer(ContainerTests, test_swift.SwiftTests):
     """This will test the Swift integration inside a container"""
 
+    # the key signing the mock downloads
+    MOCK_KEY_FINGERPRINT = "E88E26E5E8E7E148C1AB4B31106BDA7574A80583"
+
     def setUp(self):
         self.hosts = {443: ["swift.org"]}
         self.apt_repo_override_path = os.path.join(self.APT_FAKE_REPO_PATH, 'swift')
@@ -35,6 +39,11 @@ class SwiftInContainer(ContainerTests, test_swift.SwiftTests):
         # override with container path
         self.installed_path = os.path.join(self.install_base_path, "swift", "swift-lang")
 
+    def command(self, commands_to_run):
+        """Pin the key signing the mock downloads"""
+        return super().command("{}={} {}".format(UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE, self.MOCK_KEY_FINGERPRINT,
+                                                 commands_to_run))
+
     def test_install_with_changed_download_page(self):
         """Installing swift ide should fail if download page has significantly changed"""
         download_page_file_path = os.path.join(get_data_dir(), "server-content", "swift.org", "download",
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for the base installer download page parsing"""
+
+from io import BytesIO
+import re
+from ..tools import LoggedTestCase
+from umake.frameworks import BaseCategory
+from umake.frameworks.baseinstaller import BaseInstaller
+from umake.network.download_center import DownloadCenter
+from umake.tools import MainLoop, NoneDict
+from unittest.mock import patch
+
+
+class PageFramework(BaseInstaller):
+    """Framework parsing download links from href attributes, failing on broken lines"""
+
+    def __init__(self, **kwargs):
+        super().__init__(name="Page Framework", description="Page framework", download_page="https://page/",
+                         category=BaseCategory(name="Page Category"), **kwargs)
+        self.auto_accept_license = False
+
+    def parse_download_link(self, line, in_download):
+        if "broken" in line:
+            raise IndexError("list index out of range")
+        match = re.search(r'href="(.*)"', line)
+        if match is None:
+            return (None, in_download)
+        return ((match.group(1), None), in_download)
+
+
+class TestPageParsing(LoggedTestCase):
+    """This will test parsing the download page, line by line"""
+
+    def setUp(self):
+        super().setUp()
+        self.framework = PageFramework()
+
+    def tearDown(self):
+        # we reset the loaded categories
+        BaseCategory.categories = NoneDict()
+        super().tearDown()
+
+    def test_parse_until_found(self):
+        """The page is parsed until we have the download link"""
+        page_parsing = self.framework._start_page_parsing()
+
+        self.assertFalse(self.framework.parse_page_line(page_parsing, b"<html>\n"))
+        self.assertTrue(self.framework.parse_page_line(page_parsing, b'<a href="https://page/foo.tgz">\n'))
+        self.assertTrue(self.framework.parse_page_line(page_parsing, b"broken\n"))
+        self.assertEqual(page_parsing.url, "https://page/foo.tgz")
+        self.assertIsNone(page_parsing.error)
+
+    def test_parser_failure(self):
+        """A parser exception ends the parsing as a parse error"""
+        page_parsing = self.framework._start_page_parsing()
+
+        self.assertTrue(self.framework.parse_page_line(page_parsing, b"broken\n"))
+        self.assertTrue(page_parsing.done)
+        self.assertEqual(page_parsing.error, "IndexError: list index out of range")
+        self.assertTrue(self.framework.parse_page_line(page_parsing, b'<a href="https://page/foo.tgz">\n'))
+        self.assertIsNone(page_parsing.url)
+
+    @patch.object(MainLoop, "_schedule_call")
+    def test_read_lines_parsed_in_main_loop(self, schedule_call_mock):
+        """Lines read while downloading the page are parsed in the main loop, until it has everything needed"""
+        page_parsing = self.framework._start_page_parsing()
+
+        self.assertFalse(self.framework._read_page_line(page_parsing, b'<a href="https://page/foo.tgz">\n'))
+        self.assertEqual(page_parsing.lines_count, 0)
+        self.assertEqual(schedule_call_mock.call_count, 1)
+
+        (wrapper, args, kwargs) = schedule_call_mock.call_args[0]
+        wrapper(*args, **kwargs)
+        self.assertEqual(page_parsing.url, "https://page/foo.tgz")
+        self.assertTrue(self.framework._read_page_line(page_parsing, b"<html>\n"))
+        self.assertEqual(schedule_call_mock.call_count, 1)
+
+    @patch("umake.frameworks.baseinstaller.UI")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_parse_error_reported(self, schedule_call_mock, ui_mock):
+        """A download page the parser fails on is reported as not parsable"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        page = DownloadCenter.DownloadResult(buffer=BytesIO(b"<html>\nbroken\n"), error=None, fd=None,
+                                             final_url="https://page/", cookies=None, validators={},
+                                             not_modified=False)
+        self.framework.get_metadata_and_check_license({"https://page/": page})
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        self.assertIn("Can't parse the download page https://page/: IndexError", self.error_warn_logs.getvalue())
+        self.expect_warn_error = True
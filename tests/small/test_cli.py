@@ -21,9 +21,11 @@
 
 import importlib
 from ..tools import LoggedTestCase
-from umake.ui.cli import mangle_args_for_default_framework
+from umake.tools import InputError
+from umake.ui.cli import mangle_args_for_default_framework, read_batch_install_manifest, split_batch_install_args
 import os
 import sys
+import tempfile
 from ..tools import get_data_dir, change_xdg_path, patchelem
 import umake
 from umake import frameworks
@@ -205,3 +207,26 @@ class TestCLIFromFrameworks(LoggedTestCase):
         """We mangle the -r remove option if global (before the category name) to append it to the framework option"""
         self.assertEqual(mangle_args_for_default_framework(["-r", "category-a", "framework-a"]),
                          ["category-a", "framework-a", "-r"])
+
+    def test_split_batch_install_args(self):
+        """Multiple frameworks are split with their options, on category or main category framework names"""
+        self.assertEqual(split_batch_install_args(["category-a", "category-a", "framework-b", "--foo",
+                                                  "framework-free-a", "install/path", "category-f"]),
+                         [["category-a"], ["category-a", "framework-b", "--foo"], ["framework-free-a", "install/path"],
+                          ["category-f"]])
+
+    def test_split_batch_install_args_unknown_name(self):
+        """An unknown category or framework name is an error"""
+        self.assertRaises(InputError, split_batch_install_args, ["category-a", "barframework"])
+
+    def test_split_batch_install_args_option_without_framework(self):
+        """Options before any framework is an error"""
+        self.assertRaises(InputError, split_batch_install_args, ["--foo", "category-a"])
+
+    def test_read_batch_install_manifest(self):
+        """Frameworks listed in a manifest file are split the same way, ignoring comments"""
+        with tempfile.NamedTemporaryFile("w") as manifest:
+            manifest.write("# my frameworks\ncategory-a framework-b --foo\n\nframework-free-a category-f  # foo\n")
+            manifest.flush()
+            self.assertEqual(read_batch_install_manifest(manifest.name),
+                             [["category-a", "framework-b", "--foo"], ["framework-free-a"], ["category-f"]])
@@ -238,6 +238,19 @@ class TestDecompressor(LoggedTestCase):
         # the original file is there here
         self.assertTrue(os.path.isfile(os.path.join(self.tempdir, 'foo')))
 
+    def test_decompress_report_progress(self):
+        """We report decompression progress until the whole archive was decompressed"""
+        filepath = os.path.join(self.compressfiles_dir, "valid.tgz")
+        fd = open(filepath, 'rb')
+        report = Mock()
+        Decompressor({fd: Decompressor.DecompressOrder(dest=self.tempdir, dir='')}, self.on_done, report=report)
+        self.wait_for_callback(self.on_done)
+
+        size = os.path.getsize(filepath)
+        progresses = [call_args[0][0][fd]["current"] for call_args in report.call_args_list]
+        self.assertEqual(progresses, sorted(progresses))
+        self.assertEqual(report.call_args[0][0], {fd: {"current": size, "size": size}})
+
     def test_decompress_multiple(self):
         """We decompress multiple valid .tgz file successfully"""
         filepath1 = os.path.join(self.compressfiles_dir, "valid.tgz")
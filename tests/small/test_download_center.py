@@ -20,14 +20,16 @@
 """Tests for the download center module using a local server"""
 
 import urllib3
+from concurrent import futures
 from enum import Enum
 import os
 from os.path import join, getsize
+from threading import Event
 from time import time
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
 from ..tools import get_data_dir, CopyingMock, LoggedTestCase
 from ..tools.local_server import LocalHttp
-from umake.network.download_center import DownloadCenter, DownloadItem
+from umake.network.download_center import DownloadCenter, DownloadItem, get_conditional_headers
 from umake.tools import ChecksumType, Checksum
 
 
@@ -332,6 +334,22 @@ class TestDownloadCenter(LoggedTestCase):
                                  map_result[self.build_server_address(filename)].fd.read())
         self.assertEqual(self.callback.call_count, 1, "Global done callback is only called once")
 
+    @patch("umake.network.download_center.futures.ThreadPoolExecutor", wraps=futures.ThreadPoolExecutor)
+    def test_multiple_downloads_max_parallel(self, executor_mock):
+        """we deliver all downloads while limiting how many are running in parallel"""
+        requests = [DownloadItem(self.build_server_address("biggerfile"), None),
+                    DownloadItem(self.build_server_address("simplefile"), None)]
+        DownloadCenter(requests, self.callback, max_parallel=1)
+        self.wait_for_callback(self.callback)
+
+        executor_mock.assert_called_once_with(max_workers=1)
+        map_result = self.callback.call_args[0][0]
+        for filename in ("biggerfile", "simplefile"):
+            with open(join(self.server_dir, filename), 'rb') as file_on_disk:
+                self.assertEqual(file_on_disk.read(),
+                                 map_result[self.build_server_address(filename)].fd.read())
+        self.assertEqual(self.callback.call_count, 1, "Global done callback is only called once")
+
     def test_multiple_downloads_with_reports(self):
         """we deliver more than on download in parallel"""
         requests = [DownloadItem(self.build_server_address("biggerfile"), None),
@@ -402,6 +420,68 @@ class TestDownloadCenter(LoggedTestCase):
                              result.buffer.read())
         self.assertIsNone(result.fd)
         self.assertIsNone(result.error)
+        self.assertFalse(result.not_modified)
+
+    def test_in_memory_download_shared(self):
+        """we read only once the same page requested while it's being read, each requester having its own copy"""
+        filename = "simplefile"
+        url = self.build_server_address(filename)
+        fetch = DownloadCenter._fetch
+        fetch_started = Event()
+
+        def wait_and_fetch(download_center, download_item, dest):
+            fetch_started.wait()
+            return fetch(download_center, download_item, dest)
+
+        other_callback = Mock()
+        with patch.object(DownloadCenter, "_fetch", side_effect=wait_and_fetch, autospec=True) as fetch_mock:
+            DownloadCenter([DownloadItem(url, None)], self.callback, download=False)
+            DownloadCenter([DownloadItem(url, None)], other_callback, download=False)
+            fetch_started.set()
+            self.wait_for_callback(self.callback)
+            self.wait_for_callback(other_callback)
+
+        self.assertEqual(fetch_mock.call_count, 1)
+        result = self.callback.call_args[0][0][url]
+        other_result = other_callback.call_args[0][0][url]
+        self.assertIsNot(result.buffer, other_result.buffer)
+        with open(join(self.server_dir, filename), 'rb') as file_on_disk:
+            content = file_on_disk.read()
+        self.assertEqual(result.buffer.read(), content)
+        self.assertEqual(other_result.buffer.read(), content)
+
+    def test_in_memory_download_line_reader(self):
+        """we read lines of a page while it's being downloaded, until the line reader is done"""
+        filename = "simplefile"
+        url = self.build_server_address(filename)
+        line_reader = Mock(side_effect=[False, True])
+        DownloadCenter([DownloadItem(url, None)], self.callback, download=False, line_reader=line_reader)
+        self.wait_for_callback(self.callback)
+
+        line_reader.assert_has_calls([call(b"foo\n"), call(b"bar\n")])
+        self.assertEqual(line_reader.call_count, 2)
+        result = self.callback.call_args[0][0][url]
+        with open(join(self.server_dir, filename), 'rb') as file_on_disk:
+            self.assertEqual(result.buffer.read(), file_on_disk.read())
+
+    def test_conditional_download_not_modified(self):
+        """we get an empty not modified page when passing back its validators"""
+        filename = "simplefile"
+        url = self.build_server_address(filename)
+        DownloadCenter([DownloadItem(url, None)], self.callback, download=False)
+        self.wait_for_callback(self.callback)
+        validators = self.callback.call_args[0][0][url].validators
+        self.assertIn("Last-Modified", validators)
+
+        self.callback.reset_mock()
+        DownloadCenter([DownloadItem(url, None, headers=get_conditional_headers(validators))], self.callback,
+                       download=False)
+        self.wait_for_callback(self.callback)
+
+        result = self.callback.call_args[0][0][url]
+        self.assertTrue(result.not_modified)
+        self.assertEqual(result.buffer.read(), b"")
+        self.assertIsNone(result.error)
 
     def test_unsupported_protocol(self):
         """Raises an exception when trying to download for an unsupported protocol"""
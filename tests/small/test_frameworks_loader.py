@@ -29,7 +29,7 @@ import tempfile
 from ..data.testframeworks.uninstantiableframework import Uninstantiable, InheritedFromUninstantiable
 from ..tools import get_data_dir, change_xdg_path, patchelem, LoggedTestCase, INSTALL_DIR
 import umake
-from umake import frameworks
+from umake import completion, frameworks
 from umake.frameworks.baseinstaller import BaseInstaller
 from umake.settings import UMAKE_FRAMEWORKS_ENVIRON_VARIABLE
 from umake.tools import NoneDict, ConfigHandler
@@ -348,6 +348,23 @@ class TestFrameworkLoader(BaseFrameworkLoader):
             self.assertTrue(remove_call.called)
             remove_call.assert_called_with()
 
+    def test_parse_category_and_framework_run_plan(self):
+        """Parsing category and framework with --plan only displays the requirements plan"""
+        args = Mock()
+        args.category = "category-a"
+        args.destdir = None
+        args.framework = "framework-b"
+        args.accept_license = False
+        args.remove = False
+        args.plan = True
+        framework = self.CategoryHandler.categories[args.category].frameworks["framework-b"]
+        with patch.object(framework, "setup") as setup_call,\
+                patch.object(framework, "display_requirements_plan") as plan_call:
+            self.CategoryHandler.categories[args.category].run_for(args)
+
+            self.assertTrue(plan_call.called)
+            self.assertFalse(setup_call.called)
+
     def test_parse_no_framework_with_no_default_returns_errors(self):
         """Parsing a category with no default returns an error when calling run"""
         args = Mock()
@@ -450,6 +467,12 @@ class TestFrameworkLoader(BaseFrameworkLoader):
         print(get_frameworks_list_output(args))
         self.assertTrue(get_frameworks_list_output(args).startswith("base: Base category [not installed]"))
 
+    def test_list_frameworks_categories_state(self):
+        """Listed categories installed state is the same than the category one"""
+        for category in frameworks.list_frameworks():
+            self.assertEqual(category["is_installed"],
+                             self.CategoryHandler.categories[category["category_name"]].is_installed)
+
 
 class TestFrameworkLoaderWithValidConfig(BaseFrameworkLoader):
     """This will test the dynamic framework loader activity with a valid configuration"""
@@ -547,6 +570,17 @@ class TestFrameworkLoaderSaveConfig(BaseFrameworkLoader):
                                  'framework-b': {'path': '/home/foo/bar'}
                              }}})
 
+    def test_call_mark_in_config_save_installed_metadata(self):
+        """Calling mark_in_config save installed metadata in the configuration, returned as installed config"""
+        fw = self.categoryA.frameworks["framework-b"]
+        self.assertEqual(fw.get_installed_config(), {})
+        with patch.object(fw, "get_installed_metadata", return_value={"downloads": [{"url": "https://foo"}]}):
+            fw.mark_in_config()
+
+        self.assertEqual(fw.get_installed_config(),
+                         {'path': os.path.expanduser('~/{}/category-a/framework-b'.format(INSTALL_DIR)),
+                          'downloads': [{'url': 'https://foo'}]})
+
     def test_call_remove_from_config(self):
         """Calling remove_from_config remove a framework from the config"""
         ConfigHandler().config = {'frameworks': {
@@ -1274,6 +1308,148 @@ class TestProductionFrameworkLoader(BaseFrameworkLoader):
         self.assertNotIn(BaseInstaller, frameworks.BaseCategory.main_category.frameworks.values())
 
 
+class TestFrameworkLoaderRegistry(BaseFrameworkLoader):
+    """This will test loading frameworks through the frameworks registry"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        sys.path.append(get_data_dir())
+        cls.testframeworks_dir = os.path.join(get_data_dir(), 'testframeworks')
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(get_data_dir())
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.fake_arch_version("bar", "10.10.10")
+        self.cache_dir = tempfile.mkdtemp()
+        change_xdg_path('XDG_CACHE_HOME', self.cache_dir)
+
+    def tearDown(self):
+        change_xdg_path('XDG_CACHE_HOME', remove=True)
+        shutil.rmtree(self.cache_dir)
+        self.restore_arch_version()
+        super().tearDown()
+
+    def load_frameworks(self, args, force_loading=False):
+        self.CategoryHandler.categories = NoneDict()
+        with patchelem(umake.frameworks, '__file__', os.path.join(self.testframeworks_dir, '__init__.py')),\
+                patchelem(umake.frameworks, '__package__', "testframeworks"):
+            frameworks.load_frameworks(force_loading=force_loading, load_user_frameworks=False, args=args)
+
+    def test_registry_created_on_first_load(self):
+        """The first load loads every module and creates the registry"""
+        self.load_frameworks(["category-a", "framework-b"])
+        self.assertIsNotNone(self.CategoryHandler.categories["category-f"])
+        self.assertTrue(os.path.exists(umake.registry.get_registry_path()))
+
+    def test_only_targeted_framework_loaded(self):
+        """Once the registry exists, only the targeted framework is loaded"""
+        self.load_frameworks(["category-a", "framework-b"])
+        self.load_frameworks(["category-a", "framework-b"])
+        self.assertEqual(list(self.CategoryHandler.categories.keys()), ["main", "category-a"])
+        self.assertEqual(list(self.CategoryHandler.categories["category-a"].frameworks.keys()), ["framework-b"])
+
+    def test_only_default_framework_loaded(self):
+        """Once the registry exists, only the default framework of the targeted category is loaded"""
+        self.load_frameworks(["category-a"])
+        self.load_frameworks(["category-a"])
+        self.assertEqual(list(self.CategoryHandler.categories["category-a"].frameworks.keys()), ["framework-a"])
+        self.assertEqual(self.CategoryHandler.categories["category-a"].default_framework.prog_name, "framework-a")
+
+    def test_all_loaded_without_target(self):
+        """Every framework is loaded when we can't find the target in the registry"""
+        self.load_frameworks(["category-a", "framework-b"])
+        self.load_frameworks(["--help"])
+        self.assertIsNotNone(self.CategoryHandler.categories["category-f"])
+        self.assertEqual(len(self.CategoryHandler.categories["category-a"].frameworks), 2)
+
+    def test_all_loaded_when_forced(self):
+        """Every framework is loaded when force loading them, like for listing"""
+        self.load_frameworks(["category-a", "framework-b"])
+        self.load_frameworks(["category-a", "framework-b", "--list"], force_loading=True)
+        self.assertIsNotNone(self.CategoryHandler.categories["category-f"])
+
+    def test_no_registry_without_args(self):
+        """We don't use nor create any registry when no command line args are provided"""
+        self.load_frameworks(None)
+        self.assertFalse(os.path.exists(umake.registry.get_registry_path()))
+
+    def complete(self, config=None):
+        """Answer completion from the registry, return if it succeeded and the main parser"""
+        parser = argparse.ArgumentParser()
+        with patchelem(umake.registry, 'FRAMEWORKS_PATH', self.testframeworks_dir),\
+                patchelem(umake.registry, 'FRAMEWORKS_PACKAGE', "testframeworks"),\
+                patch('umake.completion.get_user_frameworks_path', return_value=None),\
+                patch('umake.completion.ConfigHandler') as config_handler_mock,\
+                patch('umake.completion.argcomplete') as argcomplete_mock:
+            config_handler_mock.return_value.config = config
+            result = completion.autocomplete(parser)
+            self.assertEqual(argcomplete_mock.autocomplete.called, result)
+        return (result, parser)
+
+    def get_choices(self, parser):
+        """Return subparsers choices of this parser"""
+        return [action for action in parser._actions if isinstance(action, argparse._SubParsersAction)][0].choices
+
+    def test_completion_from_registry(self):
+        """Completion is answered from the registry with categories, frameworks and their arguments"""
+        self.load_frameworks(["category-a", "framework-b"])
+        result, parser = self.complete()
+
+        self.assertTrue(result)
+        categories = self.get_choices(parser)
+        self.assertIn("category-f", categories)
+        self.assertIn("framework-b", self.get_choices(categories["category-a"]))
+        args = parser.parse_args(["category-a", "framework-b", "/foo", "-r"])
+        self.assertEqual(args.destdir, "/foo")
+        self.assertTrue(args.remove)
+
+    def test_completion_only_shows_installed_for_removal_frameworks(self):
+        """Frameworks only for removal are completed only if they are installed"""
+        self.load_frameworks(["category-a", "framework-b"])
+        install_dir = tempfile.mkdtemp()
+        result, parser = self.complete({"frameworks": {"category-r": {"framework-r-installed": {"path": install_dir}}}})
+
+        self.assertIn("framework-r-installed", self.get_choices(self.get_choices(parser)["category-r"]))
+        shutil.rmtree(install_dir)
+        result, parser = self.complete({"frameworks": {"category-r": {"framework-r-installed": {"path": install_dir}}}})
+        self.assertNotIn("framework-r-installed", self.get_choices(self.get_choices(parser)["category-r"]))
+
+    def test_completion_install_and_lock_commands(self):
+        """Install and lock commands are completed from the registry, with the frameworks to install"""
+        self.load_frameworks(["category-a", "framework-b"])
+        result, parser = self.complete()
+
+        for command in ("install", "lock"):
+            command_parser = self.get_choices(parser)[command]
+            frameworks_action = [action for action in command_parser._actions if action.dest == "frameworks"][0]
+            completions = frameworks_action.completer(prefix="", parsed_args=argparse.Namespace(frameworks=[]))
+            self.assertIn("category-a", completions)
+            self.assertNotIn("framework-b", completions)
+            completions = frameworks_action.completer(prefix="fr",
+                                                      parsed_args=argparse.Namespace(frameworks=["category-a"]))
+            # main category frameworks can follow too
+            self.assertEqual(sorted(completions),
+                             ["framework-a", "framework-b", "framework-free---b", "framework-free-a"])
+            # only for removal frameworks can't be installed
+            completions = frameworks_action.completer(prefix="framework-r",
+                                                      parsed_args=argparse.Namespace(frameworks=["category-r"]))
+            self.assertEqual(completions, ["framework-r-installed-not-installable"])
+        args = parser.parse_args(["lock", "-o", "foo.lock", "category-a", "framework-b"])
+        self.assertEqual(args.output, "foo.lock")
+        self.assertEqual(args.frameworks, ["category-a", "framework-b"])
+
+    def test_completion_without_registry(self):
+        """Completion isn't answered without any registry, so that we fallback to loading frameworks"""
+        result, parser = self.complete()
+
+        self.assertFalse(result)
+
+
 class TestCustomFrameworkCantLoad(BaseFrameworkLoader):
     """Get custom unloadable automatically frameworks to test custom corner cases"""
 
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for updating JetBrains IDEs from their upstream patches"""
+
+from concurrent import futures
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from ..tools import LoggedTestCase
+from umake.frameworks import BaseCategory
+from umake.frameworks.ide import IdeCategory, PyCharm
+from umake.network.download_center import DownloadItem
+from umake.tools import MainLoop, NoneDict
+from unittest.mock import patch
+
+
+class TestJetBrainsPatch(LoggedTestCase):
+    """This will test applying JetBrains IDEs update patches, and falling back to the full download"""
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.framework = PyCharm(category=IdeCategory())
+        self.framework.install_path = os.path.join(self.tempdir, "pycharm")
+        self.framework.dry_run = False
+        self.framework.build = "2.0"
+        os.makedirs(os.path.join(self.framework.install_path, "jbr", "bin"))
+        self.write_build(self.framework.install_path, "1.0")
+
+        self.patch_path = os.path.join(self.tempdir, "patch.jar")
+        with open(self.patch_path, "wb") as f:
+            f.write(b"patch content")
+        self.framework.patch_checksum = hashlib.sha256(b"patch content").hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        # we reset the loaded categories
+        BaseCategory.categories = NoneDict()
+        super().tearDown()
+
+    def write_build(self, install_path, build):
+        with open(os.path.join(install_path, "build.txt"), "w") as f:
+            f.write("PC-{}".format(build))
+
+    def write_java(self, script):
+        """Write a fake bundled java runtime, running the script as the JetBrains updater"""
+        java = os.path.join(self.framework.install_path, "jbr", "bin", "java")
+        with open(java, "w") as f:
+            # called as java -cp <patch> com.intellij.updater.Runner install <path>
+            f.write("#!/bin/sh\n[ \"$3 $4\" = \"com.intellij.updater.Runner install\" ] || exit 1\n" + script)
+        os.chmod(java, os.stat(java).st_mode | stat.S_IEXEC)
+
+    def apply_patch(self):
+        with open(self.patch_path, "rb") as fd:
+            self.framework._apply_patch(fd)
+
+    def test_get_build(self):
+        """The installed build is read from build.txt"""
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+        self.assertIsNone(PyCharm.get_build(self.tempdir))
+
+    def test_patch_applied(self):
+        """The patched copy of the installation replaces it"""
+        self.write_java('echo PC-2.0 > "$5/build.txt"\necho \'{"buildNumber": "2.0"}\' > "$5/product-info.json"\n')
+        self.apply_patch()
+
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "2.0")
+        self.assertEqual(PyCharm.get_product_info_build(self.framework.install_path), "2.0")
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["patch.jar", "pycharm"])
+
+    def test_patch_checksum_mismatch(self):
+        """A patch not matching its checksum isn't applied"""
+        self.write_java('echo PC-2.0 > "$5/build.txt"\n')
+        self.framework.patch_checksum = "0" * 64
+
+        self.assertRaises(BaseException, self.apply_patch)
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["patch.jar", "pycharm"])
+
+    def test_patched_build_mismatch(self):
+        """A patch not resulting in the target build leaves the installation untouched"""
+        self.write_java('echo PC-1.5 > "$5/build.txt"\n')
+
+        self.assertRaises(BaseException, self.apply_patch)
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["patch.jar", "pycharm"])
+
+    def test_patched_product_info_mismatch(self):
+        """A patch not resulting in the target product info build leaves the installation untouched"""
+        self.write_java('echo PC-2.0 > "$5/build.txt"\necho \'{"buildNumber": "1.0"}\' > "$5/product-info.json"\n')
+
+        self.assertRaises(BaseException, self.apply_patch)
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["patch.jar", "pycharm"])
+
+    def test_patch_without_java(self):
+        """A patch can't be applied without any java runtime"""
+        with patch("umake.frameworks.ide.shutil.which", return_value=None):
+            self.assertRaises(BaseException, self.apply_patch)
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+
+    def test_patch_updater_failure(self):
+        """A patch the updater can't run or apply leaves the installation untouched"""
+        self.write_java('echo "Could not find or load main class com.intellij.updater.Runner" >&2\nexit 1\n')
+
+        self.assertRaises(BaseException, self.apply_patch)
+        self.assertEqual(PyCharm.get_build(self.framework.install_path), "1.0")
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["patch.jar", "pycharm"])
+
+    @patch("umake.frameworks.ide.DownloadCenter")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_patch_failure_falls_back_to_full_download(self, schedule_call_mock, download_center_mock):
+        """The whole IDE is downloaded if its patch couldn't be applied"""
+        self.framework.batch = object()
+        self.framework.download_requests = [DownloadItem("https://download.jetbrains.com/pycharm.tar.gz", None)]
+        self.framework.delta_download_request = DownloadItem("https://download.jetbrains.com/pycharm.jar", None)
+        future = futures.Future()
+        future.set_exception(BaseException("Patched build is 1.5 instead of 2.0."))
+        with open(self.patch_path, "rb") as fd:
+            self.framework._apply_patch_done(fd, future)
+
+        self.assertIsNone(self.framework.delta_download_request)
+        download_center_mock.assert_called_once_with(urls=self.framework.download_requests,
+                                                     on_done=self.framework.full_download_done)
+        self.expect_warn_error = True
+
+    def get_release(self):
+        """Return a release of the framework with a patch from the installed build"""
+        url = "https://download.jetbrains.com/pycharm"
+        return {"PCC": [{"build": "2.0",
+                         "downloads": {"linux": {"link": url + ".tar.gz", "checksumLink": url + ".tar.gz.sha256"}},
+                         "patches": {"unix": [{"fromBuild": "1.0", "link": url + ".jar",
+                                               "checksumLink": url + ".jar.sha256"}]}}]}
+
+    def test_patch_from_installed_build(self):
+        """The patch from the installed build is used"""
+        self.framework.parse_download_link(self.get_release(), False)
+        self.assertEqual(self.framework.patch["link"], "https://download.jetbrains.com/pycharm.jar")
+
+    def test_no_patch_in_dry_run(self):
+        """A dry run doesn't look for a patch, as the full download is resolved"""
+        self.framework.dry_run = True
+        self.framework.parse_download_link(self.get_release(), False)
+        self.assertIsNone(self.framework.patch)
+        self.assertEqual(self.framework.url, "https://download.jetbrains.com/pycharm.tar.gz")
+
+    def test_no_patch_from_other_build(self):
+        """Patches from other builds than the installed one are ignored"""
+        self.write_build(self.framework.install_path, "0.5")
+        self.framework.parse_download_link(self.get_release(), False)
+        self.assertIsNone(self.framework.patch)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests that heavy modules are only imported on the code paths using them"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from textwrap import dedent
+import time
+from ..tools import get_root_dir, LoggedTestCase
+from umake import registry, settings
+
+
+class TestImportTime(LoggedTestCase):
+    """Run umake commands and check their imported modules and import time budget"""
+
+    def setUp(self):
+        super().setUp()
+        self.xdg_dir = tempfile.mkdtemp()
+        self.env = os.environ.copy()
+        for key in ("XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_DATA_HOME"):
+            self.env[key] = os.path.join(self.xdg_dir, key)
+        self.env.pop("_ARGCOMPLETE", None)
+        # the background latest version check needs the network stack
+        self.env["UMAKE_NO_VERSION_CHECK"] = "1"
+        # time umake as installed, with its modules bytecode cached
+        self.env.pop("PYTHONDONTWRITEBYTECODE", None)
+        self.completions_path = os.path.join(self.xdg_dir, "completions")
+
+    def tearDown(self):
+        shutil.rmtree(self.xdg_dir)
+        super().tearDown()
+
+    def get_imports(self, *args, env=None):
+        """Run umake with those args and return (imported modules names, total import time in seconds)"""
+        result = subprocess.run([sys.executable, "-X", "importtime", os.path.join(get_root_dir(), "bin", "umake")] +
+                                list(args), env=env or self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        modules = set()
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            # nested imports are indented and already counted in their parent cumulative time
+            if not name.startswith("  "):
+                total += int(cumulative) / 1000000
+            modules.add(name.strip())
+        return (modules, total)
+
+    def assertNotImported(self, modules, forbidden_modules):
+        """Assert none of forbidden_modules, or their submodules, were imported"""
+        imported = [module for module in modules if module.split(".")[0] in forbidden_modules]
+        self.assertEqual(imported, [], "Unexpected imported modules: {}".format(imported))
+
+    def test_version(self):
+        """Printing the version doesn't import any framework, GI, apt or network modules"""
+        modules, total = self.get_imports("--version")
+        self.assertIn("umake", modules)
+        self.assertNotImported(modules, ["gi", "apt", "apt_pkg", "requests", "progressbar", "argcomplete", "yaml",
+                                         "gnupg"])
+        self.assertNotIn("umake.frameworks", modules)
+        self.assertLess(total, 0.2)
+
+    def test_help(self):
+        """Help doesn't import network, progress bar or completion modules"""
+        modules, total = self.get_imports("--help")
+        self.assertIn("umake", modules)
+        self.assertNotImported(modules, ["requests", "progressbar", "argcomplete", "gnupg"])
+        self.assertLess(total, 1)
+
+    def test_list_installed(self):
+        """Listing installed frameworks doesn't import network, progress bar or completion modules"""
+        modules, total = self.get_imports("--list-installed")
+        self.assertIn("umake", modules)
+        self.assertNotImported(modules, ["requests", "progressbar", "argcomplete", "gnupg"])
+        self.assertLess(total, 1)
+
+    def test_list_installed_json(self):
+        """Listing installed frameworks as JSON doesn't import any framework, GI, apt or network modules"""
+        modules, total = self.get_imports("--list-installed", "--json")
+        self.assertIn("umake", modules)
+        self.assertNotImported(modules, ["gi", "apt", "apt_pkg", "requests", "progressbar", "argcomplete", "gnupg"])
+        self.assertNotIn("umake.frameworks", modules)
+        self.assertLess(total, 0.2)
+
+    def test_json_without_list_installed(self):
+        """JSON output is rejected without --list-installed, rather than being ignored"""
+        env = self.env.copy()
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        result = subprocess.run([sys.executable, os.path.join(get_root_dir(), "bin", "umake"), "--list", "--json"],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--json can only be used with --list-installed", result.stderr)
+
+    def test_list_time(self):
+        """Listing all frameworks with their installed and installable states is answered within budget, end to end"""
+        env = self.env.copy()
+        # requirements are checked with the apt bindings the tests run with
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        durations = []
+        for i in range(3):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, os.path.join(get_root_dir(), "bin", "umake"), "--list"], env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+            durations.append(time.perf_counter() - start)
+            self.assertEqual(result.returncode, 0)
+        self.assertIn("android-studio", result.stdout)
+        self.assertLess(min(durations), 1.5)
+
+    def write_registry(self):
+        """Write a valid frameworks registry for the umake frameworks modules, with a category-a/framework-a"""
+        modules = registry.get_frameworks_modules(registry.FRAMEWORKS_PATH, registry.FRAMEWORKS_PACKAGE, [])
+        categories = {"category-a": {"description": "Category A", "is_main_category": False,
+                                     "frameworks": {"framework-a": {"description": "Framework A",
+                                                                    "only_for_removal": False, "arguments": []}}}}
+        registry_path = os.path.join(self.env["XDG_CACHE_HOME"], settings.CACHE_DIRNAME,
+                                     settings.FRAMEWORKS_REGISTRY_FILENAME)
+        os.makedirs(os.path.dirname(registry_path))
+        with open(registry_path, "w", encoding="utf-8") as f:
+            json.dump({"format": registry.REGISTRY_FORMAT,
+                       "locale": [self.env.get(var) for var in ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")],
+                       "modules": registry.get_modules_state(modules),
+                       "categories": categories}, f)
+
+    def get_completion_env(self, comp_line):
+        """Return the environment requesting umake shell completion for comp_line"""
+        env = self.env.copy()
+        env.update({"_ARGCOMPLETE": "1", "_ARGCOMPLETE_STDOUT_FILENAME": self.completions_path,
+                    "_ARGCOMPLETE_IFS": "\n", "COMP_LINE": comp_line, "COMP_POINT": str(len(comp_line)),
+                    "HOME": self.xdg_dir})
+        return env
+
+    def complete(self, comp_line):
+        """Run umake shell completion for comp_line, return (completions, imported modules names)"""
+        modules, total = self.get_imports(env=self.get_completion_env(comp_line))
+
+        with open(self.completions_path) as f:
+            return (f.read().split(), modules)
+
+    def time_completion(self, comp_line):
+        """Return the best duration, in seconds, of a few umake shell completions of comp_line in a new process
+
+        The duration is measured from umake being loaded to the completions being written, excluding the
+        interpreter startup which doesn't depend on umake."""
+        # argcomplete exits the process once the completions are written
+        script = dedent("""\
+            import os, sys, time
+            start = time.perf_counter()
+            exit = os._exit
+
+            def timed_exit(status):
+                sys.stderr.write("{{}}\\n".format(time.perf_counter() - start))
+                exit(status)
+
+            os._exit = timed_exit
+            sys.argv = ["umake"]
+            sys.path.insert(0, {!r})
+            from umake import main
+            main()
+            """.format(get_root_dir()))
+        durations = []
+        for i in range(5):
+            result = subprocess.run([sys.executable, "-c", script], env=self.get_completion_env(comp_line),
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+            durations.append(float(result.stderr.splitlines()[-1]))
+        return min(durations)
+
+    def test_completion(self):
+        """Completion from the registry is answered in a new process without any framework, GI, apt or network
+        modules"""
+        self.write_registry()
+        completions, modules = self.complete("umake category-a ")
+
+        self.assertIn("framework-a", completions)
+        self.assertIn("umake.completion", modules)
+        self.assertNotImported(modules, ["gi", "apt", "apt_pkg", "requests", "progressbar", "yaml", "gnupg"])
+        self.assertNotIn("umake.frameworks", modules)
+
+    def test_completion_time(self):
+        """Completion from the registry is answered within the TAB press budget, interpreter startup aside"""
+        self.write_registry()
+        self.assertLess(self.time_completion("umake category-a "), 0.05)
+
+    def test_completion_install(self):
+        """Frameworks to install are completed from the registry, without any framework, GI, apt or network
+        modules"""
+        self.write_registry()
+        completions, modules = self.complete("umake install category-a ")
+
+        self.assertIn("framework-a", completions)
+        self.assertNotImported(modules, ["gi", "apt", "apt_pkg", "requests", "progressbar", "yaml", "gnupg"])
+        self.assertNotIn("umake.frameworks", modules)
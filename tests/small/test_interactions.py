@@ -298,10 +298,9 @@ class TestInteractions(LoggedTestCase):
         self.assertEqual(inter.text, "Content")
 
     def test_unknown_progress(self):
-        """We can instantiate an unknown progress"""
-        def foo():
-            yield
-        inter = UnknownProgress(foo)
+        """We can instantiate an unknown progress, not done by default"""
+        inter = UnknownProgress()
         inter.bar = "BarElement"
 
         self.assertEqual(inter.bar, "BarElement")
+        self.assertFalse(inter.done)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests the installed frameworks inventory"""
+
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+from ..tools import change_xdg_path, LoggedTestCase
+from umake import inventory
+from umake.tools import ConfigHandler
+from unittest.mock import patch
+
+
+class TestInventory(LoggedTestCase):
+    """This will test the installed frameworks inventory from config and registry"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = tempfile.mkdtemp()
+        change_xdg_path('XDG_CONFIG_HOME', self.config_dir)
+        self.install_dir = tempfile.mkdtemp()
+        self.framework_a_path = os.path.join(self.install_dir, "framework-a")
+        os.makedirs(os.path.join(self.framework_a_path, "bin"))
+        open(os.path.join(self.framework_a_path, "bin", "framework-a"), "w").close()
+        self.registry = {"categories": {
+            "category-a": {"description": "Category A description", "is_main_category": False,
+                           "frameworks": {"framework-a": {"description": "Framework A description",
+                                                          "required_files_path": [os.path.join("bin", "framework-a")],
+                                                          "desktop_filename": None}}}}}
+        self.load_current_patcher = patch("umake.inventory.registry.load_current", return_value=self.registry)
+        self.load_current_mock = self.load_current_patcher.start()
+
+    def tearDown(self):
+        self.load_current_patcher.stop()
+        change_xdg_path('XDG_CONFIG_HOME', remove=True)
+        shutil.rmtree(self.config_dir)
+        shutil.rmtree(self.install_dir)
+        super().tearDown()
+
+    def set_config(self, frameworks):
+        ConfigHandler().config = {"frameworks": frameworks}
+
+    def test_installed_framework(self):
+        """An installed framework is listed with its description"""
+        self.set_config({"category-a": {"framework-a": {"path": self.framework_a_path}}})
+        self.assertEqual(list(inventory.get_installed_frameworks()),
+                         [{"category_name": "category-a", "framework_name": "framework-a",
+                           "framework_description": "Framework A description",
+                           "install_path": self.framework_a_path}])
+
+    def test_no_config(self):
+        """No configuration means no installed framework, without even loading the registry"""
+        self.assertEqual(list(inventory.get_installed_frameworks()), [])
+        self.assertFalse(self.load_current_mock.called)
+
+    def test_removed_install_path(self):
+        """A framework whose install path was removed isn't listed"""
+        self.set_config({"category-a": {"framework-a": {"path": os.path.join(self.install_dir, "doesnt-exist")}}})
+        self.assertEqual(list(inventory.get_installed_frameworks()), [])
+
+    def test_missing_required_file(self):
+        """A framework with a missing required file isn't listed"""
+        os.remove(os.path.join(self.framework_a_path, "bin", "framework-a"))
+        self.set_config({"category-a": {"framework-a": {"path": self.framework_a_path}}})
+        self.assertEqual(list(inventory.get_installed_frameworks()), [])
+
+    @patch("umake.inventory.launcher_exists")
+    def test_missing_launcher(self, launcher_exists_mock):
+        """A framework with a missing launcher isn't listed"""
+        launcher_exists_mock.return_value = False
+        self.registry["categories"]["category-a"]["frameworks"]["framework-a"]["desktop_filename"] = "foo.desktop"
+        self.set_config({"category-a": {"framework-a": {"path": self.framework_a_path}}})
+        self.assertEqual(list(inventory.get_installed_frameworks()), [])
+        launcher_exists_mock.assert_called_once_with("foo.desktop")
+
+    def test_framework_not_in_registry(self):
+        """An installed framework which isn't available anymore is listed without description"""
+        self.set_config({"category-b": {"framework-b": {"path": self.framework_a_path}}})
+        self.assertEqual(list(inventory.get_installed_frameworks()),
+                         [{"category_name": "category-b", "framework_name": "framework-b",
+                           "framework_description": None, "install_path": self.framework_a_path}])
+
+    @patch("umake.frameworks.load_frameworks")
+    def test_refresh_outdated_registry(self, load_frameworks_mock):
+        """All frameworks are loaded to refresh an outdated registry"""
+        self.load_current_mock.side_effect = [None, self.registry]
+        self.set_config({"category-a": {"framework-a": {"path": self.framework_a_path}}})
+        self.assertEqual(len(list(inventory.get_installed_frameworks())), 1)
+        load_frameworks_mock.assert_called_once_with(force_loading=True, args=[])
+
+    def test_dump_json(self):
+        """Installed frameworks are dumped as a JSON list"""
+        self.set_config({"category-a": {"framework-a": {"path": self.framework_a_path}},
+                         "category-b": {"framework-b": {"path": self.framework_a_path}}})
+        stream = StringIO()
+        inventory.dump_installed_frameworks(stream)
+        self.assertEqual([framework["framework_name"] for framework in json.loads(stream.getvalue())],
+                         ["framework-a", "framework-b"])
+
+    def test_dump_json_nothing_installed(self):
+        """An empty JSON list is dumped when nothing is installed"""
+        stream = StringIO()
+        inventory.dump_installed_frameworks(stream)
+        self.assertEqual(json.loads(stream.getvalue()), [])
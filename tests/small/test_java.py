@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for selecting the AdoptOpenJDK assets to install"""
+
+from io import BytesIO
+import json
+from ..tools import LoggedTestCase
+from umake.frameworks import BaseCategory
+from umake.frameworks.java import AdoptOpenJDK, JavaCategory
+from umake.network.download_center import DownloadCenter
+from umake.tools import MainLoop, NoneDict
+from unittest.mock import patch
+
+
+class TestAdoptOpenJDKAssets(LoggedTestCase):
+    """This will test choosing the assets page of the latest java version listing some assets"""
+
+    LATEST_PAGE = AdoptOpenJDK.ASSETS_URL.format(15, "hotspot")
+    PREVIOUS_PAGE = AdoptOpenJDK.ASSETS_URL.format(14, "hotspot")
+
+    def setUp(self):
+        super().setUp()
+        self.framework = AdoptOpenJDK(category=JavaCategory())
+
+    def tearDown(self):
+        # we reset the loaded categories
+        BaseCategory.categories = NoneDict()
+        super().tearDown()
+
+    def get_assets(self, *packages):
+        """Return assets of those binary packages"""
+        return [{"binary": {"package": {"link": "https://github.com/{}.tar.gz".format(package)}}}
+                for package in packages]
+
+    def get_result(self, latest_content, previous_content, latest_error=None):
+        """Return the download result of the latest and previous assets pages"""
+        def get_page(content, error=None):
+            return DownloadCenter.DownloadResult(buffer=BytesIO(json.dumps(content).encode()), error=error, fd=None,
+                                                 final_url=None, cookies=None, validators={}, not_modified=False)
+        return {self.LATEST_PAGE: get_page(latest_content, latest_error),
+                self.PREVIOUS_PAGE: get_page(previous_content)}
+
+    def test_select_latest_assets_page(self):
+        """The latest version assets page is used if it lists some assets"""
+        result = self.get_result(self.get_assets("jdk_x64_linux"), self.get_assets("jdk_x64_linux"))
+        self.assertEqual(AdoptOpenJDK.select_assets_page([self.LATEST_PAGE, self.PREVIOUS_PAGE], result),
+                         self.LATEST_PAGE)
+
+    def test_select_previous_assets_page(self):
+        """The previous version assets page is used if the latest version doesn't have any asset yet"""
+        result = self.get_result([], self.get_assets("jdk_x64_linux"))
+        self.assertEqual(AdoptOpenJDK.select_assets_page([self.LATEST_PAGE, self.PREVIOUS_PAGE], result),
+                         self.PREVIOUS_PAGE)
+
+    def test_select_previous_assets_page_on_error(self):
+        """The previous version assets page is used if the latest version one couldn't be downloaded"""
+        result = self.get_result(self.get_assets("jdk_x64_linux"), self.get_assets("jdk_x64_linux"),
+                                 latest_error="404")
+        self.assertEqual(AdoptOpenJDK.select_assets_page([self.LATEST_PAGE, self.PREVIOUS_PAGE], result),
+                         self.PREVIOUS_PAGE)
+
+    def test_select_without_any_assets(self):
+        """The last assets page is used if none lists any asset"""
+        result = self.get_result([], [])
+        self.assertEqual(AdoptOpenJDK.select_assets_page([self.LATEST_PAGE, self.PREVIOUS_PAGE], result),
+                         self.PREVIOUS_PAGE)
+
+    def test_no_matching_asset(self):
+        """No download link is found if no asset is a linux x64 jdk"""
+        self.assertEqual(self.framework.parse_download_link(self.get_assets("jre_x64_linux", "jdk_aarch64_linux"),
+                                                            False), (None, False))
+        self.assertEqual(self.framework.parse_download_link(self.get_assets("jre_x64_linux", "jdk_x64_linux"),
+                                                            False), ("https://github.com/jdk_x64_linux.tar.gz", True))
+
+    @patch.object(AdoptOpenJDK, "get_metadata_and_check_license")
+    @patch.object(MainLoop, "_schedule_call")
+    def test_assets_page_set_in_main_loop(self, schedule_call_mock, get_metadata_mock):
+        """The selected assets page is only set as the download page in the main loop"""
+        download_page = self.framework.download_page
+        result = self.get_result([], self.get_assets("jdk_x64_linux"))
+        self.framework.assets_pages_downloaded([self.LATEST_PAGE, self.PREVIOUS_PAGE], result)
+        self.assertEqual(self.framework.download_page, download_page)
+
+        (wrapper, args, kwargs) = schedule_call_mock.call_args[0]
+        wrapper(*args, **kwargs)
+        self.assertEqual(self.framework.download_page, self.PREVIOUS_PAGE)
+        get_metadata_mock.assert_called_once_with(result)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests the frameworks lock file"""
+
+import json
+import os
+import shutil
+import tempfile
+from ..tools import LoggedTestCase
+from umake import lockfile
+from umake.network.download_center import DownloadItem
+from umake.tools import Checksum, ChecksumType, InputError
+from unittest.mock import Mock
+
+
+class TestLockFile(LoggedTestCase):
+    """This will test saving and loading frameworks lock files"""
+
+    def setUp(self):
+        super().setUp()
+        self.lock_dir = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.lock_dir, lockfile.DEFAULT_LOCK_FILENAME)
+        self.framework = Mock()
+        self.framework.category.prog_name = "category-a"
+        self.framework.prog_name = "framework-a"
+        self.framework.download_requests = [
+            DownloadItem("https://example.com/framework-a-1.0.tar.gz", Checksum(ChecksumType.sha256, "abcdef")),
+            DownloadItem("https://example.com/framework-a-plugin", None)]
+        self.framework.dir_to_decompress_in_tarball = "framework-a-*"
+        self.framework.required_files_path = [os.path.join("bin", "framework-a")]
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+        super().tearDown()
+
+    def write_lock(self, content):
+        with open(self.lock_path, "w") as f:
+            f.write(content)
+
+    def test_framework_lock(self):
+        """A framework lock records its download requests and installation layout"""
+        self.assertEqual(lockfile.get_framework_lock(self.framework, ["category-a", "framework-a"], ""),
+                         {"category": "category-a", "framework": "framework-a",
+                          "command_line": ["category-a", "framework-a"],
+                          "downloads": [{"url": "https://example.com/framework-a-1.0.tar.gz",
+                                         "checksum_type": "sha256", "checksum": "abcdef",
+                                         "archive_format": "tar.gz"},
+                                        {"url": "https://example.com/framework-a-plugin",
+                                         "checksum_type": None, "checksum": None, "archive_format": None}],
+                          "dir_to_decompress_in_tarball": "framework-a-*",
+                          "required_files_path": [os.path.join("bin", "framework-a")],
+                          "license": None})
+
+    def test_save_and_load(self):
+        """A saved lock file is loaded back, with the same download requests"""
+        framework_lock = lockfile.get_framework_lock(self.framework, ["category-a"], "License text")
+        lockfile.save(self.lock_path, [framework_lock])
+
+        self.assertFalse(os.path.exists(self.lock_path + ".new"))
+        frameworks_locks = lockfile.load(self.lock_path)
+        self.assertEqual(frameworks_locks, [framework_lock])
+        self.assertEqual(lockfile.get_download_requests(frameworks_locks[0]),
+                         [DownloadItem("https://example.com/framework-a-1.0.tar.gz",
+                                       Checksum(ChecksumType.sha256, "abcdef")),
+                          DownloadItem("https://example.com/framework-a-plugin", Checksum(None, None))])
+
+    def test_load_unsupported_format(self):
+        """A lock file with another format version is rejected"""
+        self.write_lock(json.dumps({"format": lockfile.LOCK_FORMAT + 1, "frameworks": []}))
+
+        self.assertRaises(InputError, lockfile.load, self.lock_path)
+
+    def test_load_invalid_content(self):
+        """Invalid json, missing keys or unknown checksum types are rejected"""
+        for content in ("{invalid", json.dumps({"format": lockfile.LOCK_FORMAT}),
+                        json.dumps({"format": lockfile.LOCK_FORMAT,
+                                    "frameworks": [{"command_line": ["category-a"],
+                                                    "downloads": [{"url": "https://example.com/a.zip",
+                                                                   "checksum_type": "unknown",
+                                                                   "checksum": "abcdef"}]}]})):
+            self.write_lock(content)
+            self.assertRaises(InputError, lockfile.load, self.lock_path)
+
+    def test_load_missing_file(self):
+        """A missing lock file raises an OSError"""
+        self.assertRaises(OSError, lockfile.load, self.lock_path)
+
+    def test_same_downloads(self):
+        """Locked downloads are the same if they have the same urls and checksums"""
+        downloads = lockfile.get_downloads_lock(self.framework.download_requests)
+        other_downloads = lockfile.get_downloads_lock(self.framework.download_requests)
+        other_downloads[0]["archive_format"] = None
+        self.assertTrue(lockfile.is_same_downloads(downloads, other_downloads))
+
+        other_downloads[0]["checksum"] = "012345"
+        self.assertFalse(lockfile.is_same_downloads(downloads, other_downloads))
+        self.assertFalse(lockfile.is_same_downloads(downloads, downloads[:1]))
+
+    def test_archive_format(self):
+        """Archive format is deduced from the url path, ignoring its query"""
+        self.assertEqual(lockfile.get_archive_format("https://example.com/a-1.0.tar.xz?download=1"), "tar.xz")
+        self.assertEqual(lockfile.get_archive_format("https://example.com/a.zip"), "zip")
+        self.assertIsNone(lockfile.get_archive_format("https://example.com/download"))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for selecting the Nodejs release and verifying its download checksum"""
+
+from io import BytesIO
+import json
+import os
+from ..tools import get_data_dir, LoggedTestCase
+from umake.frameworks import BaseCategory
+from umake.frameworks.baseinstaller import BaseInstaller
+from umake.frameworks.nodejs import NodejsCategory, NodejsLang
+from umake.network.download_center import DownloadCenter, DownloadItem
+from umake.tools import ChecksumType, MainLoop, NoneDict
+from unittest.mock import patch
+
+
+@patch("umake.frameworks.nodejs.get_current_arch", return_value="amd64")
+class TestNodejsRelease(LoggedTestCase):
+    """This will test selecting the Nodejs release from the releases index, and checking its SHASUMS256.txt"""
+
+    DIST_URL = "https://nodejs.org/dist/mock/"
+
+    def setUp(self):
+        super().setUp()
+        self.dist_dir = os.path.join(get_data_dir(), "server-content", "nodejs.org", "dist", "mock")
+        self.framework = NodejsLang(category=NodejsCategory())
+        self.framework.dry_run = False
+        self.framework.batch = None
+        self.fds = []
+
+    def tearDown(self):
+        for fd in self.fds:
+            fd.close()
+        # we reset the loaded categories
+        BaseCategory.categories = NoneDict()
+        super().tearDown()
+
+    def get_index(self):
+        """Return a releases index listing, from the latest, releases without linux download, current, lts, current"""
+        files = ["linux-arm64", "linux-x64", "src"]
+        return json.dumps([{"version": "v3.0.0", "files": ["src"], "lts": False},
+                           {"version": "v2.0.0", "files": files, "lts": False},
+                           {"version": "v1.2.0", "files": files, "lts": "Mock"},
+                           {"version": "v1.0.0", "files": files, "lts": False}])
+
+    @patch.object(NodejsLang, "start_download_and_install")
+    @patch("umake.frameworks.nodejs.DownloadCenter")
+    def test_select_current_release(self, download_center_mock, start_download_mock, arch_mock):
+        """The latest release with a download for this arch is installed by default"""
+        self.framework.parse_releases_index(self.get_index())
+
+        self.assertEqual(self.framework.download_page, "https://nodejs.org/dist/v2.0.0/SHASUMS256.txt")
+        self.assertEqual(self.framework.download_requests,
+                         [DownloadItem("https://nodejs.org/dist/v2.0.0/node-v2.0.0-linux-x64.tar.xz", None)])
+        self.assertEqual(download_center_mock.call_args[0][0],
+                         [DownloadItem("https://nodejs.org/dist/v2.0.0/SHASUMS256.txt")])
+        start_download_mock.assert_called_once_with()
+
+    @patch.object(NodejsLang, "start_download_and_install")
+    @patch("umake.frameworks.nodejs.DownloadCenter")
+    def test_select_lts_release(self, download_center_mock, start_download_mock, arch_mock):
+        """The latest lts release with a download for this arch is installed with --lts"""
+        self.framework.lts = True
+        self.framework.parse_releases_index(self.get_index())
+
+        self.assertEqual(self.framework.download_page, "https://nodejs.org/dist/v1.2.0/SHASUMS256.txt")
+        self.assertEqual(self.framework.download_requests,
+                         [DownloadItem("https://nodejs.org/dist/v1.2.0/node-v1.2.0-linux-x64.tar.xz", None)])
+        start_download_mock.assert_called_once_with()
+
+    @patch("umake.frameworks.nodejs.UI")
+    @patch.object(NodejsLang, "start_download_and_install")
+    @patch("umake.frameworks.nodejs.DownloadCenter")
+    def test_no_release_for_arch(self, download_center_mock, start_download_mock, ui_mock, arch_mock):
+        """The releases index is reported as not parsable if no release has a download for this arch"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        arch_mock.return_value = "aarch64"
+        index = json.dumps([{"version": "v2.0.0", "files": ["linux-x64"], "lts": False}])
+        self.assertRaises(MainLoop.ReturnMainLoop, self.framework.parse_releases_index, index)
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        start_download_mock.assert_not_called()
+        self.expect_warn_error = True
+
+    def open_download(self, filename):
+        """Return the fd of a download of the mock dist content"""
+        fd = open(os.path.join(self.dist_dir, filename), "rb")
+        self.fds.append(fd)
+        return fd
+
+    def get_shasums(self, without=None):
+        """Return the download result of the mock SHASUMS256.txt page, without the lines listing without"""
+        with open(os.path.join(self.dist_dir, "SHASUMS256.txt"), "rb") as f:
+            content = b"".join(line for line in f if without is None or without not in line)
+        return {self.framework.download_page: DownloadCenter.DownloadResult(
+            buffer=BytesIO(content), error=None, fd=None, final_url=self.framework.download_page, cookies=None,
+            validators={}, not_modified=False)}
+
+    def start_download(self, filename):
+        """Start downloading filename from the mock dist, its checksum being fetched"""
+        self.framework.download_page = self.DIST_URL + "SHASUMS256.txt"
+        self.framework.download_requests = [DownloadItem(self.DIST_URL + filename, None)]
+        self.framework.checksum_pending = True
+
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_checksum_match(self, schedule_call_mock, decompress_and_install_mock, arch_mock):
+        """The download is installed once it's verified against its SHASUMS256.txt entry"""
+        self.start_download("node-mock-linux-x64.tar.xz")
+        fd = self.open_download("node-mock-linux-x64.tar.xz")
+        self.framework.decompress_and_install([fd])
+        decompress_and_install_mock.assert_not_called()
+
+        self.framework.get_checksum(self.get_shasums())
+        decompress_and_install_mock.assert_called_once_with([fd])
+        self.assertEqual(self.framework.download_requests[0].checksum.checksum_type, ChecksumType.sha256)
+        self.assertEqual(self.framework.download_requests[0].checksum.checksum_value,
+                         "347bfb7290b329045425be1b625fc3d8100922178b1128e0951f610dd3898749")
+
+    @patch("umake.frameworks.nodejs.UI")
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_checksum_mismatch(self, schedule_call_mock, decompress_and_install_mock, ui_mock, arch_mock):
+        """A download not matching its SHASUMS256.txt entry aborts the install"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        self.start_download("node-mock-linux-x64.tar.xz")
+        self.framework.get_checksum(self.get_shasums())
+        # the mock x86 tarball content differs from the listed x64 one
+        fd = self.open_download("node-mock-linux-x86.tar.xz")
+        self.assertRaises(MainLoop.ReturnMainLoop, self.framework.decompress_and_install, [fd])
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        decompress_and_install_mock.assert_not_called()
+        self.assertIn("doesn't match. Corrupted download? Aborting.", self.error_warn_logs.getvalue())
+        self.expect_warn_error = True
+
+    @patch("umake.frameworks.nodejs.UI")
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_checksum_missing(self, schedule_call_mock, decompress_and_install_mock, ui_mock, arch_mock):
+        """The install is aborted if the download isn't listed in SHASUMS256.txt"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        self.start_download("node-mock-linux-x64.tar.xz")
+        self.framework.decompress_and_install([self.open_download("node-mock-linux-x64.tar.xz")])
+        self.framework.get_checksum(self.get_shasums(without=b"node-mock-linux-x64.tar.xz"))
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        decompress_and_install_mock.assert_not_called()
+        self.assertIn("checksum missing", self.error_warn_logs.getvalue())
+        self.expect_warn_error = True
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests the frameworks registry"""
+
+import os
+import shutil
+import tempfile
+from ..tools import change_xdg_path, LoggedTestCase
+from umake import registry
+
+
+class TestRegistry(LoggedTestCase):
+    """This will test the frameworks registry cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        change_xdg_path('XDG_CACHE_HOME', self.cache_dir)
+        self.modules_dir = tempfile.mkdtemp()
+        self.module_path = os.path.join(self.modules_dir, "foo.py")
+        open(self.module_path, "w").close()
+        self.modules = [("frameworks.foo", self.module_path)]
+        self.categories = {
+            "main": {"description": "", "is_main_category": True,
+                     "frameworks": {"framework-main": self.framework_entry()}},
+            "category-a": {"description": "Category A description", "is_main_category": False,
+                           "frameworks": {"framework-a": self.framework_entry(is_category_default=True),
+                                          "framework-b": self.framework_entry()}},
+            "category-b": {"description": "Category B description", "is_main_category": False,
+                           "frameworks": {"framework-c": self.framework_entry()}}
+        }
+
+    def tearDown(self):
+        change_xdg_path('XDG_CACHE_HOME', remove=True)
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.modules_dir)
+        super().tearDown()
+
+    def framework_entry(self, is_category_default=False):
+        return {"module": "frameworks.foo", "class": "Foo", "description": "Foo description",
+                "is_category_default": is_category_default, "only_for_removal": False, "only_on_archs": [],
+                "only_ubuntu": False, "only_ubuntu_version": []}
+
+    def save_registry(self):
+        modules_state = registry.get_modules_state(self.modules)
+        registry.save(modules_state, self.categories)
+        return modules_state
+
+    def test_save_and_load(self):
+        """A saved registry is loaded back"""
+        modules_state = self.save_registry()
+        self.assertEqual(registry.load(modules_state)["categories"], self.categories)
+
+    def test_registry_in_cache_dir(self):
+        """The registry is saved in the xdg cache directory"""
+        self.save_registry()
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "umake", "frameworks-registry.json")))
+
+    def test_no_registry(self):
+        """No registry saved returns None"""
+        self.assertIsNone(registry.load(registry.get_modules_state(self.modules)))
+
+    def test_invalid_registry(self):
+        """An invalid registry content returns None"""
+        os.makedirs(os.path.join(self.cache_dir, "umake"))
+        with open(registry.get_registry_path(), "w") as f:
+            f.write("{invalid")
+        self.assertIsNone(registry.load(registry.get_modules_state(self.modules)))
+
+    def test_registry_invalidated_by_module_change(self):
+        """The registry is invalidated when a module is modified"""
+        self.save_registry()
+        os.utime(self.module_path, (0, 0))
+        self.assertIsNone(registry.load(registry.get_modules_state(self.modules)))
+
+    def test_registry_invalidated_by_new_module(self):
+        """The registry is invalidated when a new module appears"""
+        self.save_registry()
+        new_module_path = os.path.join(self.modules_dir, "bar.py")
+        open(new_module_path, "w").close()
+        self.modules.append(("frameworks.bar", new_module_path))
+        self.assertIsNone(registry.load(registry.get_modules_state(self.modules)))
+
+    def test_registry_invalidated_by_locale_change(self):
+        """The registry is invalidated when the locale changes, as descriptions are translated"""
+        initial_language = os.environ.get("LANGUAGE")
+        modules_state = self.save_registry()
+        os.environ["LANGUAGE"] = "fr_FR"
+        try:
+            self.assertIsNone(registry.load(modules_state))
+        finally:
+            os.environ.pop("LANGUAGE")
+            if initial_language is not None:
+                os.environ["LANGUAGE"] = initial_language
+
+    def test_no_modules_state_for_missing_module(self):
+        """We can't compute modules state if one module path is missing"""
+        self.modules.append(("frameworks.bar", os.path.join(self.modules_dir, "bar.py")))
+        self.assertIsNone(registry.get_modules_state(self.modules))
+
+    def test_target_category_and_framework(self):
+        """Target a category and framework"""
+        self.save_registry()
+        self.assertEqual(registry.get_targeted_framework({"categories": self.categories},
+                                                         ["category-a", "framework-b", "--remove"]),
+                         ("category-a", "framework-b"))
+
+    def test_target_default_framework(self):
+        """Target the default framework of a category"""
+        self.assertEqual(registry.get_targeted_framework({"categories": self.categories}, ["-v", "category-a"]),
+                         ("category-a", "framework-a"))
+
+    def test_target_default_framework_with_path(self):
+        """Target the default framework of a category with a destination path"""
+        self.assertEqual(registry.get_targeted_framework({"categories": self.categories}, ["category-a", "/foo"]),
+                         ("category-a", "framework-a"))
+
+    def test_target_no_default_framework_with_typo(self):
+        """A framework name typo doesn't target the default framework"""
+        self.assertIsNone(registry.get_targeted_framework({"categories": self.categories},
+                                                          ["category-a", "framwork-b"]))
+
+    def test_target_no_default_framework(self):
+        """A category without default framework doesn't target anything"""
+        self.assertIsNone(registry.get_targeted_framework({"categories": self.categories}, ["category-b"]))
+
+    def test_target_category_help(self):
+        """Help on a category doesn't target any framework"""
+        self.assertIsNone(registry.get_targeted_framework({"categories": self.categories},
+                                                          ["category-a", "--help"]))
+
+    def test_target_main_category_framework(self):
+        """Target a framework of the main category"""
+        self.assertEqual(registry.get_targeted_framework({"categories": self.categories}, ["framework-main"]),
+                         ("main", "framework-main"))
+
+    def test_target_nothing(self):
+        """No positional arguments doesn't target anything"""
+        self.assertIsNone(registry.get_targeted_framework({"categories": self.categories}, ["--version"]))
+
+    def test_target_unknown_category(self):
+        """An unknown category doesn't target anything"""
+        self.assertIsNone(registry.get_targeted_framework({"categories": self.categories}, ["foo"]))
@@ -19,10 +19,13 @@
 
 """Tests for the download center module using a local server"""
 
+from concurrent import futures
+import hashlib
 import os
 import shutil
 import subprocess
 import sys
+from threading import Event, Thread
 from time import time
 from unittest.mock import Mock, call, patch
 from contextlib import suppress
@@ -298,6 +301,161 @@ class TestRequirementsHandler(DpkgAptSetup):
         """Bucket isn't installed if some package are even not in the cache"""
         self.assertFalse(self.handler.is_bucket_installed(["testpackagedoesntexist"]))
 
+    def test_plan_bucket(self):
+        """Planning a bucket returns the number of packages and sizes without installing anything"""
+        plan = self.handler.plan_bucket(["testpackage"])
+        self.assertEqual(plan.packages_count, 1)
+        self.assertTrue(plan.download_size > 0)
+        self.assertFalse(self.handler.is_bucket_installed(["testpackage"]))
+        self.assertEqual(self.handler.cache.install_count, 0)
+
+    def test_plan_bucket_with_deps(self):
+        """Planning a bucket counts its dependencies"""
+        self.assertEqual(self.handler.plan_bucket(["testpackage1"]).packages_count, 2)
+
+    def test_plan_bucket_installed(self):
+        """Planning an already installed bucket returns an empty plan"""
+        self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+        self.wait_for_callback(self.done_callback)
+        self.assertEqual(self.handler.plan_bucket(["testpackage"]),
+                         RequirementsHandler.RequirementsPlan(packages_count=0, download_size=0, installed_size=0))
+
+    def test_prefetch(self):
+        """Prefetching a bucket downloads its archives without installing anything"""
+        self.handler.prefetch_bucket(["testpackage1"])
+        # wait for the prefetch request to be processed
+        self.handler.executor.submit(lambda: None).result()
+
+        self.assertEqual(sorted(os.listdir(self.handler._prefetch_dir.name)),
+                         ["testpackage1_0.0.1_all.deb", "testpackage_0.0.1_all.deb"])
+        # archives of our local repository are copied, not symlinked
+        self.assertFalse(os.path.islink(os.path.join(self.handler._prefetch_dir.name, "testpackage_0.0.1_all.deb")))
+        self.assertFalse(self.handler.is_bucket_installed(["testpackage"]))
+        self.assertEqual(self.handler.cache.install_count, 0)
+        self.handler._prefetch_dir.cleanup()
+        self.handler._prefetch_dir = None
+
+    def test_install_after_prefetch(self):
+        """Install a bucket reusing prefetched archives"""
+        copied_archives = []
+        really_copy_verified_archive = RequirementsHandler._copy_verified_archive
+
+        def copy_verified_archive(*args):
+            copied_archives.append(really_copy_verified_archive(*args))
+            return copied_archives[-1]
+
+        self.handler.prefetch_bucket(["testpackage"])
+        with patch.object(RequirementsHandler, "_copy_verified_archive", side_effect=copy_verified_archive):
+            self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+            self.wait_for_callback(self.done_callback)
+
+        self.assertIsNone(self.done_callback.call_args[0][0].error)
+        self.assertTrue(self.handler.is_bucket_installed(["testpackage"]))
+        self.assertEqual(copied_archives, [True])
+        self.assertIsNone(self.handler._prefetch_dir)
+
+    def test_install_after_tampered_prefetch(self):
+        """Install a bucket ignoring a prefetched archive which doesn't match its expected hash"""
+        self.handler.prefetch_bucket(["testpackage"])
+        self.handler.executor.submit(lambda: None).result()
+        # replace the prefetched archive, never write through it
+        archive_path = os.path.join(self.handler._prefetch_dir.name, "testpackage_0.0.1_all.deb")
+        os.remove(archive_path)
+        with open(archive_path, "wb") as f:
+            f.write(b"tampered")
+        with patch.object(RequirementsHandler, "_copy_verified_archive",
+                          side_effect=RequirementsHandler._copy_verified_archive) as copy_mock:
+            self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+            self.wait_for_callback(self.done_callback)
+
+        self.assertIsNone(self.done_callback.call_args[0][0].error)
+        self.assertTrue(self.handler.is_bucket_installed(["testpackage"]))
+        self.assertEqual(copy_mock.call_count, 1)
+        self.assertEqual(copy_mock.call_args[0][2], self.handler.cache["testpackage"].candidate.sha256)
+        self.expect_warn_error = True
+
+    def test_copy_verified_archive(self):
+        """Only archives matching their expected hash are copied, through the partial directory"""
+        archive_path = os.path.join(self.chroot_path, "foo_1.0_all.deb")
+        archives_dir = os.path.join(self.chroot_path, "archives")
+        with open(archive_path, "wb") as f:
+            f.write(b"content")
+        sha256 = hashlib.sha256(b"content").hexdigest()
+
+        self.assertFalse(RequirementsHandler._copy_verified_archive(archive_path, archives_dir, "0" * 64))
+        self.assertEqual(os.listdir(archives_dir), ["partial"])
+        self.assertEqual(os.listdir(os.path.join(archives_dir, "partial")), [])
+        self.assertTrue(RequirementsHandler._copy_verified_archive(archive_path, archives_dir, sha256))
+        with open(os.path.join(archives_dir, "foo_1.0_all.deb"), "rb") as f:
+            self.assertEqual(f.read(), b"content")
+        self.expect_warn_error = True
+
+    def test_copy_verified_archive_symlink(self):
+        """Symlinked prefetched archives aren't followed"""
+        archive_path = os.path.join(self.chroot_path, "foo_1.0_all.deb")
+        os.symlink(os.path.join(self.chroot_path, "other"), archive_path)
+
+        self.assertRaises(OSError, RequirementsHandler._copy_verified_archive, archive_path,
+                          os.path.join(self.chroot_path, "archives"), "0" * 64)
+
+    def test_prefetch_installed_bucket(self):
+        """Prefetching an installed bucket is a noop"""
+        self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+        self.wait_for_callback(self.done_callback)
+        self.handler.prefetch_bucket(["testpackage"])
+        self.handler.executor.submit(lambda: None).result()
+
+        self.assertIsNone(self.handler._prefetch_dir)
+
+    def test_prefetch_waits_for_cache_lock(self):
+        """Prefetching only marks the apt cache once other lookups released it"""
+        with self.handler._cache_lock:
+            self.handler.prefetch_bucket(["testpackage"])
+            future = self.handler.executor.submit(lambda: None)
+            self.assertRaises(futures.TimeoutError, future.result, timeout=0.5)
+            self.assertIsNone(self.handler._prefetch_dir)
+        future.result(timeout=10)
+
+        self.assertEqual(os.listdir(self.handler._prefetch_dir.name), ["testpackage_0.0.1_all.deb"])
+        self.handler._prefetch_dir.cleanup()
+        self.handler._prefetch_dir = None
+
+    def test_buckets_states_snapshot(self):
+        """Snapshotted buckets states are answered without waiting for the apt cache lock"""
+        buckets = [["testpackage"], ["testpackagedoesntexist"], ["testpackagedoesntexist | testpackage"]]
+        lock_taken, release_lock = Event(), Event()
+
+        def hold_cache_lock():
+            with self.handler._cache_lock:
+                lock_taken.set()
+                release_lock.wait()
+
+        with self.handler.buckets_states_snapshot(buckets):
+            lock_holder = Thread(target=hold_cache_lock)
+            lock_holder.start()
+            lock_taken.wait()
+            try:
+                with futures.ThreadPoolExecutor(max_workers=len(buckets)) as executor:
+                    installed = executor.map(self.handler.is_bucket_installed, buckets, timeout=5)
+                    available = executor.map(self.handler.is_bucket_available, buckets, timeout=5)
+                    self.assertEqual(list(installed), [False, False, False])
+                    self.assertEqual(list(available), [True, False, True])
+            finally:
+                release_lock.set()
+                lock_holder.join()
+
+    def test_buckets_states_snapshot_only_in_context(self):
+        """Buckets states are evaluated again against the apt cache out of the snapshot"""
+        with self.handler.buckets_states_snapshot([["testpackage"]]):
+            self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+            self.wait_for_callback(self.done_callback)
+            self.assertFalse(self.handler.is_bucket_installed(["testpackage"]))
+        self.assertTrue(self.handler.is_bucket_installed(["testpackage"]))
+
+    def test_plan_bucket_with_unavailable_package(self):
+        """Planning a bucket ignores packages not in the cache"""
+        self.assertEqual(self.handler.plan_bucket(["testpackagedoesntexist"]).packages_count, 0)
+
     def test_is_bucket_installed_with_unavailable_multiarch_package(self):
         """Bucket isn't installed if some multiarch package are even not in the cache"""
         self.assertFalse(self.handler.is_bucket_installed(["testpackagedoesntexist:foo"]))
@@ -415,6 +573,43 @@ class TestRequirementsHandler(DpkgAptSetup):
             self.wait_for_callback(self.done_callback)
             self.assertEqual(openaptcache_mock.call_count, 2)
 
+    def test_apt_cache_not_ready_backoff(self):
+        """We wait with an exponential and capped backoff while the apt cache isn't ready"""
+        origin_open = self.handler.cache.open
+        remaining_failures = 8
+
+        def cache_call(*args, **kwargs):
+            nonlocal remaining_failures
+            if remaining_failures == 0:
+                return origin_open()
+            remaining_failures -= 1
+            raise SystemError
+
+        with patch.object(self.handler.cache, 'open', side_effect=cache_call),\
+                patch("umake.network.requirements_handler.time.sleep") as sleep_mock:
+            self.handler._force_reload_apt_cache()
+            delays = [call_item[0][0] for call_item in sleep_mock.call_args_list]
+            self.assertEqual(delays, [0.1, 0.2, 0.4, 0.8, 1.6, 3.2, 5, 5])
+
+    def test_apt_cache_reload_once_per_transaction(self):
+        """The apt cache is reloaded only once per install transaction"""
+        with patch.object(self.handler, '_force_reload_apt_cache') as reload_mock:
+            self.handler.install_bucket(["testpackage"], lambda x: "", self.done_callback)
+            self.wait_for_callback(self.done_callback)
+            self.assertEqual(reload_mock.call_count, 1)
+
+    def test_wait_for_dpkg_lock(self):
+        """We wait for the dpkg lock to be released by another process before reloading the cache"""
+        with patch.object(self.handler, '_is_dpkg_locked', side_effect=[True, True, False]),\
+                patch("umake.network.requirements_handler.time.sleep") as sleep_mock:
+            self.handler._force_reload_apt_cache()
+            self.assertEqual(sleep_mock.call_count, 2)
+
+    def test_dpkg_not_locked_without_lock_file(self):
+        """We don't consider dpkg locked if there is no lock file"""
+        with patch.object(self.handler, 'DPKG_LOCK_FILE', os.path.join(self.chroot_path, "doesntexist")):
+            self.assertFalse(self.handler._is_dpkg_locked())
+
     def test_upgrade(self):
         """Upgrade one package already installed"""
         shutil.copy(os.path.join(self.apt_status_dir, "testpackage_installed_dpkg_status"),
@@ -19,10 +19,12 @@
 
 """Tests the umake settings handler"""
 
+import json
 import os
 import shutil
 import tempfile
-from ..tools import get_data_dir, LoggedTestCase
+import time
+from ..tools import change_xdg_path, get_data_dir, LoggedTestCase
 from unittest.mock import patch
 
 from umake import settings
@@ -97,3 +99,68 @@ class TestVersionHandler(LoggedTestCase):
         path_join_result.side_effect = self.return_fake_version_path
         os.environ["PATH"] = ""
         self.assertEqual(settings.get_version(), "42.02+unknown")
+
+
+class TestLatestVersion(LoggedTestCase):
+    """This will test the cached latest version check"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        change_xdg_path('XDG_CACHE_HOME', self.cache_dir)
+        self.initial_env = os.environ.copy()
+        os.environ.pop(settings.UMAKE_NO_VERSION_CHECK_ENVIRON_VARIABLE, None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.initial_env)
+        change_xdg_path('XDG_CACHE_HOME', remove=True)
+        shutil.rmtree(self.cache_dir)
+        super().tearDown()
+
+    def write_cache(self, version, timestamp):
+        os.makedirs(os.path.join(self.cache_dir, "umake"))
+        with open(settings.get_latest_version_path(), "w") as f:
+            json.dump({"version": version, "timestamp": timestamp}, f)
+
+    def test_no_cached_version(self):
+        """No cached latest version returns None"""
+        self.assertIsNone(settings.get_cached_latest_version())
+
+    def test_cached_version(self):
+        """A fresh cached latest version is returned"""
+        self.write_cache("42.03", time.time())
+        self.assertEqual(settings.get_cached_latest_version(), "42.03")
+
+    def test_expired_cached_version(self):
+        """An expired cached latest version isn't returned"""
+        self.write_cache("42.03", time.time() - settings.LATEST_VERSION_TTL - 1)
+        self.assertIsNone(settings.get_cached_latest_version())
+
+    @patch("umake.settings.get_latest_version")
+    def test_check_refreshes_cache(self, get_latest_version_mock):
+        """Checking latest version in background saves it in the cache"""
+        get_latest_version_mock.return_value = "42.03"
+        settings.start_latest_version_check().join()
+        self.assertEqual(settings.get_cached_latest_version(), "42.03")
+
+    @patch("umake.settings.get_latest_version")
+    def test_check_failure_not_cached(self, get_latest_version_mock):
+        """A failing latest version check doesn't create any cache"""
+        get_latest_version_mock.side_effect = OSError("No network")
+        settings.start_latest_version_check().join()
+        self.assertIsNone(settings.get_cached_latest_version())
+
+    @patch("umake.settings.get_latest_version")
+    def test_no_check_with_fresh_cache(self, get_latest_version_mock):
+        """We don't check latest version if the cached one is still fresh"""
+        self.write_cache("42.03", time.time())
+        self.assertIsNone(settings.start_latest_version_check())
+        self.assertFalse(get_latest_version_mock.called)
+
+    @patch("umake.settings.get_latest_version")
+    def test_no_check_when_disabled(self, get_latest_version_mock):
+        """We don't check latest version when disabled in the environment"""
+        os.environ[settings.UMAKE_NO_VERSION_CHECK_ENVIRON_VARIABLE] = "1"
+        self.assertIsNone(settings.start_latest_version_check())
+        self.assertFalse(get_latest_version_mock.called)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for verifying the Swift downloads signature with the pinned signing keys"""
+
+from io import BytesIO
+import os
+import shutil
+import tempfile
+from ..tools import get_data_dir, LoggedTestCase
+from umake.frameworks import BaseCategory
+from umake.frameworks.baseinstaller import BaseInstaller
+from umake.frameworks.swift import SwiftCategory, SwiftLang
+from umake.network.download_center import DownloadCenter
+from umake.settings import UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE
+from umake.tools import MainLoop, NoneDict
+from unittest.mock import patch
+from xdg import BaseDirectory
+
+
+class TestSwiftSignature(LoggedTestCase):
+    """This will test the Swift signing keys keyring and the download verification"""
+
+    # the key signing the mock downloads, and another one which isn't pinned
+    MOCK_KEY_FINGERPRINT = "E88E26E5E8E7E148C1AB4B31106BDA7574A80583"
+    OTHER_KEY_FINGERPRINT = "B445180236991DC99EDBB8854FDF88FBF74D990A"
+
+    def setUp(self):
+        super().setUp()
+        self.server_content = os.path.join(get_data_dir(), "server-content", "swift.org")
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_patcher = patch.object(BaseDirectory, "xdg_cache_home", self.tempdir)
+        self.cache_patcher.start()
+        self.framework = SwiftLang(category=SwiftCategory())
+        self.framework.dry_run = False
+        self.framework.need_root_access = False
+        self.framework.KEYS_FINGERPRINTS = [self.MOCK_KEY_FINGERPRINT]
+        self.fds = []
+
+    def tearDown(self):
+        for fd in self.fds:
+            fd.close()
+        self.cache_patcher.stop()
+        shutil.rmtree(self.tempdir)
+        # we reset the loaded categories
+        BaseCategory.categories = NoneDict()
+        super().tearDown()
+
+    def open_download(self, path):
+        """Return the fd of a download of the mock server content"""
+        fd = open(os.path.join(self.server_content, path), "rb")
+        self.fds.append(fd)
+        return fd
+
+    def download_keys(self):
+        """Update the keyring with the mock server keys"""
+        with open(os.path.join(self.server_content, "keys", "all-keys.asc"), "rb") as f:
+            keys = DownloadCenter.DownloadResult(buffer=BytesIO(f.read()), error=None, fd=None,
+                                                 final_url=self.framework.asc_url, cookies=None, validators={},
+                                                 not_modified=False)
+        self.framework.keys_downloaded({self.framework.asc_url: keys})
+
+    def get_keyring_fingerprints(self):
+        import gnupg
+        gpg = gnupg.GPG(gnupghome=self.framework.keyring_path, options=["--no-autostart"])
+        return [key["fingerprint"] for key in gpg.list_keys()]
+
+    @patch.object(BaseInstaller, "get_metadata")
+    @patch("umake.frameworks.swift.DownloadCenter")
+    def test_keys_fetched_without_keyring(self, download_center_mock, get_metadata_mock):
+        """The signing keys are fetched along with the metadata if there is no keyring yet"""
+        self.framework.get_metadata()
+
+        self.assertEqual(download_center_mock.call_args[0][0][0].url, "https://swift.org/keys/all-keys.asc")
+        self.assertFalse(self.framework.keys_ready)
+        get_metadata_mock.assert_called_once_with()
+
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_keyring_only_keeps_pinned_keys(self, schedule_call_mock):
+        """Only the pinned keys are kept in the keyring, and the pins it was updated for are recorded"""
+        self.download_keys()
+
+        self.assertTrue(self.framework.keys_ready)
+        self.assertEqual(self.get_keyring_fingerprints(), [self.MOCK_KEY_FINGERPRINT])
+        self.assertTrue(self.framework.is_keyring_pinned())
+
+    @patch.object(BaseInstaller, "get_metadata")
+    @patch("umake.frameworks.swift.DownloadCenter")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_keyring_cache_hit(self, schedule_call_mock, download_center_mock, get_metadata_mock):
+        """The keyring is reused without fetching the keys again if it's pinned to the same keys"""
+        self.download_keys()
+        framework = SwiftLang(category=self.framework.category)
+        framework.dry_run = False
+        framework.KEYS_FINGERPRINTS = [self.MOCK_KEY_FINGERPRINT]
+        framework.get_metadata()
+
+        download_center_mock.assert_not_called()
+        self.assertTrue(framework.keys_ready)
+        get_metadata_mock.assert_called_once_with()
+
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_keyring_pins_changed(self, schedule_call_mock):
+        """The keys are fetched again if the pinned keys changed since the keyring was updated"""
+        self.download_keys()
+        self.framework.KEYS_FINGERPRINTS = [self.MOCK_KEY_FINGERPRINT, self.OTHER_KEY_FINGERPRINT]
+
+        self.assertFalse(self.framework.is_keyring_pinned())
+
+    def test_additional_pinned_keys_from_environment(self):
+        """Additional keys can be pinned from the environment"""
+        with patch.dict(os.environ, {UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE: " {}, ".format(
+                self.OTHER_KEY_FINGERPRINT.lower())}):
+            self.assertEqual(self.framework.keys_fingerprints, [self.MOCK_KEY_FINGERPRINT, self.OTHER_KEY_FINGERPRINT])
+
+    @patch("umake.frameworks.swift.UI")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_no_pinned_keys(self, schedule_call_mock, ui_mock):
+        """The install is aborted if none of the fetched keys is pinned"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        self.framework.KEYS_FINGERPRINTS = SwiftLang.KEYS_FINGERPRINTS
+        self.download_keys()
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        self.assertFalse(self.framework.keys_ready)
+        self.assertFalse(self.framework.is_keyring_pinned())
+        self.expect_warn_error = True
+
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_good_signature(self, schedule_call_mock, decompress_and_install_mock):
+        """A download signed with a pinned key is installed once the keys are there"""
+        tarball = self.open_download(os.path.join("builds", "swift-mock-ubuntu15.10.tar.gz"))
+        sig = self.open_download(os.path.join("builds", "swift-mock-ubuntu15.10.tar.gz.sig"))
+        self.framework.decompress_and_install([tarball, sig])
+        decompress_and_install_mock.assert_not_called()
+
+        self.download_keys()
+        decompress_and_install_mock.assert_called_once_with([tarball])
+        self.assertTrue(sig.closed)
+
+    @patch("umake.frameworks.swift.UI")
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_bad_signature(self, schedule_call_mock, decompress_and_install_mock, ui_mock):
+        """A download not matching its signature aborts the install"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        self.download_keys()
+        page = self.open_download(os.path.join("download", "index.html"))
+        sig = self.open_download(os.path.join("builds", "swift-mock-ubuntu15.10.tar.gz.sig"))
+        self.assertRaises(MainLoop.ReturnMainLoop, self.framework.decompress_and_install, [page, sig])
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        decompress_and_install_mock.assert_not_called()
+        self.assertIn("Couldn't verify Swift Lang download signature", self.error_warn_logs.getvalue())
+        self.expect_warn_error = True
+
+    @patch("umake.frameworks.swift.UI")
+    @patch.object(BaseInstaller, "decompress_and_install")
+    @patch.object(MainLoop, "_schedule_call", side_effect=lambda function, args, kwargs: function(*args, **kwargs))
+    def test_signature_from_unpinned_key(self, schedule_call_mock, decompress_and_install_mock, ui_mock):
+        """A valid signature made with a key which isn't pinned anymore aborts the install"""
+        ui_mock.return_main_screen.side_effect = MainLoop.ReturnMainLoop
+        self.download_keys()
+        self.framework.KEYS_FINGERPRINTS = [self.OTHER_KEY_FINGERPRINT]
+        tarball = self.open_download(os.path.join("builds", "swift-mock-ubuntu15.10.tar.gz"))
+        sig = self.open_download(os.path.join("builds", "swift-mock-ubuntu15.10.tar.gz.sig"))
+        self.assertRaises(MainLoop.ReturnMainLoop, self.framework.decompress_and_install, [tarball, sig])
+
+        ui_mock.return_main_screen.assert_called_once_with(status_code=1)
+        decompress_and_install_mock.assert_not_called()
+        self.expect_warn_error = True
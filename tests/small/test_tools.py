@@ -21,8 +21,10 @@
 
 from concurrent import futures
 from gi.repository import GLib
+import json
 import os
 import shutil
+import stat
 import subprocess
 import sys
 import tempfile
@@ -35,7 +37,7 @@ from umake import settings, tools
 from umake.tools import ConfigHandler, Singleton, get_current_arch, get_foreign_archs, get_current_distro_version,\
     create_launcher, launcher_exists_and_is_pinned, launcher_exists, get_icon_path, get_launcher_path, copy_icon,\
     add_exec_link
-from unittest.mock import patch, Mock
+from unittest.mock import call, patch, Mock
 from contextlib import suppress
 
 
@@ -133,17 +135,55 @@ class TestConfigHandler(LoggedTestCase):
             self.assertTrue(os.path.exists(os.path.join(tmpdirname, "umake")), "New umake config file exists")
             self.assertFalse(os.path.exists(os.path.join(tmpdirname, "udtc")), "Old udtc config file is removed")
 
+    def test_save_config_atomically(self):
+        """Saving a config doesn't leave any temporary file behind"""
+        ConfigHandler().config = {'foo': 'bar'}
+
+        self.assertNotIn(settings.CONFIG_FILENAME + ".new", os.listdir(self.config_dir))
+
+    def test_update_config(self):
+        """Updating the config saves it"""
+        ConfigHandler().update(lambda config: config.update({'foo': 'bar'}))
+
+        self.assertEqual(ConfigHandler().config, {'foo': 'bar'})
+        with open(os.path.join(self.config_dir, settings.CONFIG_FILENAME)) as f:
+            self.assertEqual(f.read(), 'foo: bar\n')
+
+    def test_update_config_keeps_concurrent_changes(self):
+        """Updating the config keeps changes saved meanwhile by another process"""
+        ConfigHandler().config = {'foo': 'bar'}
+        with open(os.path.join(self.config_dir, settings.CONFIG_FILENAME), "w") as f:
+            f.write("foo: bar\nbaz: other process\n")
+        ConfigHandler().update(lambda config: config.update({'new': 'value'}))
+
+        self.assertEqual(ConfigHandler().config, {'foo': 'bar', 'baz': 'other process', 'new': 'value'})
+
+    def test_batch_config_updates(self):
+        """Config updates in a batch are visible right away, but only saved once at the end"""
+        config_handler = ConfigHandler()
+        with patch.object(config_handler, "_save", wraps=config_handler._save) as save_mock:
+            with config_handler.batch():
+                config_handler.update(lambda config: config.update({'foo': 'bar'}))
+                with config_handler.batch():
+                    config_handler.update(lambda config: config.update({'baz': 'qux'}))
+                self.assertEqual(config_handler.config, {'foo': 'bar', 'baz': 'qux'})
+                self.assertFalse(save_mock.called)
+            self.assertEqual(save_mock.call_count, 1)
+
+        with open(os.path.join(self.config_dir, settings.CONFIG_FILENAME)) as f:
+            self.assertEqual(f.read(), 'baz: qux\nfoo: bar\n')
+
 
 class TestGetUbuntuVersion(LoggedTestCase):
 
     def setUp(self):
         """Reset previously cached values"""
         super().setUp()
-        tools._version = None
+        tools._os_release = None
 
     def tearDown(self):
         """Reset cached values"""
-        tools._version = None
+        tools._os_release = None
         super().tearDown()
 
     def get_os_release_filepath(self, name):
@@ -175,6 +215,24 @@ class TestGetUbuntuVersion(LoggedTestCase):
         Report an issue on ubuntu check"""
         settings_module.OS_RELEASE_FILE = self.get_os_release_filepath("debian")
         self.assertEqual(get_current_distro_version(distro_name="debian"), '10')
+        self.assertIsNone(get_current_distro_version())
+
+    @patch("umake.tools.settings")
+    def test_get_current_distro_id(self, settings_module):
+        """Current distro id is reported from our os_releases local file"""
+        settings_module.OS_RELEASE_FILE = self.get_os_release_filepath("valid")
+        self.assertEqual(tools.get_current_distro_id(), 'ubuntu')
+
+    @patch("umake.tools.settings")
+    def test_os_release_parsed_once(self, settings_module):
+        """os-release file is only parsed once for all distro facts"""
+        settings_module.OS_RELEASE_FILE = self.get_os_release_filepath("valid")
+        with patch("umake.tools.platform_facts.read_os_release",
+                   side_effect=tools.platform_facts.read_os_release) as read_os_release_mock:
+            get_current_distro_version()
+            tools.get_current_distro_id()
+            get_current_distro_version(distro_name="debian")
+            self.assertEqual(read_os_release_mock.call_count, 1)
 
 
 class TestCompletion(LoggedTestCase):
@@ -218,43 +276,103 @@ class TestArchVersion(DpkgAptSetup):
         """Simulate a dpkg failure"""
         raise subprocess.CalledProcessError("dpkg failure", cmd="dpkg")
 
+    def write_dpkg_arch_file(self, content):
+        """Create a temporary dpkg arch file with this content"""
+        dpkg_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dpkg_dir)
+        arch_file = os.path.join(dpkg_dir, "arch")
+        with open(arch_file, "w") as f:
+            f.write(content)
+        return arch_file
+
     def test_get_current_arch(self):
-        """Current arch is reported"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.return_value = "fooarch"
-            self.assertEqual(get_current_arch(), "fooarch")
+        """Current arch is reported from the interpreter multiarch tuple, without calling dpkg"""
+        with patch("umake.platform_facts.sysconfig") as sysconfig_mock,\
+                patch("umake.platform_facts.subprocess") as subprocess_mock:
+            sysconfig_mock.get_config_var.return_value = "aarch64-linux-gnu"
+            self.assertEqual(get_current_arch(), "arm64")
+            self.assertFalse(subprocess_mock.check_output.called)
 
     def test_get_current_arch_twice(self):
         """Current arch is reported twice and the same"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.return_value = "fooarch"
+        with patch("umake.platform_facts.get_native_arch") as get_native_arch_mock:
+            get_native_arch_mock.return_value = "fooarch"
+            self.assertEqual(get_current_arch(), "fooarch")
             self.assertEqual(get_current_arch(), "fooarch")
+            self.assertEqual(get_native_arch_mock.call_count, 1, "We cache older value")
+
+    def test_get_current_arch_unknown_multiarch(self):
+        """Current arch is reported by dpkg on unknown interpreter multiarch tuple"""
+        with patch("umake.platform_facts.sysconfig") as sysconfig_mock,\
+                patch("umake.platform_facts.subprocess") as subprocess_mock:
+            sysconfig_mock.get_config_var.return_value = None
+            subprocess_mock.check_output.return_value = "fooarch\n"
             self.assertEqual(get_current_arch(), "fooarch")
-            self.assertEqual(subprocess_mock.check_output.call_count, 1, "We cache older value")
 
     def test_get_current_arch_no_dpkg(self):
-        """Assert an error if dpkg exit with an error"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
+        """Assert an error if dpkg exit with an error on unknown interpreter multiarch tuple"""
+        with patch("umake.platform_facts.sysconfig") as sysconfig_mock,\
+                patch("umake.platform_facts.subprocess") as subprocess_mock:
+            sysconfig_mock.get_config_var.return_value = None
             subprocess_mock.check_output.side_effect = self.dpkg_error
             self.assertRaises(subprocess.CalledProcessError, get_current_arch)
 
     def test_get_foreign_arch(self):
-        """Get current foreign arch (one)"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.return_value = "fooarch"
+        """Get current foreign arch (one), excluding the native one"""
+        tools._current_arch = "nativearch"
+        arch_file = self.write_dpkg_arch_file("nativearch\nfooarch\n")
+        with patch("umake.platform_facts.which", return_value="/usr/bin/dpkg"),\
+                patch("umake.platform_facts.DPKG_ARCH_FILE", arch_file),\
+                patch("umake.platform_facts.DPKG_CONFIG_FILES", []):
             self.assertEqual(get_foreign_archs(), ["fooarch"])
 
     def test_get_foreign_archs(self):
         """Get current foreign arch (multiple)"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.return_value = "fooarch\nbararch\nbazarch"
+        tools._current_arch = "nativearch"
+        arch_file = self.write_dpkg_arch_file("nativearch\nfooarch\nbararch\nbazarch\n")
+        with patch("umake.platform_facts.which", return_value="/usr/bin/dpkg"),\
+                patch("umake.platform_facts.DPKG_ARCH_FILE", arch_file),\
+                patch("umake.platform_facts.DPKG_CONFIG_FILES", []):
             self.assertEqual(get_foreign_archs(), ["fooarch", "bararch", "bazarch"])
 
-    def test_get_foreign_archs_error(self):
-        """Get current foreign arch raises an exception if dpkg is in error"""
-        with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.side_effect = self.dpkg_error
-            self.assertRaises(subprocess.CalledProcessError, get_foreign_archs)
+    def test_get_foreign_archs_from_dpkg_config(self):
+        """Get foreign archs declared in dpkg configuration files, without duplicates"""
+        tools._current_arch = "nativearch"
+        arch_file = self.write_dpkg_arch_file("nativearch\nfooarch\n")
+        config_file = self.write_dpkg_arch_file("# comment\nforeign-architecture bararch\nforeign-architecture fooarch")
+        with patch("umake.platform_facts.which", return_value="/usr/bin/dpkg"),\
+                patch("umake.platform_facts.DPKG_ARCH_FILE", arch_file),\
+                patch("umake.platform_facts.DPKG_CONFIG_FILES", [config_file]):
+            self.assertEqual(get_foreign_archs(), ["fooarch", "bararch"])
+
+    def test_get_foreign_archs_from_dpkg_admindir(self):
+        """Get foreign archs from the dpkg database set in the environment"""
+        tools._current_arch = "nativearch"
+        arch_file = self.write_dpkg_arch_file("nativearch\nfooarch\n")
+        with patch("umake.platform_facts.which", return_value="/usr/bin/dpkg"),\
+                patch.dict(os.environ, {"DPKG_ADMINDIR": os.path.dirname(arch_file)}),\
+                patch("umake.platform_facts.DPKG_ARCH_FILE", "/doesnt/exist"),\
+                patch("umake.platform_facts.DPKG_CONFIG_FILES", []):
+            self.assertEqual(get_foreign_archs(), ["fooarch"])
+
+    def test_get_foreign_archs_none(self):
+        """No foreign arch without any dpkg arch file"""
+        tools._current_arch = "nativearch"
+        with patch("umake.platform_facts.which", return_value="/usr/bin/dpkg"),\
+                patch("umake.platform_facts.DPKG_ARCH_FILE", "/doesnt/exist"),\
+                patch("umake.platform_facts.DPKG_CONFIG_FILES", []),\
+                patch("umake.platform_facts.subprocess") as subprocess_mock:
+            self.assertEqual(get_foreign_archs(), [])
+            self.assertFalse(subprocess_mock.check_output.called)
+
+    def test_get_foreign_archs_from_dpkg_wrapper(self):
+        """Foreign archs are asked to dpkg if it's not the system one, as it may use another database"""
+        tools._current_arch = "nativearch"
+        with patch("umake.platform_facts.subprocess") as subprocess_mock:
+            subprocess_mock.check_output.return_value = "fooarch\nbararch\n"
+            self.assertEqual(get_foreign_archs(), ["fooarch", "bararch"])
+            subprocess_mock.check_output.assert_called_once_with(["dpkg", "--print-foreign-architectures"],
+                                                                 universal_newlines=True)
 
     def test_add_new_foreign_arch(self):
         """Add a new foreign arch and check that we can retrieve it (cache invalidated)"""
@@ -265,8 +383,8 @@ class TestArchVersion(DpkgAptSetup):
 
     def test_add_foreign_arch_already_in(self):
         """Add a foreign arch which was already there should be a noop"""
+        tools._foreign_arch = ["foo"]
         with patch("umake.tools.subprocess") as subprocess_mock:
-            subprocess_mock.check_output.return_value = "foo"
             subprocess_mock.call.side_effect = subprocess.call
             tools.add_foreign_arch("foo")
 
@@ -299,6 +417,7 @@ class TestToolsThreads(LoggedTestCase):
 
     def tearDown(self):
         Singleton._instances = {}
+        tools.MainLoop.batch_dispatches = True
         sys.stderr = self.saved_stderr
         super().tearDown()
 
@@ -371,6 +490,56 @@ class TestToolsThreads(LoggedTestCase):
         self.assertIsNotNone(self.function_thread)
         self.assertNotEqual(self.mainloop_thread, self.function_thread)
 
+    def run_dispatched_calls(self):
+        """Queue some calls to run in the mainloop thread and return their arguments in running order"""
+        called_with = []
+
+        @tools.MainLoop.in_mainloop_thread
+        def _function_in_mainloop_thread(value):
+            called_with.append(value)
+            if len(called_with) == 3:
+                self.mainloop_object.quit()
+
+        for value in range(3):
+            _function_in_mainloop_thread(value)
+        self.start_glib_mainloop()
+        self.wait_for_mainloop_shutdown()
+        return called_with
+
+    @patch("umake.tools.sys")
+    def test_batch_dispatches(self, mocksys):
+        """Pending calls are all run in order in a single mainloop iteration"""
+        self.assertEqual(self.run_dispatched_calls(), [0, 1, 2])
+
+        stats = self.mainloop_object.dispatch_stats
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.iterations, 1)
+        self.assertEqual(stats.max_queue_depth, 3)
+        self.assertGreater(stats.max_latency, 0)
+
+    @patch("umake.tools.sys")
+    def test_no_batch_dispatches(self, mocksys):
+        """Pending calls are run in order in one mainloop iteration each without batching"""
+        tools.MainLoop.batch_dispatches = False
+        self.assertEqual(self.run_dispatched_calls(), [0, 1, 2])
+
+        stats = self.mainloop_object.dispatch_stats
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.iterations, 3)
+        self.assertEqual(stats.max_queue_depth, 3)
+
+    def test_mainloop_thread_function_source_id(self):
+        """Decorated mainloop thread functions return the idle source id running them, shared by batched calls"""
+
+        @tools.MainLoop.in_mainloop_thread
+        def _function_in_mainloop_thread():
+            pass
+
+        source_id = _function_in_mainloop_thread()
+        self.assertIsNotNone(source_id)
+        self.assertEqual(_function_in_mainloop_thread(), source_id)
+        GLib.source_remove(source_id)
+
     def test_singleton(self):
         """Ensure we are delivering a singleton for RequirementsHandler"""
         second = tools.MainLoop()
@@ -463,6 +632,15 @@ class TestLauncherIcons(LoggedTestCase):
                StartupWMClass=jetbrains-android-studio
                """.format(install_dir=INSTALL_DIR))
 
+    def set_favorites(self, SettingsMock, favorites):
+        """Set the launcher favorites list, updated by set_strv"""
+        favorites = list(favorites)
+
+        def set_strv(key, value):
+            favorites[:] = value
+        SettingsMock.return_value.get_strv.side_effect = lambda key: list(favorites)
+        SettingsMock.return_value.set_strv.side_effect = set_strv
+
     def write_desktop_file(self, filename):
         """Write a dummy filename to the applications dir and return filepath"""
         result_file = os.path.join(self.local_dir, "applications", filename)
@@ -470,11 +648,11 @@ class TestLauncherIcons(LoggedTestCase):
             f.write("Foo Bar Baz")
         return result_file
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_can_install(self, SettingsMock):
         """Install a basic launcher, default case with unity://running"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
-        SettingsMock.return_value.get_strv.return_value = ["application://bar.desktop", "unity://running-apps"]
+        self.set_favorites(SettingsMock, ["application://bar.desktop", "unity://running-apps"])
         create_launcher("foo.desktop", self.get_generic_desktop_content())
 
         self.assertTrue(SettingsMock.list_schemas.called)
@@ -485,11 +663,11 @@ class TestLauncherIcons(LoggedTestCase):
         self.assertTrue(os.path.exists(get_launcher_path("foo.desktop")))
         self.assertEqual(open(get_launcher_path("foo.desktop")).read(), self.get_generic_desktop_content())
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_can_update_launcher(self, SettingsMock):
         """Update a launcher file"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
-        SettingsMock.return_value.get_strv.return_value = ["application://bar.desktop", "unity://running-apps"]
+        self.set_favorites(SettingsMock, ["application://bar.desktop", "unity://running-apps"])
         create_launcher("foo.desktop", self.get_generic_desktop_content())
         new_content = dedent("""\
                [Desktop Entry]
@@ -508,11 +686,11 @@ class TestLauncherIcons(LoggedTestCase):
         self.assertTrue(os.path.exists(get_launcher_path("foo.desktop")))
         self.assertEqual(open(get_launcher_path("foo.desktop")).read(), new_content)
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_can_install_without_unity_running(self, SettingsMock):
         """Install a basic launcher icon, without a running apps entry (so will be last)"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
-        SettingsMock.return_value.get_strv.return_value = ["application://bar.desktop", "application://baz.desktop"]
+        self.set_favorites(SettingsMock, ["application://bar.desktop", "application://baz.desktop"])
         create_launcher("foo.desktop", self.get_generic_desktop_content())
 
         self.assertTrue(SettingsMock.list_schemas.called)
@@ -520,7 +698,76 @@ class TestLauncherIcons(LoggedTestCase):
                                                                             "application://baz.desktop",
                                                                             "application://foo.desktop"])
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
+    def test_batch_launcher_pinning(self, SettingsMock):
+        """Launchers created in a batch are all pinned at the end with a single change"""
+        SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
+        self.set_favorites(SettingsMock, ["application://bar.desktop", "unity://running-apps"])
+        with tools.batch_launcher_pinning():
+            create_launcher("foo.desktop", self.get_generic_desktop_content())
+            create_launcher("baz.desktop", self.get_generic_desktop_content())
+            create_launcher("foo.desktop", self.get_generic_desktop_content())
+            self.assertFalse(SettingsMock.return_value.set_strv.called)
+
+        SettingsMock.return_value.set_strv.assert_called_once_with("favorites", ["application://bar.desktop",
+                                                                                 "application://foo.desktop",
+                                                                                 "application://baz.desktop",
+                                                                                 "unity://running-apps"])
+        self.assertTrue(os.path.exists(get_launcher_path("baz.desktop")))
+
+    @patch("umake.tools.sleep")
+    @patch("gi.repository.Gio.Settings")
+    def test_install_retry_lost_launcher_change(self, SettingsMock, sleep_mock):
+        """A launcher favorites change which wasn't applied is made again"""
+        SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
+        SettingsMock.return_value.get_strv.side_effect = [["application://bar.desktop"],
+                                                          ["application://bar.desktop"],
+                                                          ["application://bar.desktop", "application://foo.desktop"]]
+        create_launcher("foo.desktop", self.get_generic_desktop_content())
+
+        self.assertEqual(SettingsMock.return_value.set_strv.call_count, 2)
+        self.assertEqual(sleep_mock.call_count, 1)
+
+    @patch("umake.tools.sleep")
+    @patch("gi.repository.Gio.Settings")
+    def test_install_check_launcher_change_with_new_settings(self, SettingsMock, sleep_mock):
+        """A launcher favorites change is checked with new settings once synced, and not the ones which made it"""
+        SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
+        saved_favorites = [None, ["application://bar.desktop"], ["application://bar.desktop"],
+                           ["application://bar.desktop", "application://foo.desktop"]]
+        gsettings_list = []
+
+        def new_settings(**kwargs):
+            gsettings = Mock()
+            gsettings.get_strv.return_value = saved_favorites[len(gsettings_list)]
+            gsettings_list.append(gsettings)
+            return gsettings
+        SettingsMock.side_effect = new_settings
+        create_launcher("foo.desktop", self.get_generic_desktop_content())
+
+        (writer, *readers) = gsettings_list
+        self.assertEqual(len(readers), 3)
+        self.assertEqual(writer.set_strv.call_args_list, [call("favorites", ["application://bar.desktop",
+                                                                             "application://foo.desktop"])] * 2)
+        self.assertFalse(writer.get_strv.called)
+        for reader in readers:
+            self.assertEqual(reader.get_strv.call_count, 1)
+            self.assertFalse(reader.set_strv.called)
+        self.assertEqual(SettingsMock.sync.call_count, 2)
+
+    @patch("umake.tools.sleep")
+    @patch("gi.repository.Gio.Settings")
+    def test_install_launcher_change_never_applied(self, SettingsMock, sleep_mock):
+        """We give up pinning after some attempts, still installing the launcher file"""
+        SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
+        SettingsMock.return_value.get_strv.return_value = ["application://bar.desktop"]
+        create_launcher("foo.desktop", self.get_generic_desktop_content())
+
+        self.assertEqual(SettingsMock.return_value.set_strv.call_count, tools.LAUNCHER_PIN_ATTEMPTS)
+        self.assertTrue(os.path.exists(get_launcher_path("foo.desktop")))
+        self.expect_warn_error = True
+
+    @patch("gi.repository.Gio.Settings")
     def test_can_install_already_in_launcher(self, SettingsMock):
         """A file listed in launcher still install the files, but the entry isn't changed"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
@@ -531,7 +778,7 @@ class TestLauncherIcons(LoggedTestCase):
         self.assertFalse(SettingsMock.return_value.set_strv.called)
         self.assertTrue(os.path.exists(get_launcher_path("foo.desktop")))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_install_no_schema_file(self, SettingsMock):
         """No schema file still installs the file"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "baz"]
@@ -541,7 +788,7 @@ class TestLauncherIcons(LoggedTestCase):
         self.assertFalse(SettingsMock.return_value.set_strv.called)
         self.assertTrue(os.path.exists(get_launcher_path("foo.desktop")))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_already_existing_file_different_content(self, SettingsMock):
         """A file with a different file content already exists and is updated"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "baz"]
@@ -550,7 +797,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertEqual(open(result_file).read(), self.get_generic_desktop_content())
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_create_launcher_without_xdg_dir(self, SettingsMock):
         """Save a new launcher in an unexisting directory"""
         shutil.rmtree(self.local_dir)
@@ -568,7 +815,7 @@ class TestLauncherIcons(LoggedTestCase):
         """Launcher file doesn't exists"""
         self.assertFalse(launcher_exists("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_exists_and_is_pinned(self, SettingsMock):
         """Launcher exists and is pinned if the file exists and is in favorites list"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
@@ -578,7 +825,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertTrue(launcher_exists_and_is_pinned("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_isnt_pinned(self, SettingsMock):
         """Launcher doesn't exists and is pinned if the file exists but not in favorites list"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
@@ -587,7 +834,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertFalse(launcher_exists_and_is_pinned("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_exists_but_isnt_pinned_in_none_unity(self, SettingsMock):
         """Launcher exists return True if file exists, not pinned but not in Unity"""
         os.environ["XDG_CURRENT_DESKTOP"] = "FOOenv"
@@ -597,7 +844,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertTrue(launcher_exists_and_is_pinned("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_exists_but_not_schema_in_none_unity(self, SettingsMock):
         """Launcher exists return True if file exists, even if Unity schema isn't installed"""
         os.environ["XDG_CURRENT_DESKTOP"] = "FOOenv"
@@ -606,7 +853,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertTrue(launcher_exists_and_is_pinned("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_exists_but_not_schema_in_unity(self, SettingsMock):
         """Launcher exists return False if file exists, but no Unity schema installed"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "baz"]
@@ -614,7 +861,7 @@ class TestLauncherIcons(LoggedTestCase):
 
         self.assertFalse(launcher_exists_and_is_pinned("foo.desktop"))
 
-    @patch("umake.tools.Gio.Settings")
+    @patch("gi.repository.Gio.Settings")
     def test_launcher_doesnt_exists_but_pinned(self, SettingsMock):
         """Launcher doesn't exist if no file, even if pinned"""
         SettingsMock.list_schemas.return_value = ["foo", "bar", "com.canonical.Unity.Launcher", "baz"]
@@ -752,6 +999,18 @@ class TestMiscTools(LoggedTestCase):
                                           "\ncontent content"),
                          "content content content contentcontent\n content\ncontent content")
 
+    def test_load_first_json_element(self):
+        """We only decode the first element of a json array"""
+        self.assertEqual(tools.load_first_json_element(' [\n {"name": "first", "assets": [1, 2]}, {"name": "second"}]'),
+                         {"name": "first", "assets": [1, 2]})
+        # the following elements aren't decoded
+        self.assertEqual(tools.load_first_json_element('["first", {invalid'), "first")
+
+    def test_load_first_json_element_not_array(self):
+        """We raise a decode error if the json isn't a non empty array"""
+        for content in ('{"message": "Not Found"}', '[]', ''):
+            self.assertRaises(json.JSONDecodeError, tools.load_first_json_element, content)
+
     def test_raise_inputerror(self):
         def foo():
             raise tools.InputError("Foo bar")
@@ -1122,6 +1381,49 @@ class TestUserENV(LoggedTestCase):
         profile_content = open(profile_file).read()
         self.assertEqual(profile_content, "Foo\nBar\nexport BAR=baz")
 
+    @patch("umake.tools.os.path.expanduser")
+    def test_batch_user_env_changes(self, expanderusermock):
+        """Env changes in a batch are only written once at the end, with the latest content per framework"""
+        expanderusermock.return_value = self.local_dir
+        profile_file = os.path.join(self.local_dir, ".profile")
+        open(profile_file, 'w').write("Foo\nBar\n# Ubuntu make installation of framework A\nexport FOO=bar\n\n")
+        with tools.batch_shell_profile_changes():
+            tools.add_env_to_user("framework B", {"BAR": {"value": "/tmp/bar", "keep": False}})
+            tools.add_env_to_user("framework B", {"BAR": {"value": "/tmp/baz", "keep": False}})
+            tools.remove_framework_envs_from_user("framework A")
+            self.assertEqual(open(profile_file).read(),
+                             "Foo\nBar\n# Ubuntu make installation of framework A\nexport FOO=bar\n\n")
+
+        self.assertEqual(open(profile_file).read(),
+                         "Foo\nBar\n# Ubuntu make installation of framework B\nexport BAR=/tmp/baz\n\n")
+
+    @patch("umake.tools.os.path.expanduser")
+    def test_add_user_env_symlinked_profile(self, expanderusermock):
+        """Env changes are written through a symlinked profile, keeping its mode"""
+        expanderusermock.return_value = self.local_dir
+        profile_file = os.path.join(self.local_dir, ".profile")
+        target_file = os.path.join(self.local_dir, "dotfiles-profile")
+        open(target_file, 'w').write("Foo\n")
+        os.chmod(target_file, 0o600)
+        os.symlink(target_file, profile_file)
+        tools.add_env_to_user("framework A", {"FOO": {"value": "bar", "keep": False}})
+
+        self.assertTrue(os.path.islink(profile_file))
+        self.assertEqual(open(target_file).read(), "Foo\n# Ubuntu make installation of framework A\nexport FOO=bar\n\n")
+        self.assertEqual(stat.S_IMODE(os.stat(target_file).st_mode), 0o600)
+
+    @patch("umake.tools.os.path.expanduser")
+    def test_remove_user_env_many_frameworks(self, expanderusermock):
+        """Remove an env from a profile with many frameworks blocks"""
+        expanderusermock.return_value = self.local_dir
+        profile_file = os.path.join(self.local_dir, ".profile")
+        blocks = ["# Ubuntu make installation of framework {}\nexport FOO{}=bar\n\n".format(i, i) for i in range(500)]
+        open(profile_file, 'w').write("Foo\n" + "".join(blocks))
+        tools.remove_framework_envs_from_user("framework 42")
+
+        del blocks[42]
+        self.assertEqual(open(profile_file).read(), "Foo\n" + "".join(blocks))
+
     @patch("umake.tools.os.path.expanduser")
     def test_remove_user_multiple_same_framework(self, expanderusermock):
         """Remove an env from a user setup, same framework being repeated multiple times"""
@@ -87,6 +87,17 @@ class TestUI(LoggedTestCase):
         UI.return_main_screen()
         self.assertTrue(self.mockUIPlug._return_main_screen.called)
 
+    @patch("umake.settings.get_latest_version")
+    @patch("umake.ui.get_cached_latest_version")
+    def test_return_to_mainscreen_on_error_without_network(self, get_cached_latest_version_mock,
+                                                           get_latest_version_mock):
+        """We only use the cached latest version when returning to main screen on error"""
+        get_cached_latest_version_mock.return_value = None
+        UI.return_main_screen(status_code=1)
+        self.assertTrue(get_cached_latest_version_mock.called)
+        self.assertFalse(get_latest_version_mock.called)
+        self.mockUIPlug._return_main_screen.assert_called_once_with(status_code=1)
+
     @patch("umake.tools.sys")
     def test_call_display(self, mocksys):
         """We call the display method from the UIPlug"""
@@ -24,13 +24,10 @@ import gettext
 from gettext import gettext as _
 import locale
 import logging
-import logging.config
 import os
 import sys
-from umake.frameworks import load_frameworks
-from umake.tools import MainLoop
-from .ui import cli
-import yaml
+from umake.settings import get_version, start_latest_version_check
+from umake.tools import is_completion_mode
 
 logger = logging.getLogger(__name__)
 
@@ -67,9 +64,11 @@ def _setup_logging(env_key='LOG_CFG', level=_default_log_level):
         requests_log.propagate = True
     if level == _default_log_level:
         if os.path.exists(path):
+            from logging.config import dictConfig
+            import yaml
             with open(path, 'rt') as f:
                 config = yaml.load(f.read())
-            logging.config.dictConfig(config)
+            dictConfig(config)
     logging.info("Logging level set to {}".format(logging.getLevelName(logging.root.getEffectiveLevel())))
 
 
@@ -103,6 +102,17 @@ def should_load_all_frameworks(args):
     return False
 
 
+def should_list_installed_as_json(args):
+    """Return if we only print installed frameworks as JSON, which doesn't need loading any framework"""
+    return "--list-installed" in args[1:] and "--json" in args[1:]
+
+
+def should_only_print_version(args):
+    """Return if we only print the version, which doesn't need loading any framework"""
+    other_args = [arg for arg in args[1:] if arg not in ["--version", "--verbose"] and not arg.startswith("-v")]
+    return "--version" in args[1:] and not other_args
+
+
 class _HelpAction(argparse._HelpAction):
 
     def __call__(self, parser, namespace, values, option_string=None):
@@ -139,16 +149,46 @@ def main():
     list_group.add_argument('-l', '--list', action="store_true", help=_("List all frameworks"))
     list_group.add_argument('--list-installed', action="store_true", help=_("List installed frameworks"))
     list_group.add_argument('--list-available', action="store_true", help=_("List installable frameworks"))
+    parser.add_argument('--json', action="store_true",
+                        help=_("With --list-installed, print installed frameworks as JSON without loading them"))
+
+    update_group = parser.add_argument_group("Update frameworks").add_mutually_exclusive_group()
+    update_group.add_argument('--outdated', action="store_true",
+                              help=_("List installed frameworks which changed upstream, without downloading them"))
+    update_group.add_argument('--upgrade-all', dest="upgrade_all", action="store_true",
+                              help=_("Reinstall installed frameworks which changed upstream"))
 
     parser.add_argument('--version', action="store_true", help=_("Print version and exit"))
 
     # set logging ignoring unknown options
     set_logging_from_args(sys.argv, parser)
 
+    # answer shell completion from the frameworks registry, without loading any framework, if possible
+    if is_completion_mode():
+        from umake import completion
+        completion.autocomplete(parser)
+
+    if should_list_installed_as_json(sys.argv):
+        from umake import inventory
+        inventory.dump_installed_frameworks(sys.stdout)
+        sys.exit(0)
+
+    if should_only_print_version(sys.argv):
+        print(get_version())
+        sys.exit(0)
+
+    from umake.frameworks import load_frameworks
+    from umake.tools import MainLoop
+    from umake.ui import cli
+
     mainloop = MainLoop()
 
+    # refresh the latest available version in background, reported only if we fail
+    if not is_completion_mode():
+        start_latest_version_check()
+
     # load frameworks
-    load_frameworks(force_loading=should_load_all_frameworks(sys.argv))
+    load_frameworks(force_loading=should_load_all_frameworks(sys.argv), args=sys.argv[1:])
 
     # initialize parser
     cli.main(parser)
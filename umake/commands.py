@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Commands acting on multiple frameworks at once
+
+Their parsers are shared by the command line interface and shell completion, so this doesn't import any framework."""
+
+import argparse
+from gettext import gettext as _
+from umake import lockfile
+
+BATCH_INSTALL_COMMAND = "install"
+LOCK_COMMAND = "lock"
+
+
+def install_batch_install_parser(parser, frameworks_completer=None):
+    """Install the command parser to install multiple frameworks at once
+
+    frameworks_completer is the shell completer of the frameworks to install, if any."""
+    batch_parser = parser.add_parser(BATCH_INSTALL_COMMAND, help=_("Install multiple frameworks at once"))
+    batch_parser.add_argument('-f', '--from-file', dest="from_file",
+                              help=_("Install frameworks listed in this file, with their options as on the command "
+                                     "line, one or more per line"))
+    batch_parser.add_argument('--from-lock', dest="from_lock",
+                              help=_("Install the exact downloads recorded in this lock file, without fetching the "
+                                     "frameworks download pages"))
+    batch_parser.add_argument('--accept-license', dest="accept_license", action="store_true",
+                              help=_("Accept licenses of all frameworks without prompting"))
+    frameworks_argument = batch_parser.add_argument(
+        'frameworks', nargs=argparse.REMAINDER,
+        help=_("Categories, each optionally followed by a framework name and its options"))
+    if frameworks_completer is not None:
+        frameworks_argument.completer = frameworks_completer
+    return batch_parser
+
+
+def install_lock_parser(parser, frameworks_completer=None):
+    """Install the command parser to lock the download urls and checksums of multiple frameworks
+
+    frameworks_completer is the shell completer of the frameworks to lock, if any."""
+    lock_parser = parser.add_parser(LOCK_COMMAND, help=_("Record download urls and checksums of frameworks in a lock "
+                                                         "file, to install them later with install --from-lock"))
+    lock_parser.add_argument('-f', '--from-file', dest="from_file",
+                             help=_("Lock frameworks listed in this file, with their options as on the command "
+                                    "line, one or more per line"))
+    lock_parser.add_argument('-o', '--output', dest="output", default=lockfile.DEFAULT_LOCK_FILENAME,
+                             help=_("Lock file to write (default: {})").format(lockfile.DEFAULT_LOCK_FILENAME))
+    frameworks_argument = lock_parser.add_argument(
+        'frameworks', nargs=argparse.REMAINDER,
+        help=_("Categories, each optionally followed by a framework name and its options"))
+    if frameworks_completer is not None:
+        frameworks_argument.completer = frameworks_completer
+    lock_parser.set_defaults(from_lock=None, accept_license=False)
+    return lock_parser
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Shell completion answered from the frameworks registry
+
+This doesn't load any framework, nor import apt, GLib or network modules, as we need to be quick."""
+
+import argcomplete
+from functools import partial
+import logging
+import os
+from umake import commands, registry
+from umake.tools import ConfigHandler, get_user_frameworks_path
+
+logger = logging.getLogger(__name__)
+
+
+def _is_installed(config, category_name, framework_name):
+    """Return if the framework is installed according to the configuration"""
+    try:
+        return os.path.isdir(config["frameworks"][category_name][framework_name]["path"])
+    except (TypeError, KeyError, FileNotFoundError):
+        return False
+
+
+def _complete_frameworks(categories, prefix, parsed_args, **kwargs):
+    """Complete the categories and frameworks to install in one command from the registry categories
+
+    Frameworks of a category are only completed right after its name."""
+    previous_arg = parsed_args.frameworks[-1] if parsed_args.frameworks else None
+    names = []
+    for category_name, category in categories.items():
+        frameworks_names = [framework_name for framework_name, framework in category["frameworks"].items()
+                            if not framework["only_for_removal"]]
+        if category["is_main_category"]:
+            names.extend(frameworks_names)
+        elif frameworks_names:
+            names.append(category_name)
+            if category_name == previous_arg:
+                names.extend(frameworks_names)
+    return [name for name in names if name.startswith(prefix)]
+
+
+def install_completion_parser(parser, categories):
+    """Install categories, frameworks and commands parsers from the registry categories"""
+    categories_parser = parser.add_subparsers(help='Developer environment', dest="category")
+    config = None
+    for category_name, category in categories.items():
+        frameworks = {}
+        for framework_name, framework in category["frameworks"].items():
+            # only show it in shell completion if it was already installed
+            if framework["only_for_removal"]:
+                if config is None:
+                    config = ConfigHandler().config
+                if not _is_installed(config, category_name, framework_name):
+                    continue
+            frameworks[framework_name] = framework
+        if not frameworks:
+            continue
+        # framework parser is directly category parser
+        if category["is_main_category"]:
+            framework_parser = categories_parser
+        else:
+            category_parser = categories_parser.add_parser(category_name, help=category["description"])
+            framework_parser = category_parser.add_subparsers(dest="framework")
+        for framework_name, framework in frameworks.items():
+            this_framework_parser = framework_parser.add_parser(framework_name, help=framework["description"])
+            registry.add_parser_arguments(this_framework_parser, framework["arguments"])
+    frameworks_completer = partial(_complete_frameworks, categories)
+    commands.install_batch_install_parser(categories_parser, frameworks_completer)
+    commands.install_lock_parser(categories_parser, frameworks_completer)
+
+
+def autocomplete(parser, **kwargs):
+    """Answer shell completion from the frameworks registry
+
+    This exits the process once done. Return False if the registry isn't available or outdated, so that the caller
+    can fallback to loading all frameworks (which will refresh the registry).
+    kwargs are passed to argcomplete."""
+    frameworks_registry = registry.load_current(get_user_frameworks_path())
+    if frameworks_registry is None:
+        logger.debug("No valid frameworks registry for shell completion")
+        return False
+    install_completion_parser(parser, frameworks_registry["categories"])
+    argcomplete.autocomplete(parser, **kwargs)
+    return True
@@ -19,6 +19,8 @@
 
 from collections import namedtuple
 from concurrent import futures
+from contextlib import suppress
+from functools import partial
 from glob import glob
 import logging
 import os
@@ -27,6 +29,7 @@ import stat
 import subprocess
 import tarfile
 import tempfile
+from threading import Lock
 import zipfile
 
 
@@ -51,7 +54,22 @@ class Decompressor:
             os.chmod(targetpath, mode)
             return targetpath
 
-    def __init__(self, orders, on_done):
+    class _ReadReporter:
+        """Wrap a file object to report how many bytes were read from it"""
+
+        def __init__(self, fd, on_read):
+            self._fd = fd
+            self._on_read = on_read
+
+        def read(self, size=-1):
+            data = self._fd.read(size)
+            self._on_read(len(data))
+            return data
+
+        def __getattr__(self, name):
+            return getattr(self._fd, name)
+
+    def __init__(self, orders, on_done, report=lambda x: None):
         """Decompress all fds in threads and send on_done callback once finished
 
 
@@ -68,10 +86,24 @@ class Decompressor:
             "fd":
                 DecompressResult(error=optional error if anything went wrong"
         }
+
+        report, if not None, will be called each time a decompression progresses by at least a percent or finishes,
+        reporting a dict of current decompressions with current/size parameters in bytes:
+        {
+            "fd": {"current": read size, "size": archive size}
+        }
         """
         self._orders = orders
         self._decompressed = {}
         self._done_callback = on_done
+        self._wired_report = report
+        self._progress_lock = Lock()
+        self._decompress_progress = {}
+        for fd in orders:
+            size = 0
+            with suppress(AttributeError, OSError):
+                size = os.fstat(fd.fileno()).st_size - fd.tell()
+            self._decompress_progress[fd] = {"current": 0, "size": size}
 
         executor = futures.ThreadPoolExecutor(max_workers=3)
         for fd in orders:
@@ -95,7 +127,7 @@ class Decompressor:
         try:
             try:
                 # the fd isn't forcibly at position 0 (like in Unity3D where we offset the script part)
-                archive = tarfile.open(fileobj=fd, mode='r|*')
+                archive = tarfile.open(fileobj=self._ReadReporter(fd, partial(self._report_read, fd)), mode='r|*')
                 logger.debug("tar file")
             except tarfile.ReadError:
                 archive = self.ZipFileWithPerm(fd.name)
@@ -137,6 +169,23 @@ class Decompressor:
             shutil.move(os.path.join(dir_path, filename), os.path.join(dest, filename))
         shutil.rmtree(tempdest)
 
+    def _report_read(self, fd, read_size):
+        """Report decompression progress of fd, only when it progressed by at least a percent"""
+        with self._progress_lock:
+            progress = self._decompress_progress[fd]
+            if not progress["size"]:
+                return
+            previous_percentage = progress["current"] * 100 // progress["size"]
+            progress["current"] = min(progress["current"] + read_size, progress["size"])
+            if progress["current"] * 100 // progress["size"] == previous_percentage:
+                return
+            decompress_progress = self._get_progress_snapshot()
+        self._wired_report(decompress_progress)
+
+    def _get_progress_snapshot(self):
+        """Return a copy of current decompressions progress, as it's updated from multiple threads"""
+        return {fd: dict(fd_progress) for fd, fd_progress in self._decompress_progress.items()}
+
     def _one_done(self, future):
         """Callback that will be called once one decompress finishes.
 
@@ -150,6 +199,11 @@ class Decompressor:
             result = result._replace(error=str(future.exception()))
 
         logger.info("Decompression to {} finished".format(future.tag_dest))
+        with self._progress_lock:
+            progress = self._decompress_progress[future.tag_fd]
+            progress["current"] = progress["size"]
+            decompress_progress = self._get_progress_snapshot()
+        self._wired_report(decompress_progress)
         self._decompressed[future.tag_fd] = result
         if len(self._orders) == len(self._decompressed):
             self._done()
@@ -21,24 +21,31 @@
 """Base Handling functions and base class of backends"""
 
 import abc
+import argparse
+from concurrent import futures
 from contextlib import suppress
 from gettext import gettext as _
 from importlib import import_module, reload
 import inspect
 import logging
 import os
-import pkgutil
 import sys
 import subprocess
+from umake.interactions import DisplayMessage
 from umake.network.requirements_handler import RequirementsHandler
-from umake.settings import DEFAULT_INSTALL_TOOLS_PATH, UMAKE_FRAMEWORKS_ENVIRON_VARIABLE, DEFAULT_BINARY_LINK_PATH
+from umake import registry
+from umake.settings import DEFAULT_INSTALL_TOOLS_PATH, DEFAULT_BINARY_LINK_PATH
 from umake.tools import ConfigHandler, NoneDict, classproperty, get_current_arch, get_current_distro_version,\
-    is_completion_mode, switch_to_current_user, MainLoop, get_user_frameworks_path, get_current_distro_id
+    get_foreign_archs, is_completion_mode, switch_to_current_user, MainLoop, get_user_frameworks_path,\
+    get_current_distro_id
 from umake.ui import UI
 
 
 logger = logging.getLogger(__name__)
 
+# number of frameworks installed and installable states evaluated in parallel when listing them
+LIST_FRAMEWORKS_WORKERS = 8
+
 
 class BaseCategory():
     """Base Category class to be inherited"""
@@ -91,10 +98,14 @@ class BaseCategory():
     @property
     def is_installed(self):
         """Return if the category is installed"""
-        installed_frameworks = [framework for framework in self.frameworks.values() if framework.is_installed]
-        if len(installed_frameworks) == 0:
+        return self.get_installed_state([framework.is_installed for framework in self.frameworks.values()])
+
+    def get_installed_state(self, frameworks_installed):
+        """Return category installed state from the list of its frameworks installed state"""
+        installed_count = len([installed for installed in frameworks_installed if installed])
+        if installed_count == 0:
             return self.NOT_INSTALLED
-        if len(installed_frameworks) == len(self.frameworks):
+        if installed_count == len(self.frameworks):
             return self.FULLY_INSTALLED
         return self.PARTIALLY_INSTALLED
 
@@ -271,18 +282,32 @@ class BaseFramework(metaclass=abc.ABCMeta):
             UI.return_main_screen(status_code=2)
 
     def mark_in_config(self):
-        """Mark the installation as installed in the config file"""
-        config = ConfigHandler().config
-        config.setdefault("frameworks", {})\
-              .setdefault(self.category.prog_name, {})\
-              .setdefault(self.prog_name, {})["path"] = self.install_path
-        ConfigHandler().config = config
+        """Mark the installation as installed in the config file, with its installed metadata"""
+        def mark(config):
+            framework_config = config.setdefault("frameworks", {})\
+                                     .setdefault(self.category.prog_name, {})\
+                                     .setdefault(self.prog_name, {})
+            framework_config["path"] = self.install_path
+            framework_config.update(self.get_installed_metadata())
+        ConfigHandler().update(mark)
+
+    def get_installed_metadata(self):
+        """Return what identifies the installed version, to save in the config file"""
+        return {}
+
+    def get_installed_config(self):
+        """Return the config of this framework saved at installation time, empty if there is none"""
+        try:
+            return ConfigHandler().config["frameworks"][self.category.prog_name][self.prog_name]
+        except (TypeError, KeyError):
+            return {}
 
     def remove_from_config(self):
         """Remove current framework from config"""
-        config = ConfigHandler().config
-        del(config["frameworks"][self.category.prog_name][self.prog_name])
-        ConfigHandler().config = config
+        def remove(config):
+            with suppress(KeyError):
+                del(config["frameworks"][self.category.prog_name][self.prog_name])
+        ConfigHandler().update(remove)
 
     @property
     def is_installed(self):
@@ -293,6 +318,19 @@ class BaseFramework(metaclass=abc.ABCMeta):
             return False
         return True
 
+    def display_requirements_plan(self):
+        """Display what installing the packages requirements would need, without installing anything"""
+        plan = RequirementsHandler().plan_bucket(self.packages_requirements)
+        if plan.packages_count == 0:
+            message = _("All package requirements for {} are already installed").format(self.name)
+        else:
+            message = _("{} requires {} package(s) to be installed or upgraded: {:.1f} MB to download, "
+                        "{:.1f} MB of additional disk space").format(self.name, plan.packages_count,
+                                                                     plan.download_size / 1024 / 1024,
+                                                                     plan.installed_size / 1024 / 1024)
+        UI.display(DisplayMessage(message))
+        UI.return_main_screen()
+
     def install_framework_parser(self, parser):
         """Install framework parser"""
         this_framework_parser = parser.add_parser(self.prog_name, help=self.description)
@@ -302,6 +340,8 @@ class BaseFramework(metaclass=abc.ABCMeta):
                                            help=_("Remove framework if installed"))
         this_framework_parser.add_argument('--dry-run', dest="dry_run", action="store_true",
                                            help=_("Fetch only the url, then exit."))
+        this_framework_parser.add_argument('--plan', dest="plan", action="store_true",
+                                           help=_("Show the packages requirements to download and install, then exit."))
 
         if self.expect_license:
             this_framework_parser.add_argument('--accept-license', dest="accept_license", action="store_true",
@@ -317,6 +357,8 @@ class BaseFramework(metaclass=abc.ABCMeta):
                 logger.error(message)
                 UI.return_main_screen(status_code=2)
             self.remove()
+        elif args.plan:
+            self.display_requirements_plan()
         else:
             install_path = None
             auto_accept_license = False
@@ -347,7 +389,10 @@ def _is_frameworkclass(o):
     return inspect.isclass(o) and issubclass(o, BaseFramework) and not inspect.isabstract(o)
 
 
-def load_module(module_abs_name, main_category, force_loading):
+def load_module(module_abs_name, main_category, force_loading, framework_class_name=None):
+    """Load a frameworks module and its category
+
+    If framework_class_name is set, only this framework of the module is instantiated."""
     logger.debug("New framework module: {}".format(module_abs_name))
     if module_abs_name not in sys.modules:
         import_module(module_abs_name)
@@ -362,10 +407,31 @@ def load_module(module_abs_name, main_category, force_loading):
     if current_category not in BaseCategory.categories.values():
         return
     for framework_name, FrameworkClass in inspect.getmembers(module, _is_frameworkclass):
+        if framework_class_name is not None and framework_name != framework_class_name:
+            continue
         if FrameworkClass(category=current_category, force_loading=force_loading) is not None:
             logger.debug("Attach framework {} to {}".format(framework_name, current_category.name))
 
 
+def _get_frameworks_state(frameworks):
+    """Return a dict of framework: (is_installed, is_installable), evaluated in parallel
+
+    Those are mostly waiting on the filesystem, so we check all frameworks concurrently. The apt cache can only be
+    queried by one thread at a time: all requirements are evaluated once upfront, and threads only read them."""
+    # warm up shared platform facts and requirements handler caches once, before threads race to create them
+    with suppress(BaseException):
+        get_current_arch()
+        get_foreign_archs()
+        get_current_distro_id()
+
+    def get_state(framework):
+        return (framework.is_installed, framework.is_installable)
+
+    with RequirementsHandler().buckets_states_snapshot([framework.packages_requirements for framework in frameworks]):
+        with futures.ThreadPoolExecutor(max_workers=LIST_FRAMEWORKS_WORKERS) as executor:
+            return dict(zip(frameworks, executor.map(get_state, frameworks)))
+
+
 def list_frameworks():
     """ Return frameworks and categories description as:
         [
@@ -390,16 +456,19 @@ def list_frameworks():
             },
         ]
     """
+    frameworks_state = _get_frameworks_state([framework for category in BaseCategory.categories.values()
+                                              for framework in category.frameworks.values()])
     categories_dict = list()
     for category in BaseCategory.categories.values():
         frameworks_dict = list()
         for framework in category.frameworks.values():
+            (is_installed, is_installable) = frameworks_state[framework]
             new_fram = {
                 "framework_name": framework.prog_name,
                 "framework_description": framework.description,
                 "install_path": framework.install_path,
-                "is_installed": framework.is_installed,
-                "is_installable": framework.is_installable,
+                "is_installed": is_installed,
+                "is_installable": is_installable,
                 "is_category_default": framework.is_category_default,
                 "only_for_removal": framework.only_for_removal
             }
@@ -409,7 +478,8 @@ def list_frameworks():
         new_cat = {
             "category_name": category.prog_name,
             "category_description": category.description,
-            "is_installed": category.is_installed,
+            "is_installed": category.get_installed_state([frameworks_state[framework][0]
+                                                          for framework in category.frameworks.values()]),
             "frameworks": frameworks_dict
         }
 
@@ -418,23 +488,68 @@ def list_frameworks():
     return categories_dict
 
 
-def load_frameworks(force_loading=False, load_user_frameworks=True):
-    """Load all modules and assign to correct category"""
+def _get_registry_categories():
+    """Return loaded categories and frameworks description for the registry"""
+    categories = {}
+    for category in BaseCategory.categories.values():
+        frameworks = {}
+        for framework in category.frameworks.values():
+            frameworks[framework.prog_name] = {
+                "module": type(framework).__module__,
+                "class": type(framework).__name__,
+                "description": framework.description,
+                "is_category_default": framework.is_category_default,
+                "only_for_removal": framework.only_for_removal,
+                "only_on_archs": framework.only_on_archs,
+                "only_ubuntu": framework.only_ubuntu,
+                "only_ubuntu_version": framework.only_ubuntu_version,
+                "required_files_path": getattr(framework, "required_files_path", []),
+                "desktop_filename": getattr(framework, "desktop_filename", None),
+                "arguments": registry.get_parser_arguments(
+                    framework.install_framework_parser(argparse.ArgumentParser().add_subparsers()))
+            }
+        categories[category.prog_name] = {
+            "description": category.description,
+            "is_main_category": category.is_main_category,
+            "frameworks": frameworks
+        }
+    return categories
+
+
+def load_frameworks(force_loading=False, load_user_frameworks=True, args=None):
+    """Load all modules and assign to correct category
+
+    If args (command line arguments) are provided, we use the frameworks registry to only load the module
+    of the targeted framework. If we can't, we load all modules and refresh the registry."""
     main_category = MainCategory()
 
     # Prepare local paths (1. environment path, 2. local path, 3. system paths).
     # If we have duplicated categories, only consider the first loaded one.
-    if load_user_frameworks:
-        local_paths = [get_user_frameworks_path()]
-        sys.path.insert(0, get_user_frameworks_path())
-    environment_path = os.environ.get(UMAKE_FRAMEWORKS_ENVIRON_VARIABLE)
-    if environment_path:
-        sys.path.insert(0, environment_path)
-        local_paths.insert(0, environment_path)
-
-    if load_user_frameworks:
-        for loader, module_name, ispkg in pkgutil.iter_modules(path=local_paths):
-            load_module(module_name, main_category, force_loading)
-    for loader, module_name, ispkg in pkgutil.iter_modules(path=[os.path.dirname(__file__)]):
-        module_name = "{}.{}".format(__package__, module_name)
+    local_paths = registry.get_local_frameworks_paths(get_user_frameworks_path() if load_user_frameworks else None)
+    for path in reversed(local_paths):
+        sys.path.insert(0, path)
+    modules = registry.get_frameworks_modules(os.path.dirname(__file__), __package__, local_paths)
+
+    modules_state = None
+    frameworks_registry = None
+    if args is not None:
+        modules_state = registry.get_modules_state(modules)
+        frameworks_registry = registry.load(modules_state)
+        if frameworks_registry and not force_loading:
+            target = registry.get_targeted_framework(frameworks_registry, args)
+            if target:
+                (category_name, framework_name) = target
+                framework_entry = frameworks_registry["categories"][category_name]["frameworks"][framework_name]
+                logger.debug("Only loading {} from {}".format(framework_entry["class"], framework_entry["module"]))
+                load_module(framework_entry["module"], main_category, force_loading,
+                            framework_class_name=framework_entry["class"])
+                return
+
+    for module_name, module_path in modules:
         load_module(module_name, main_category, force_loading)
+
+    # only force loading registers every framework, even not installable ones: prefer this content
+    if args is not None:
+        categories = _get_registry_categories()
+        if frameworks_registry is None or (force_loading and frameworks_registry["categories"] != categories):
+            registry.save(modules_state, categories)
@@ -21,23 +21,25 @@
 """Downloader abstract module"""
 
 from contextlib import suppress
+from functools import partial
 from gettext import gettext as _
 from io import StringIO
-import gnupg
 import json
 import logging
-from progressbar import ProgressBar
 import os
 import shutil
+from urllib.parse import urlparse
+from xdg import BaseDirectory
 import umake.frameworks
 from umake.decompressor import Decompressor
+from umake import lockfile
 from umake.interactions import InputText, YesNo, LicenseAgreement, DisplayMessage, UnknownProgress
-from umake.network.download_center import DownloadCenter, DownloadItem
+from umake.network.download_center import DownloadCenter, DownloadItem, get_conditional_headers
 from umake.network.requirements_handler import RequirementsHandler
 from umake.ui import UI
-from umake.settings import DEFAULT_INSTALL_TOOLS_PATH
+from umake.settings import CACHE_DIRNAME, DEFAULT_INSTALL_TOOLS_PATH
 from umake.tools import MainLoop, strip_tags, launcher_exists, get_icon_path, get_launcher_path, \
-    Checksum, remove_framework_envs_from_user, add_exec_link
+    Checksum, remove_framework_envs_from_user, add_exec_link, batch_shell_profile_changes, load_first_json_element
 
 logger = logging.getLogger(__name__)
 
@@ -77,7 +79,19 @@ class BaseInstaller(umake.frameworks.BaseFramework):
                 kwargs.pop(extra_arg)
         super().__init__(*args, **kwargs)
 
-        self._install_done = False
+        self._install_progress = None
+        # BatchInstaller installing this framework with others, if any
+        self.batch = None
+        # lock file entry of this framework to install from, if any
+        self.locked_metadata = None
+        # provider page validators (ETag, Last-Modified) when it was last fetched, and when checking if it changed
+        self.download_page_validators = {}
+        self.previous_download_page_validators = None
+        # download request updating the previous installation to the version of download_requests, if any
+        self.delta_download_request = None
+        # download page parsing state while it's being downloaded, if any
+        self._page_parsing = None
+        self._requirements_prefetched = False
         self._paths_to_clean = set()
         self._arg_install_path = None
         self.download_requests = []
@@ -112,6 +126,14 @@ class BaseInstaller(umake.frameworks.BaseFramework):
         if self.dry_run:
             self.download_provider_page()
         elif self.is_installed:
+            if self.batch is not None:
+                if self.batch.reinstall:
+                    logger.debug("Mark previous installation path for cleaning.")
+                    self._paths_to_clean.add(self.install_path)
+                    self.confirm_path(self.arg_install_path)
+                    return
+                self.batch.skip(self, _("{} is already installed on your system, skipping it").format(self.name))
+                return
             UI.display(YesNo("{} is already installed on your system, do you want to reinstall "
                              "it anyway?".format(self.name), self.reinstall, UI.return_main_screen))
         else:
@@ -155,13 +177,32 @@ class BaseInstaller(umake.frameworks.BaseFramework):
         UI.delayed_display(DisplayMessage("Suppression done"))
         UI.return_main_screen()
 
+    @property
+    def use_delta_download(self):
+        """Update the previous installation with the delta download request instead of replacing it"""
+        return self.delta_download_request is not None and self.install_path in self._paths_to_clean
+
+    def get_requests_to_download(self):
+        """Return the download requests to fetch for installing"""
+        if self.use_delta_download:
+            return [self.delta_download_request]
+        return self.download_requests
+
     def set_exec_path(self):
         if self.desktop_filename:
             self.exec_path = os.path.join(self.install_path, self.required_files_path[0])
 
     def confirm_path(self, path_dir=""):
         """Confirm path dir"""
-
+        # we are installing: start fetching the requirements while we are asking questions and parsing the download
+        # page, only once as we can be asked again for the path
+        if not self.dry_run and not self._requirements_prefetched:
+            self._requirements_prefetched = True
+            RequirementsHandler().prefetch_bucket(self.packages_requirements)
+
+        if not path_dir and self.batch is not None:
+            logger.debug("No installation path provided while installing multiple frameworks, use the default one.")
+            path_dir = self.install_path
         if not path_dir:
             logger.debug("No installation path provided. Requesting one.")
             UI.display(InputText("Choose installation path:", self.confirm_path, self.install_path))
@@ -176,6 +217,10 @@ class BaseInstaller(umake.frameworks.BaseFramework):
                         logger.error("This doesn't seem wise. We won't let you shoot in your feet.")
                         self.confirm_path()
                         return
+                    if self.batch is not None:
+                        logger.error("{} isn't an empty directory, can't install {} there while installing multiple "
+                                     "frameworks".format(path_dir, self.name))
+                        UI.return_main_screen(status_code=1)
                     self.install_path = path_dir  # we don't set it before to not repropose / as installation path
                     UI.display(YesNo("{} isn't an empty directory, do you want to remove its content and install "
                                      "there?".format(path_dir), self.set_installdir_to_clean, UI.return_main_screen))
@@ -185,17 +230,108 @@ class BaseInstaller(umake.frameworks.BaseFramework):
             logger.info("Install Path has been overridden to fix an upstream issue.")
             self.install_path += "/" + self.override_install_path
         self.set_exec_path()
-        self.download_provider_page()
+        self.get_metadata()
 
     def set_installdir_to_clean(self):
         logger.debug("Mark non empty new installation path for cleaning.")
         self._paths_to_clean.add(self.install_path)
         self.set_exec_path()
-        self.download_provider_page()
+        self.get_metadata()
+
+    def get_metadata(self):
+        """Get download requests and license from the lock file entry, if any, or from the provider page"""
+        if self.locked_metadata is not None:
+            self.use_locked_metadata()
+        else:
+            self.download_provider_page()
+
+    @MainLoop.in_mainloop_thread
+    def use_locked_metadata(self):
+        """Take the resolved download requests from the lock file entry instead of parsing the provider page"""
+        logger.debug("Use locked download metadata")
+        self.download_requests = lockfile.get_download_requests(self.locked_metadata)
+        self.dir_to_decompress_in_tarball = self.locked_metadata["dir_to_decompress_in_tarball"]
+        self.required_files_path = self.locked_metadata["required_files_path"]
+        self.set_exec_path()
+        self.batch.metadata_ready(self, self.locked_metadata["license"] or "")
 
     def download_provider_page(self):
         logger.debug("Download application provider page")
-        DownloadCenter([DownloadItem(self.download_page)], self.get_metadata_and_check_license, download=False)
+        headers = None
+        if self.previous_download_page_validators:
+            # only get the page if it changed since installed
+            headers = get_conditional_headers(self.previous_download_page_validators)
+        if self.is_github_listing() and urlparse(self.download_page).path.endswith("/releases") and \
+           "per_page=" not in self.download_page:
+            # we only use the first release of the listing
+            self.download_page += "{}per_page=1".format("&" if "?" in self.download_page else "?")
+        line_reader = None
+        # parse the page while downloading it, unless the framework parses it its own way
+        if not self.json and \
+           type(self).get_metadata_and_check_license is BaseInstaller.get_metadata_and_check_license:
+            self._page_parsing = self._start_page_parsing()
+            line_reader = partial(self._read_page_line, self._page_parsing)
+        DownloadCenter([DownloadItem(self.download_page, headers=headers)], self.get_metadata_and_check_license,
+                       download=False, line_reader=line_reader)
+
+    def is_github_listing(self):
+        """Return if the download page is a github api listing, of which we use the first element"""
+        return self.download_page.startswith("https://api.github.com") and \
+            not urlparse(self.download_page).path.endswith("/latest")
+
+    @staticmethod
+    def get_page_cache_path(cache_filename):
+        """Return the path of a downloaded page cache file"""
+        return os.path.join(BaseDirectory.xdg_cache_home, CACHE_DIRNAME, cache_filename)
+
+    def get_cached_page(self, cache_filename):
+        """Return the cached page content and validators, None if there is none"""
+        try:
+            with open(self.get_page_cache_path(cache_filename), encoding="utf-8") as f:
+                cache = json.load(f)
+            return {"content": cache["content"], "validators": cache["validators"]}
+        except (OSError, ValueError, TypeError, KeyError):
+            logger.debug("No valid cached page in {}".format(cache_filename))
+            return None
+
+    def save_cached_page(self, cache_filename, content, validators):
+        """Save the page content and validators in the cache, to only download it again if it changed"""
+        cache_path = self.get_page_cache_path(cache_filename)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + ".new", "w", encoding="utf-8") as f:
+                json.dump({"content": content, "validators": validators}, f)
+            os.rename(cache_path + ".new", cache_path)
+        except OSError as e:
+            logger.debug("Couldn't save cached page in {}: {}".format(cache_filename, e))
+            with suppress(OSError):
+                os.remove(cache_path + ".new")
+
+    def download_cached_page(self, url, cache_filename, on_done):
+        """Download the url page only if it changed since saved in cache_filename, then call on_done with its content
+
+        The cached content is used if the page can't be downloaded."""
+        cached_page = self.get_cached_page(cache_filename)
+        headers = get_conditional_headers(cached_page["validators"]) if cached_page else None
+        DownloadCenter([DownloadItem(url, headers=headers)],
+                       partial(self._cached_page_downloaded, url, cache_filename, cached_page, on_done), download=False)
+
+    @MainLoop.in_mainloop_thread
+    def _cached_page_downloaded(self, url, cache_filename, cached_page, on_done, result):
+        res = result[url]
+        if res.error:
+            if not cached_page:
+                logger.error("An error occurred while downloading {}: {}".format(url, res.error))
+                UI.return_main_screen(status_code=1)
+            logger.warning("Couldn't download {}, using the cached page: {}".format(url, res.error))
+            content = cached_page["content"]
+        elif res.not_modified:
+            logger.debug("{} didn't change since cached".format(url))
+            content = cached_page["content"]
+        else:
+            content = res.buffer.getvalue().decode('utf-8')
+            self.save_cached_page(cache_filename, content, res.validators)
+        on_done(content)
 
     def parse_license(self, line, license_txt, in_license):
         """Parse license per line, eventually write to license_txt if it's in the license part.
@@ -221,22 +357,31 @@ class BaseInstaller(umake.frameworks.BaseFramework):
             logger.error("An error occurred while downloading {}: {}".format(self.download_page, error_msg))
             UI.return_main_screen(status_code=1)
 
-        self.new_download_url = None
-        self.shasum_read_method = hasattr(self, 'get_sha_and_start_download')
-        with StringIO() as license_txt:
+        page = result[self.download_page]
+        self.download_page_validators = page.validators
+        if page.not_modified:
+            logger.debug("{} didn't change since {} was installed".format(self.download_page, self.name))
+            self.batch.metadata_unchanged(self)
+            return
+
+        # the page may have been parsed while being downloaded
+        page_parsing = self._page_parsing
+        self._page_parsing = None
+        if page_parsing is None:
+            page_parsing = self._start_page_parsing()
+        with page_parsing.license_txt as license_txt:
             url, checksum = (None, None)
-            page = result[self.download_page]
             if self.json is True:
                 logger.debug("Using json parser")
                 try:
-                    latest = json.loads(page.buffer.read().decode())
                     # On a download from github, if the page is not .../releases/latest
                     # we want to download the latest version (beta/development)
-                    # So we get the first element in the json tree.
+                    # So we only decode the first element in the json tree.
                     # In the framework we only change the url and this condition is satisfied.
-                    if self.download_page.startswith("https://api.github.com") and\
-                       not self.download_page.endswith("/latest"):
-                        latest = latest[0]
+                    if self.is_github_listing():
+                        latest = load_first_json_element(page.buffer.read().decode())
+                    else:
+                        latest = json.loads(page.buffer.read().decode())
                     url = None
                     in_download = False
                     (url, in_download) = self.parse_download_link(latest, in_download)
@@ -252,30 +397,15 @@ class BaseInstaller(umake.frameworks.BaseFramework):
                 logger.debug("Found download URL: " + url)
 
             else:
-                in_license = False
-                in_download = False
-                for line in page.buffer:
-                    line_content = line.decode()
-
-                    if self.expect_license and not self.auto_accept_license:
-                        in_license = self.parse_license(line_content, license_txt, in_license)
-
-                    # always take the first valid (url, checksum) if not match_last_link is set to True:
-                    download = None
-                    # if not in_download:
-                    if (url is None or (self.checksum_type and not checksum) or
-                       self.match_last_link) and\
-                       not(self.shasum_read_method and self.new_download_url):
-                        (download, in_download) = self.parse_download_link(line_content, in_download)
-                    if download is not None:
-                        (newurl, new_checksum) = download
-                        url = newurl if newurl is not None else url
-                        checksum = new_checksum if new_checksum is not None else checksum
-                        if url is not None:
-                            if self.checksum_type and checksum:
-                                logger.debug("Found download link for {}, checksum: {}".format(url, checksum))
-                            elif not self.checksum_type:
-                                logger.debug("Found download link for {}".format(url))
+                if not page_parsing.lines_count:
+                    for line in page.buffer:
+                        if self.parse_page_line(page_parsing, line):
+                            break
+                if page_parsing.error:
+                    logger.error("Can't parse the download page {}: {}".format(self.download_page,
+                                                                               page_parsing.error))
+                    UI.return_main_screen(status_code=1)
+                url, checksum = page_parsing.url, page_parsing.checksum
 
             if hasattr(self, 'get_sha_and_start_download'):
                 logger.debug('Run get_sha_and_start_download')
@@ -284,6 +414,90 @@ class BaseInstaller(umake.frameworks.BaseFramework):
             else:
                 self.check_data_and_start_download(url, checksum, license_txt)
 
+    class PageParsing:
+        """State of the download page parsing, line by line"""
+
+        def __init__(self):
+            self.url = None
+            self.checksum = None
+            self.in_license = False
+            self.in_download = False
+            self.license_txt = StringIO()
+            self.lines_count = 0
+            self.done = False
+            self.error = None
+
+    def _start_page_parsing(self):
+        """Return a new download page parsing state, resetting what the parsing sets"""
+        self.new_download_url = None
+        self.shasum_read_method = hasattr(self, 'get_sha_and_start_download')
+        return self.PageParsing()
+
+    def _read_page_line(self, page_parsing, line):
+        """Hand a line of the download page being downloaded to the main loop, which parses it
+
+        Parsers set the framework attributes, so they only run in the main loop. This is called in the download
+        thread: return True once the main loop parsed everything we need from the page."""
+        if page_parsing.done:
+            return True
+        self._parse_read_page_line(page_parsing, line)
+        return False
+
+    @MainLoop.in_mainloop_thread
+    def _parse_read_page_line(self, page_parsing, line):
+        self.parse_page_line(page_parsing, line)
+
+    def parse_page_line(self, page_parsing, line):
+        """Parse one line of the download page, return True once we have everything we need from the page
+
+        A parser failure is set as the page parsing error, and ends it."""
+        page_parsing.lines_count += 1
+        if page_parsing.done:
+            return True
+        try:
+            line_content = line.decode()
+
+            parse_license = self.expect_license and not self.auto_accept_license
+            if parse_license:
+                page_parsing.in_license = self.parse_license(line_content, page_parsing.license_txt,
+                                                             page_parsing.in_license)
+
+            # always take the first valid (url, checksum) if not match_last_link is set to True:
+            download = None
+            if (page_parsing.url is None or (self.checksum_type and not page_parsing.checksum) or
+               self.match_last_link) and\
+               not(self.shasum_read_method and self.new_download_url):
+                (download, page_parsing.in_download) = self.parse_download_link(line_content,
+                                                                                page_parsing.in_download)
+        except Exception as e:
+            logger.debug("Parsing line {} of the download page failed".format(page_parsing.lines_count))
+            page_parsing.error = "{}: {}".format(type(e).__name__, e)
+            page_parsing.done = True
+            return True
+        if download is not None:
+            (newurl, new_checksum) = download
+            page_parsing.url = newurl if newurl is not None else page_parsing.url
+            page_parsing.checksum = new_checksum if new_checksum is not None else page_parsing.checksum
+            if page_parsing.url is not None:
+                if self.checksum_type and page_parsing.checksum:
+                    logger.debug("Found download link for {}, checksum: {}".format(page_parsing.url,
+                                                                                   page_parsing.checksum))
+                elif not self.checksum_type:
+                    logger.debug("Found download link for {}".format(page_parsing.url))
+
+        # stop as soon as we have the download link, checksum and license, unless we want the last link
+        if self.match_last_link:
+            return False
+        found_download = (page_parsing.url is not None and (not self.checksum_type or page_parsing.checksum)) or \
+            bool(self.shasum_read_method and self.new_download_url)
+        found_license = not parse_license or (page_parsing.license_txt.getvalue() != "" and
+                                              not page_parsing.in_license)
+        page_parsing.done = found_download and found_license
+        if page_parsing.done:
+            logger.debug("Found everything needed after {} lines of the download page".format(
+                page_parsing.lines_count))
+        return page_parsing.done
+
     def check_data_and_start_download(self, url=None, checksum=None, license_txt=StringIO()):
         if url is None:
             logger.error("Download page changed its syntax or is not parsable (url missing)")
@@ -294,20 +508,27 @@ class BaseInstaller(umake.frameworks.BaseFramework):
             UI.return_main_screen(status_code=1)
         self.download_requests.append(DownloadItem(url, Checksum(self.checksum_type, checksum)))
 
-        if self.dry_run:
+        # the batch locks the download requests while in dry run
+        if self.dry_run and self.batch is None:
             UI.display(DisplayMessage("Found download URL: " + url))
             if checksum is not None:
                 UI.display(DisplayMessage("Found download checksum: " + checksum))
             UI.return_main_screen(status_code=0)
 
+        if license_txt.getvalue() == "" and self.expect_license and not self.auto_accept_license:
+            logger.error("We were expecting to find a license on the download page, we didn't.")
+            UI.return_main_screen(status_code=1)
+
+        # the batch asks for licenses and downloads once it has the metadata of all of its frameworks
+        if self.batch is not None:
+            self.batch.metadata_ready(self, strip_tags(license_txt.getvalue()).strip())
+            return
+
         if license_txt.getvalue() != "":
             logger.debug("Check license agreement.")
             UI.display(LicenseAgreement(strip_tags(license_txt.getvalue()).strip(),
                                         self.start_download_and_install,
                                         UI.return_main_screen))
-        elif self.expect_license and not self.auto_accept_license:
-            logger.error("We were expecting to find a license on the download page, we didn't.")
-            UI.return_main_screen(status_code=1)
         else:
             self.start_download_and_install()
 
@@ -320,11 +541,21 @@ class BaseInstaller(umake.frameworks.BaseFramework):
         self.result_download = None
         self._download_done_callback_called = False
         UI.display(DisplayMessage("Downloading and installing requirements"))
+        from progressbar import ProgressBar
         self.pbar = ProgressBar().start()
+        self.requirements_plan = None
+        try:
+            self.requirements_plan = RequirementsHandler().plan_bucket(self.packages_requirements)
+            self.pkg_size_download = self.requirements_plan.download_size
+        except SystemError as e:
+            logger.info("Couldn't plan requirements installation, will balance progress while installing: "
+                        "{}".format(e))
         self.pkg_to_install = RequirementsHandler().install_bucket(self.packages_requirements,
                                                                    self.get_progress_requirement,
                                                                    self.requirement_done)
-        DownloadCenter(urls=self.download_requests, on_done=self.download_done, report=self.get_progress_download)
+        self.requests_to_download = self.get_requests_to_download()
+        DownloadCenter(urls=self.requests_to_download, on_done=self.download_done,
+                       report=self.get_progress_download)
 
     @MainLoop.in_mainloop_thread
     def get_progress(self, progress_download, progress_requirement):
@@ -344,6 +575,19 @@ class BaseInstaller(umake.frameworks.BaseFramework):
                 self.last_progress_requirement = 0
                 if self.last_progress_download is None:
                     return
+            elif self.requirements_plan is not None:
+                # we know upfront the requirements cost, only wait for the total download size
+                if self.last_progress_download is None:
+                    return
+                if self.last_progress_requirement is None:
+                    self.last_progress_requirement = 0
+                # unpacking and configuring packages costs roughly as much as their installed size
+                requirement_cost = self.requirements_plan.download_size + self.requirements_plan.installed_size
+                if requirement_cost + self.total_download_size > 0:
+                    self.balance_requirement_download = requirement_cost / (requirement_cost +
+                                                                            self.total_download_size)
+                else:
+                    self.balance_requirement_download = 0
             else:
                 # we only update if we got a progress from both sides
                 if self.last_progress_download is None or self.last_progress_requirement is None:
@@ -369,15 +613,19 @@ class BaseInstaller(umake.frameworks.BaseFramework):
         """Chain up to main get_progress, returning current value between 0 and 100"""
 
         percentage = status["percentage"]
-        # 60% is download, 40% is installing
+        # without a plan, 60% is download, 40% is installing
+        download_share = 0.6
+        if self.requirements_plan is not None and self.requirements_plan.download_size > 0:
+            download_share = self.requirements_plan.download_size / (self.requirements_plan.download_size +
+                                                                     self.requirements_plan.installed_size)
         if status["step"] == RequirementsHandler.STATUS_DOWNLOADING:
             self.pkg_size_download = status["pkg_size_download"]
-            progress = 0.6 * percentage
+            progress = download_share * percentage
         else:
             if self.pkg_size_download == 0:
                 progress = percentage  # no download, only install
             else:
-                progress = 60 + 0.4 * percentage
+                progress = 100 * download_share + (1 - download_share) * percentage
         self.get_progress(None, progress)
 
     def get_progress_download(self, downloads):
@@ -385,7 +633,7 @@ class BaseInstaller(umake.frameworks.BaseFramework):
 
         First call initialize the balance between requirements and download progress"""
         # don't push any progress until we have the total download size
-        if len(downloads) != len(self.download_requests):
+        if len(downloads) != len(self.requests_to_download):
             return
         total_size = 0
         total_current_size = 0
@@ -461,20 +709,62 @@ class BaseInstaller(umake.frameworks.BaseFramework):
             else:
                 decompress_fds[fd] = Decompressor.DecompressOrder(dir=self.dir_to_decompress_in_tarball,
                                                                   dest=self.install_path)
-        Decompressor(decompress_fds, self.decompress_and_install_done)
-        UI.display(UnknownProgress(self.iterate_until_install_done))
-
-    def _check_gpg_signature(gnupgdir, asc_content, sig):
-        """check gpg signature (temporary stock in dir)"""
-        gpg = gnupg.GPG(gnupghome=gnupgdir)
-        imported_keys = gpg.import_keys(asc_content)
-        if imported_keys.count == 0:
-            logger.error("Keys not valid")
-            UI.return_main_screen(status_code=1)
-        verify = gpg.verify(sig)
-        if verify is False:
+        self.display_install_progress()
+        Decompressor(decompress_fds, self.decompress_and_install_done, report=self.get_progress_decompress)
+
+    def display_install_progress(self):
+        """Show the installation progress, shared with other frameworks when installing in a batch"""
+        if self.batch is not None:
+            self._install_progress = self.batch.install_progress
+        else:
+            self._install_progress = UnknownProgress()
+            UI.display(self._install_progress)
+
+    @MainLoop.in_mainloop_thread
+    def get_progress_decompress(self, progress):
+        """Refresh the installation progress only when the decompression progressed"""
+        if not self._install_progress.done:
+            UI.display(self._install_progress)
+
+    def get_installed_metadata(self):
+        """Installed downloads and provider page validators, to know later on if they changed"""
+        return {"downloads": lockfile.get_downloads_lock(self.download_requests),
+                "download_page_validators": self.download_page_validators}
+
+    @staticmethod
+    def update_gpg_keyring(gnupgdir, asc_content, fingerprints):
+        """Import the asc_content keys in the gnupgdir keyring, only keeping the ones pinned by fingerprints
+
+        Return if any pinned key is in the keyring."""
+        import gnupg
+        # don't start any agent lingering on the keyring, no secret key is involved
+        gpg = gnupg.GPG(gnupghome=gnupgdir, options=["--no-autostart"])
+        gpg.import_keys(asc_content)
+        unpinned_keys = [key["fingerprint"] for key in gpg.list_keys() if key["fingerprint"] not in fingerprints]
+        if unpinned_keys:
+            logger.debug("Removing keys which aren't pinned: {}".format(", ".join(unpinned_keys)))
+            gpg.delete_keys(unpinned_keys)
+        if not gpg.list_keys():
+            logger.error("None of the pinned keys is valid")
+            return False
+        return True
+
+    @staticmethod
+    def check_gpg_signature(gnupgdir, sig_path, data_path, fingerprints):
+        """Return if the data_path signature in sig_path is valid and made with one of the fingerprints keys
+
+        The keys are the ones of gnupgdir keyring, the gpg home directory."""
+        import gnupg
+        gpg = gnupg.GPG(gnupghome=gnupgdir, options=["--no-autostart"])
+        with open(sig_path, "rb") as sig:
+            verify = gpg.verify_file(sig, data_path)
+        if not verify.valid:
             logger.error("Signature not valid")
-            UI.return_main_screen(status_code=1)
+            return False
+        if verify.pubkey_fingerprint not in fingerprints:
+            logger.error("Signature made with an unexpected key: {}".format(verify.pubkey_fingerprint))
+            return False
+        return True
 
     def post_install(self):
         """Call the post_install process, like creating a launcher, adding env variables…"""
@@ -482,7 +772,9 @@ class BaseInstaller(umake.frameworks.BaseFramework):
 
     @MainLoop.in_mainloop_thread
     def decompress_and_install_done(self, result):
-        self._install_done = True
+        if self.batch is None:
+            self._install_progress.done = True
+            UI.display(self._install_progress)
         error_detected = False
         for fd in result:
             if result[fd].error:
@@ -492,15 +784,16 @@ class BaseInstaller(umake.frameworks.BaseFramework):
         if error_detected:
             UI.return_main_screen(status_code=1)
 
-        if self.exec_link_name:
-            add_exec_link(self.exec_path, self.exec_link_name)
-        self.post_install()
+        # all env changes of this installation are written at once in the shell profile
+        with batch_shell_profile_changes():
+            if self.exec_link_name:
+                add_exec_link(self.exec_path, self.exec_link_name)
+            self.post_install()
         # Mark as installation done in configuration
         self.mark_in_config()
 
+        if self.batch is not None:
+            self.batch.framework_done(self)
+            return
         UI.delayed_display(DisplayMessage("Installation done"))
         UI.return_main_screen()
-
-    def iterate_until_install_done(self):
-        while not self._install_done:
-            yield
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+
+"""Install multiple frameworks at once"""
+
+import atexit
+from contextlib import ExitStack
+from gettext import gettext as _
+import logging
+from umake import lockfile
+from umake.interactions import DisplayMessage, LicenseAgreement, UnknownProgress
+from umake.network.download_center import DownloadCenter
+from umake.network.requirements_handler import RequirementsHandler
+from umake.settings import BATCH_INSTALL_MAX_PARALLEL_DOWNLOADS
+from umake.tools import ConfigHandler, MainLoop, batch_launcher_pinning, batch_shell_profile_changes
+from umake.ui import UI
+
+logger = logging.getLogger(__name__)
+
+
+class BatchInstaller:
+    """Install a set of frameworks in one go
+
+    Metadata of all frameworks are fetched concurrently. Once we have all of them and their licenses are accepted,
+    their packages requirements are installed as a single bucket while downloading all of them, with a single
+    progress bar. They are then all decompressed and installed in parallel.
+    Installation paths aren't asked for: the default or previous ones are used. Any error stops the whole batch.
+    If a lock path is given, the resolved download requests of all frameworks are saved there instead of installing
+    them. If check_outdated is set, installed frameworks whose download requests changed since installed are reported
+    instead, and reinstalled if upgrade is set too."""
+
+    def __init__(self, frameworks_args, auto_accept_license=False, lock_path=None, check_outdated=False,
+                 upgrade=False, reinstall=False):
+        """frameworks_args is a list of (framework, parsed command line arguments, command line arguments list)
+
+        reinstall installs again frameworks which are already installed instead of skipping them."""
+        self.frameworks_args = frameworks_args
+        self._auto_accept_license = auto_accept_license
+        self._lock_path = lock_path
+        self._check_outdated = check_outdated
+        self._upgrade = upgrade
+        self.reinstall = reinstall
+        self._pending_frameworks = []
+        self._ready_frameworks = []
+        self._unchanged_frameworks = []
+        self._licenses = {}
+        self._licenses_to_accept = []
+        self._installing_frameworks = []
+        self._exit_stack = ExitStack()
+        self.install_progress = UnknownProgress()
+
+    def start(self):
+        """Setup all frameworks, which will report back once they have their metadata or are skipped"""
+        for framework, args, command_line in self.frameworks_args:
+            framework.batch = self
+            self._pending_frameworks.append(framework)
+        for framework, args, command_line in self.frameworks_args:
+            if self._auto_accept_license:
+                args.accept_license = True
+            # only resolve the download requests, without checking installed state nor requiring root
+            args.dry_run = bool(self._lock_path or self._check_outdated)
+            if self._check_outdated:
+                framework.previous_download_page_validators = framework.get_installed_config().get(
+                    "download_page_validators")
+            framework.run_for(args)
+        # every framework may have been skipped
+        self._check_metadata_done()
+
+    def skip(self, framework, message):
+        """Don't install this framework, displaying why"""
+        UI.display(DisplayMessage(message))
+        self._pending_frameworks.remove(framework)
+
+    def metadata_ready(self, framework, license_txt):
+        """Framework download requests are known, with the license text to accept, if any"""
+        self._pending_frameworks.remove(framework)
+        self._ready_frameworks.append(framework)
+        self._licenses[framework] = license_txt
+        if license_txt:
+            self._licenses_to_accept.append((framework, license_txt))
+        self._check_metadata_done()
+
+    def metadata_unchanged(self, framework):
+        """Framework provider page didn't change since installed, so neither its download requests"""
+        self._pending_frameworks.remove(framework)
+        self._unchanged_frameworks.append(framework)
+        self._check_metadata_done()
+
+    def _check_metadata_done(self):
+        if self._pending_frameworks:
+            return
+        if self._check_outdated:
+            self.report_outdated()
+            return
+        if not self._ready_frameworks:
+            UI.display(DisplayMessage(_("Nothing to install")))
+            UI.return_main_screen()
+        if self._lock_path:
+            self.save_lock()
+        self._accept_next_license()
+
+    def report_outdated(self):
+        """Report installed frameworks which changed upstream, and reinstall them from their new download requests
+        if upgrading"""
+        outdated_frameworks_args = []
+        for framework, args, command_line in self.frameworks_args:
+            installed_downloads = framework.get_installed_config().get("downloads")
+            if framework in self._unchanged_frameworks or (installed_downloads and lockfile.is_same_downloads(
+                    installed_downloads, lockfile.get_downloads_lock(framework.download_requests))):
+                UI.display(DisplayMessage(_("{} is up to date").format(framework.name)))
+                continue
+            if installed_downloads:
+                UI.display(DisplayMessage(_("{} has a new version available").format(framework.name)))
+            else:
+                UI.display(DisplayMessage(_("{} installed version is unknown, considering it outdated").format(
+                    framework.name)))
+            framework.locked_metadata = lockfile.get_framework_lock(framework, command_line,
+                                                                    self._licenses[framework])
+            outdated_frameworks_args.append((framework, args, command_line))
+
+        if not self._upgrade or not outdated_frameworks_args:
+            UI.return_main_screen()
+        BatchInstaller(outdated_frameworks_args, auto_accept_license=self._auto_accept_license, reinstall=True).start()
+
+    def save_lock(self):
+        """Save the resolved download requests of all frameworks to the lock file"""
+        frameworks_locks = [lockfile.get_framework_lock(framework, command_line, self._licenses[framework])
+                            for framework, args, command_line in self.frameworks_args]
+        try:
+            lockfile.save(self._lock_path, frameworks_locks)
+        except OSError as e:
+            logger.error("Can't save lock file {}: {}".format(self._lock_path, e))
+            UI.return_main_screen(status_code=1)
+        UI.display(DisplayMessage(_("Locked {} in {}").format(
+            ", ".join(framework.name for framework in self._ready_frameworks), self._lock_path)))
+        UI.return_main_screen()
+
+    def _accept_next_license(self):
+        """Ask for licenses one at a time, then start the installation"""
+        if not self._licenses_to_accept:
+            self.start_download_and_install()
+            return
+        framework, license_txt = self._licenses_to_accept.pop(0)
+        UI.display(DisplayMessage(_("{} license:").format(framework.name)))
+        UI.display(LicenseAgreement(license_txt, self._accept_next_license, UI.return_main_screen))
+
+    def start_download_and_install(self):
+        self.last_progress_download = 0
+        self.last_progress_requirement = 0
+        self.result_requirement = None
+        self.result_download = None
+        self._download_done_callback_called = False
+        bucket = []
+        self.download_requests = []
+        for framework in self._ready_frameworks:
+            bucket.extend(package for package in framework.packages_requirements if package not in bucket)
+            self.download_requests.extend(framework.get_requests_to_download())
+
+        UI.display(DisplayMessage(_("Downloading {} and installing requirements").format(
+            ", ".join(framework.name for framework in self._ready_frameworks))))
+        from progressbar import ProgressBar
+        self.pbar = ProgressBar().start()
+        self.pkg_to_install = RequirementsHandler().install_bucket(bucket, self.get_progress_requirement,
+                                                                   self.requirement_done)
+        DownloadCenter(urls=self.download_requests, on_done=self.download_done, report=self.get_progress_download,
+                       max_parallel=BATCH_INSTALL_MAX_PARALLEL_DOWNLOADS)
+
+    @MainLoop.in_mainloop_thread
+    def get_progress(self, progress_download, progress_requirement):
+        """Global progress info, requirements and downloads weighting the same if there are packages to install"""
+        if progress_download is not None:
+            self.last_progress_download = progress_download
+        if progress_requirement is not None:
+            self.last_progress_requirement = progress_requirement
+        progress = self.last_progress_download
+        if self.pkg_to_install:
+            progress = (self.last_progress_download + self.last_progress_requirement) / 2
+        if not self.pbar.finished:  # drawing is delayed, so ensure we are not done first
+            self.pbar.update(max(0, min(progress, 100)))
+
+    def get_progress_requirement(self, status):
+        """Chain up to main get_progress, downloading and installing packages weighting the same"""
+        if status["step"] == RequirementsHandler.STATUS_DOWNLOADING:
+            self.get_progress(None, status["percentage"] / 2)
+        else:
+            self.get_progress(None, 50 + status["percentage"] / 2)
+
+    def get_progress_download(self, downloads):
+        """Chain up to main get_progress, each download weighting the same as they don't all start at once"""
+        progress = 0
+        for download in downloads.values():
+            if download["size"] > 0:
+                progress += download["current"] / download["size"]
+        self.get_progress(progress / len(self.download_requests) * 100, None)
+
+    def requirement_done(self, result):
+        if not result.error:
+            self.get_progress(None, 100)
+        self.result_requirement = result
+        self.download_and_requirements_done()
+
+    def download_done(self, result):
+        self.result_download = result
+        self.download_and_requirements_done()
+
+    @MainLoop.in_mainloop_thread
+    def download_and_requirements_done(self):
+        # wait for both side to be done
+        if self._download_done_callback_called or (not self.result_download or not self.result_requirement):
+            return
+        self._download_done_callback_called = True
+
+        self.pbar.finish()
+        error_detected = False
+        if self.result_requirement.error:
+            logger.error("Package requirements can't be met: {}".format(self.result_requirement.error))
+            error_detected = True
+        for url in self.result_download:
+            if self.result_download[url].error:
+                logger.error(self.result_download[url].error)
+                error_detected = True
+        if error_detected:
+            UI.return_main_screen(status_code=1)
+
+        # save the config, shell profile and launcher pins at once when every framework is installed, or when
+        # exiting on a failure of any of them
+        self._exit_stack.enter_context(ConfigHandler().batch())
+        self._exit_stack.enter_context(batch_shell_profile_changes())
+        self._exit_stack.enter_context(batch_launcher_pinning())
+        atexit.register(self._exit_stack.close)
+        UI.display(self.install_progress)
+        for framework in self._ready_frameworks:
+            self._installing_frameworks.append(framework)
+            framework.decompress_and_install([self.result_download[download_request.url].fd
+                                              for download_request in framework.get_requests_to_download()])
+
+    def framework_done(self, framework):
+        """Framework is installed and marked in the configuration"""
+        self._installing_frameworks.remove(framework)
+        if self._installing_frameworks:
+            return
+        self.install_progress.done = True
+        UI.display(self.install_progress)
+        atexit.unregister(self._exit_stack.close)
+        self._exit_stack.close()
+
+        UI.delayed_display(DisplayMessage(_("Installation of {} done").format(
+            ", ".join(framework.name for framework in self._ready_frameworks))))
+        UI.return_main_screen()
@@ -21,16 +21,22 @@
 
 """Generic IDE module."""
 from abc import ABCMeta, abstractmethod
+from concurrent import futures
 from contextlib import suppress
+from functools import partial
 from gettext import gettext as _
+import json
 import logging
 import os
 import platform
 import re
 import shutil
+import subprocess
 
 import umake.frameworks.baseinstaller
+from umake.interactions import DisplayMessage
 from umake.network.download_center import DownloadCenter, DownloadItem
+from umake.ui import UI
 from umake.tools import create_launcher, get_application_desktop_file, ChecksumType, MainLoop,\
     get_current_arch, get_current_distro_version
 
@@ -198,17 +204,25 @@ class EclipseCPP(BaseEclipse):
 class BaseJetBrains(umake.frameworks.baseinstaller.BaseInstaller, metaclass=ABCMeta):
     """The base for all JetBrains installers."""
 
+    # only the latest release of each product, with its patches from previous builds
+    RELEASES_URL = "https://data.services.jetbrains.com/products/releases?code={}&latest=true"
+    # update patches of all JetBrains IDEs are applied there
+    patch_executor = futures.ThreadPoolExecutor(max_workers=3)
+
     def __init__(self, *args, **kwargs):
         """Add executable required file path to existing list"""
         if self.executable:
             current_required_files_path = kwargs.get("required_files_path", [])
             current_required_files_path.append(os.path.join("bin", self.executable))
             kwargs["required_files_path"] = current_required_files_path
-        download_page = "https://data.services.jetbrains.com/products/releases?code={}".format(self.download_keyword)
-        kwargs["download_page"] = download_page
+        kwargs["download_page"] = self.RELEASES_URL.format(self.download_keyword)
         kwargs["json"] = True
         kwargs["checksum_type"] = ChecksumType.sha256
         super().__init__(*args, **kwargs)
+        self.eap = False
+        self.build = None
+        self.patch = None
+        self.patch_checksum = None
 
     @property
     @abstractmethod
@@ -220,20 +234,140 @@ class BaseJetBrains(umake.frameworks.baseinstaller.BaseInstaller, metaclass=ABCM
     def executable(self):
         pass
 
+    @staticmethod
+    def get_build(install_path):
+        """Return the build number of the version installed in install_path, None if unknown"""
+        with suppress(OSError):
+            with open(os.path.join(install_path, "build.txt")) as f:
+                # build.txt content is <product code>-<build number>
+                return f.read().strip().split("-", 1)[-1]
+        return None
+
+    @staticmethod
+    def get_product_info_build(install_path):
+        """Return the build number product-info.json of install_path refers to, None if there is none"""
+        with suppress(OSError, ValueError, AttributeError):
+            with open(os.path.join(install_path, "product-info.json")) as f:
+                return json.load(f).get("buildNumber")
+        return None
+
+    def download_provider_page(self):
+        if self.batch is not None:
+            # read the releases of all JetBrains IDEs of the batch in one request, shared between them
+            codes = sorted({framework.download_keyword for framework, args, command_line in self.batch.frameworks_args
+                            if isinstance(framework, BaseJetBrains) and args.eap == self.eap})
+            self.download_page = self.RELEASES_URL.format(",".join(codes))
+            if self.eap:
+                self.download_page += '&type=eap'
+        super().download_provider_page()
+
     def parse_download_link(self, line, in_download):
-        key, content = line.popitem()
-        content = content[0]
+        # the releases may be of multiple products
+        content = line[self.download_keyword][0]
         self.url = content['downloads']['linux']['link']
         self.new_download_url = content['downloads']['linux']['checksumLink']
 
+        # a patch from the installed build to this one avoids downloading the whole IDE again
+        self.build = content.get('build')
+        self.patch = None
+        # a dry run only resolves the full download
+        installed_build = None if self.dry_run else self.get_build(self.install_path)
+        for patch in content.get('patches', {}).get('unix', []):
+            if installed_build is not None and patch.get('fromBuild') == installed_build and \
+               patch.get('checksumLink'):
+                logger.debug("Found patch from build {} to {}: {}".format(installed_build, self.build, patch['link']))
+                self.patch = patch
+
         return (None, in_download)
 
     @MainLoop.in_mainloop_thread
     def get_sha_and_start_download(self, download_result):
         res = download_result[self.new_download_url]
         checksum = res.buffer.getvalue().decode('utf-8').split()[0]
+        if self.patch is not None:
+            DownloadCenter(urls=[DownloadItem(self.patch['checksumLink'])],
+                           on_done=partial(self.get_patch_sha_and_start_download, checksum), download=False)
+            return
         self.check_data_and_start_download(self.url, checksum)
 
+    @MainLoop.in_mainloop_thread
+    def get_patch_sha_and_start_download(self, checksum, download_result):
+        """Use the patch as a delta download if we have its checksum, then continue with the full download data"""
+        res = download_result[self.patch['checksumLink']]
+        if res.error:
+            logger.warning("Can't get the checksum of the update patch, will download the whole {}: {}".format(
+                self.name, res.error))
+        else:
+            self.patch_checksum = res.buffer.getvalue().decode('utf-8').split()[0]
+            # the patch checksum is verified before applying it, to fall back to the full download if it mismatches
+            self.delta_download_request = DownloadItem(self.patch['link'], None)
+        self.check_data_and_start_download(self.url, checksum)
+
+    def decompress_and_install(self, fds):
+        if not self.use_delta_download:
+            super().decompress_and_install(fds)
+            return
+        UI.display(DisplayMessage(_("Updating {}").format(self.name)))
+        self.display_install_progress()
+        future = self.patch_executor.submit(self._apply_patch, fds[0])
+        future.add_done_callback(partial(self._apply_patch_done, fds[0]))
+
+    def _apply_patch(self, fd):
+        """Apply the update patch to a staging copy of the installation, then swap them once verified"""
+        if DownloadCenter.sha256_for_fd(fd) != self.patch_checksum:
+            raise BaseException("The checksum of the update patch doesn't match.")
+        install_path = self.install_path.rstrip(os.path.sep)
+        staging_path = install_path + ".update"
+        previous_path = install_path + ".previous"
+        for path in (staging_path, previous_path):
+            shutil.rmtree(path, ignore_errors=True)
+
+        java = os.path.join(install_path, "jbr", "bin", "java")
+        if not os.path.exists(java):
+            java = shutil.which("java")
+        if java is None:
+            raise BaseException("No java runtime to apply the update patch.")
+        shutil.copytree(install_path, staging_path, symlinks=True)
+        try:
+            subprocess.run([java, "-cp", fd.name, "com.intellij.updater.Runner", "install", staging_path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            # the patch only updates a build to another: check both build markers are the target ones
+            patched_build = self.get_build(staging_path)
+            if patched_build != self.build:
+                raise BaseException("Patched build is {} instead of {}.".format(patched_build, self.build))
+            product_info_build = self.get_product_info_build(staging_path)
+            if product_info_build is not None and product_info_build != self.build:
+                raise BaseException("Patched product info build is {} instead of {}.".format(product_info_build,
+                                                                                             self.build))
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        os.rename(install_path, previous_path)
+        os.rename(staging_path, install_path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+    @MainLoop.in_mainloop_thread
+    def _apply_patch_done(self, fd, future):
+        fd.close()
+        if future.exception():
+            logger.warning("Couldn't update {} with its patch, downloading it fully: {}".format(
+                self.name, future.exception()))
+            if self.batch is None:
+                self._install_progress.done = True
+                UI.display(self._install_progress)
+            self.delta_download_request = None
+            DownloadCenter(urls=self.download_requests, on_done=self.full_download_done)
+            return
+        self.decompress_and_install_done({})
+
+    @MainLoop.in_mainloop_thread
+    def full_download_done(self, result):
+        for url in result:
+            if result[url].error:
+                logger.error(result[url].error)
+                UI.return_main_screen(status_code=1)
+        self.decompress_and_install([result[download_request.url].fd for download_request in self.download_requests])
+
     def post_install(self):
         """Create the appropriate JetBrains launcher."""
         icon_path = os.path.join(self.install_path, 'bin', self.icon_filename)
@@ -255,6 +389,7 @@ class BaseJetBrains(umake.frameworks.baseinstaller.BaseInstaller, metaclass=ABCM
 
     def run_for(self, args):
         if args.eap:
+            self.eap = True
             self.download_page += '&type=eap'
             self.name += " EAP"
             self.description += " EAP"
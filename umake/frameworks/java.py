@@ -21,12 +21,12 @@
 """Java module"""
 
 from contextlib import suppress
+from functools import partial
 from gettext import gettext as _
 import logging
 import os
 import re
 import json
-import requests
 import umake.frameworks.baseinstaller
 from umake.interactions import DisplayMessage
 from umake.network.download_center import DownloadCenter, DownloadItem
@@ -44,6 +44,8 @@ class JavaCategory(umake.frameworks.BaseCategory):
 
 class AdoptOpenJDK(umake.frameworks.baseinstaller.BaseInstaller):
 
+    ASSETS_URL = "https://api.adoptopenjdk.net/v3/assets/latest/{}/{}"
+
     def __init__(self, **kwargs):
         super().__init__(name="AdoptOpenJDK",
                          description=_("Prebuilt OpenJDK binaries from a fully open " +
@@ -91,12 +93,29 @@ class AdoptOpenJDK(umake.frameworks.baseinstaller.BaseInstaller):
             logger.error("Download page changed its syntax or is not parsable")
             UI.return_main_screen(status_code=1)
 
-        self.download_page = "https://api.adoptopenjdk.net/v3/assets/latest/{}/{}".format(version, self.jvm_impl)
-        # Check download page, or revert to previous version
-        if requests.get(self.download_page).json() == []:
-            self.download_page = "https://api.adoptopenjdk.net/v3/assets/latest/{}/{}".format(version_prev,
-                                                                                              self.jvm_impl)
-        DownloadCenter([DownloadItem(self.download_page)], self.get_metadata_and_check_license, download=False)
+        # fetch the previous version assets along, in case the latest one doesn't have any yet
+        assets_pages = [self.ASSETS_URL.format(assets_version, self.jvm_impl)
+                        for assets_version in (version, version_prev) if assets_version is not None]
+        if not assets_pages:
+            logger.error("Can't find any java version in {}".format(self.download_page))
+            UI.return_main_screen(status_code=1)
+        DownloadCenter([DownloadItem(assets_page) for assets_page in assets_pages],
+                       partial(self.assets_pages_downloaded, assets_pages), download=False)
+
+    @staticmethod
+    def select_assets_page(assets_pages, result):
+        """Return the first assets page listing some assets, or revert to the last one"""
+        for assets_page in assets_pages:
+            page = result[assets_page]
+            with suppress(AttributeError, ValueError):
+                if not page.error and json.loads(page.buffer.getvalue().decode()) != []:
+                    return assets_page
+        return assets_pages[-1]
+
+    @MainLoop.in_mainloop_thread
+    def assets_pages_downloaded(self, assets_pages, result):
+        self.download_page = self.select_assets_page(assets_pages, result)
+        self.get_metadata_and_check_license(result)
 
     def parse_download_link(self, line, in_download):
         """Parse Java download link, expect to find a url"""
@@ -22,13 +22,13 @@
 
 from contextlib import suppress
 from gettext import gettext as _
+import json
 import logging
 import os
-import re
 import umake.frameworks.baseinstaller
 from umake.network.download_center import DownloadCenter, DownloadItem
 from umake.interactions import DisplayMessage
-from umake.tools import get_current_arch, add_env_to_user, ChecksumType
+from umake.tools import get_current_arch, add_env_to_user, Checksum, ChecksumType, MainLoop
 from umake.ui import UI
 
 logger = logging.getLogger(__name__)
@@ -43,58 +43,120 @@ class NodejsCategory(umake.frameworks.BaseCategory):
 
 class NodejsLang(umake.frameworks.baseinstaller.BaseInstaller):
 
+    INDEX_URL = "https://nodejs.org/dist/index.json"
+    INDEX_CACHE_FILENAME = "nodejs-index.json"
+    DIST_URL = "https://nodejs.org/dist/{}/"
+
     def __init__(self, **kwargs):
         super().__init__(name="Nodejs Lang", description=_("Nodejs stable"), is_category_default=True,
                          only_on_archs=['amd64'],
-                         download_page="https://nodejs.org/en/download/current",
+                         download_page=self.INDEX_URL,
                          checksum_type=ChecksumType.sha256,
                          dir_to_decompress_in_tarball="node*",
                          required_files_path=[os.path.join("bin", "node")],
                          **kwargs)
+        self.lts = False
+        # checksum of the download, fetched while downloading
+        self.checksum_pending = False
+        self.checksum = None
+        self.fds_to_verify = None
     arch_trans = {
         "amd64": "x64",
         "aarch64": "arm64"
     }
 
     def download_provider_page(self):
-        logger.debug("Download application provider page")
-        DownloadCenter([DownloadItem(self.download_page)], self.parse_shasum_page, download=False)
-
-    def parse_shasum_page(self, result):
-        """Parse the download page and get the SHASUMS256.txt page"""
-        logger.debug("Parse download metadata")
-
-        error_msg = result[self.download_page].error
-        if error_msg:
-            logger.error("An error occurred while downloading {}: {}".format(self.download_page, error_msg))
+        logger.debug("Download releases index")
+        self.download_cached_page(self.INDEX_URL, self.INDEX_CACHE_FILENAME, self.parse_releases_index)
+
+    def parse_releases_index(self, content):
+        """Get the latest current or lts release from the releases index, then its SHASUMS256.txt page"""
+        arch = self.arch_trans[get_current_arch()]
+        try:
+            # releases are listed from the latest one
+            release = next(release for release in json.loads(content)
+                           if (release["lts"] or not self.lts) and "linux-{}".format(arch) in release["files"])
+        except (ValueError, TypeError, KeyError, StopIteration):
+            logger.error("Download page changed its syntax or is not parsable")
+            UI.return_main_screen(status_code=1)
+        logger.debug("Found Nodejs release {}".format(release["version"]))
+
+        dist_url = self.DIST_URL.format(release["version"])
+        self.download_page = dist_url + "SHASUMS256.txt"
+        if self.dry_run:
+            # the checksum is shown or recorded without downloading
+            DownloadCenter([DownloadItem(self.download_page)], self.get_metadata_and_check_license, download=False)
+            return
+
+        # fetch the checksum while downloading, the download is verified once both are done
+        url = "{}node-{}-linux-{}.tar.xz".format(dist_url, release["version"], arch)
+        logger.debug("Found download link for {}".format(url))
+        self.checksum_pending = True
+        DownloadCenter([DownloadItem(self.download_page)], self.get_checksum, download=False)
+        self.download_requests.append(DownloadItem(url, None))
+        if self.batch is not None:
+            self.batch.metadata_ready(self, "")
+            return
+        self.start_download_and_install()
+
+    @MainLoop.in_mainloop_thread
+    def get_checksum(self, result):
+        """Get the download checksum from the SHASUMS256.txt page, and verify the download if it's waiting for it"""
+        res = result[self.download_page]
+        if res.error:
+            logger.error("An error occurred while downloading {}: {}".format(self.download_page, res.error))
             UI.return_main_screen(status_code=1)
 
-        for line in result[self.download_page].buffer:
-            line_content = line.decode()
-            with suppress(AttributeError):
-                shasum_url = re.search(r'a href=\"(https://nodejs\.org/dist/v[\d\.]+/SHASUMS\d\d\d\.txt\.asc)\"', line_content).group(1)
-
-        if not result:
-            logger.error("Download page changed its syntax or is not parsable")
+        in_download = False
+        for line in res.buffer:
+            (download, in_download) = self.parse_download_link(line.decode(), in_download)
+            if download is not None and download[0] == self.download_requests[0].url:
+                self.checksum = download[1]
+                break
+        if self.checksum is None:
+            logger.error("Download page changed its syntax or is not parsable (checksum missing)")
             UI.return_main_screen(status_code=1)
 
-        self.download_page = shasum_url
-        DownloadCenter([DownloadItem(self.download_page)], self.get_metadata_and_check_license, download=False)
+        if self.fds_to_verify is not None:
+            self.verify_and_install()
 
     def parse_download_link(self, line, in_download):
-        """Parse Nodejs download link, expect to find a sha1 and a url"""
+        """Parse Nodejs download link, expect to find a sha256 and a url"""
         url, shasum = (None, None)
         arch = get_current_arch()
         if "linux-{}.tar.xz".format(self.arch_trans[arch]) in line:
             in_download = True
         if in_download:
-            url = self.download_page.strip("SHASUMS256.txt.asc") + line.split()[1].rstrip()
+            url = self.download_page.rsplit("/", 1)[0] + "/" + line.split()[1].rstrip()
             shasum = line.split()[0]
 
         if url is None and shasum is None:
             return (None, in_download)
         return ((url, shasum), in_download)
 
+    def decompress_and_install(self, fds):
+        """Only install once the download checksum is verified, it may still be fetched"""
+        self.fds_to_verify = fds
+        if self.checksum_pending and self.checksum is None:
+            logger.debug("Waiting for Nodejs checksum to verify the download")
+            return
+        self.verify_and_install()
+
+    def verify_and_install(self):
+        """Verify the download against the fetched checksum, if any, then install it"""
+        fds, self.fds_to_verify = self.fds_to_verify, None
+        if self.checksum_pending:
+            for fd in fds:
+                if DownloadCenter.sha256_for_fd(fd) != self.checksum:
+                    logger.error("The checksum of {} doesn't match. Corrupted download? Aborting.".format(
+                        self.download_requests[0].url))
+                    UI.return_main_screen(status_code=1)
+                fd.seek(0)
+            # the installed download is recorded with its verified checksum
+            self.download_requests = [DownloadItem(download_request.url, Checksum(self.checksum_type, self.checksum))
+                                      for download_request in self.download_requests]
+        super().decompress_and_install(fds)
+
     def prefix_set(self):
         with suppress(IOError):
             with open(os.path.join(os.environ['HOME'], '.npmrc'), 'r') as file:
@@ -122,7 +184,7 @@ class NodejsLang(umake.frameworks.baseinstaller.BaseInstaller):
 
     def run_for(self, args):
         if args.lts:
-            self.download_page = "https://nodejs.org/en/download/"
+            self.lts = True
         if not args.remove:
-            print('Download from {}'.format(self.download_page))
+            print('Download {} release from {}'.format("lts" if self.lts else "current", self.download_page))
         super().run_for(args)
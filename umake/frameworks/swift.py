@@ -25,10 +25,10 @@ from gettext import gettext as _
 import logging
 import os
 import re
-import tempfile
 
 import umake.frameworks.baseinstaller
 from umake.interactions import DisplayMessage
+from umake.settings import UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE
 from umake.tools import add_env_to_user, as_root, MainLoop, get_current_distro_version
 from umake.network.download_center import DownloadCenter, DownloadItem
 from umake.ui import UI
@@ -45,6 +45,14 @@ class SwiftCategory(umake.frameworks.BaseCategory):
 
 class SwiftLang(umake.frameworks.baseinstaller.BaseInstaller):
 
+    # swift.org release signing keys fingerprints, only signatures made with them are trusted
+    KEYS_FINGERPRINTS = ["7463A81A4B2EEA1B551FFBCFD441C977412B37AD", "1BE1E29A084CB305F397D62A9F597F4D21A56D5F",
+                         "A3BAFD3556A59079C06894BD63BC1CFE91D306C6", "5E4DF843FB065D7F7E24FBA2EF5430F071E1B235",
+                         "8513444E2DA36B7C1659AF4D7638F1FB2B2B08C4", "A62AE125BBBFBB96A6E042EC925CC1CCED3D1561",
+                         "8A7495662C3CD4AE18D95637FAF6989E1BC16FEA", "E813C892820A6FA13755B268F167DF1ACF9CE069"]
+    KEYRING_DIRNAME = "swift-gnupg"
+    PINS_FILENAME = "pinned-fingerprints"
+
     def __init__(self, **kwargs):
         super().__init__(name="Swift Lang", description=_("Swift compiler (default)"), is_category_default=True,
                          packages_requirements=["clang", "libicu-dev"],
@@ -55,6 +63,80 @@ class SwiftLang(umake.frameworks.baseinstaller.BaseInstaller):
                          required_files_path=[os.path.join("usr", "bin", "swift")],
                          **kwargs)
         self.asc_url = "https://swift.org/keys/all-keys.asc"
+        self.keys_ready = False
+        self.fds_to_verify = None
+
+    @property
+    def keys_fingerprints(self):
+        """Pinned signing keys fingerprints, with the additional ones from the environment"""
+        additional_fingerprints = os.getenv(UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE, "").upper().split(",")
+        return self.KEYS_FINGERPRINTS + [fingerprint.strip() for fingerprint in additional_fingerprints
+                                         if fingerprint.strip()]
+
+    @property
+    def keyring_path(self):
+        """The signing keys gpg home directory, kept in the cache and reused across installs"""
+        return self.get_page_cache_path(self.KEYRING_DIRNAME)
+
+    def is_keyring_pinned(self):
+        """Return if the keyring was already updated with the current pinned keys"""
+        try:
+            with open(os.path.join(self.keyring_path, self.PINS_FILENAME), encoding="utf-8") as f:
+                return sorted(f.read().split()) == sorted(self.keys_fingerprints)
+        except OSError:
+            return False
+
+    def get_metadata(self):
+        """Fetch the signing keys while getting the metadata and downloading, if the keyring doesn't have them yet"""
+        if not self.dry_run:
+            if self.is_keyring_pinned():
+                logger.debug("Using the Swift signing keys from {}".format(self.keyring_path))
+                self.keys_ready = True
+            else:
+                DownloadCenter([DownloadItem(self.asc_url)], self.keys_downloaded, download=False)
+        super().get_metadata()
+
+    @MainLoop.in_mainloop_thread
+    def keys_downloaded(self, result):
+        """Update the keyring with the pinned signing keys, and verify the downloads if they are waiting for them"""
+        res = result[self.asc_url]
+        if res.error:
+            logger.error("An error occurred while downloading {}: {}".format(self.asc_url, res.error))
+            UI.return_main_screen(status_code=1)
+
+        os.makedirs(self.keyring_path, mode=0o700, exist_ok=True)
+        if not self.run_gpg(self.update_gpg_keyring, self.keyring_path, res.buffer.getvalue().decode('utf-8'),
+                            self.keys_fingerprints):
+            logger.error("Couldn't import {} signing keys".format(self.name))
+            UI.return_main_screen(status_code=1)
+        with open(os.path.join(self.keyring_path, self.PINS_FILENAME), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.keys_fingerprints) + "\n")
+
+        self.keys_ready = True
+        if self.fds_to_verify is not None:
+            self.verify_and_install()
+
+    def run_gpg(self, function, *args):
+        """Call function running gpg on the keyring, return its result
+
+        When we install new packages, we are executing as root and then dropping
+        as the user for extracting and such. However, gpg doesn't like privilege
+        drop (if uid = 0 and euid = 1000) and asserts if uid != euid.
+        Consequently, run gpg as root if we needed root access or as the user
+        otherwise. The keyring is in the user cache directory, so the files gpg
+        created as root are then given back to the user."""
+        if not self.need_root_access:
+            return function(*args)
+        with as_root():
+            try:
+                return function(*args)
+            finally:
+                uid = int(os.getenv("SUDO_UID", default=0))
+                gid = int(os.getenv("SUDO_GID", default=0))
+                for root, dirs, files in os.walk(self.keyring_path):
+                    os.chown(root, uid, gid)
+                    for name in files:
+                        os.chown(os.path.join(root, name), uid, gid)
 
     def parse_download_link(self, line, in_download):
         """Parse Swift download link, expect to find a .sig file"""
@@ -92,45 +174,44 @@ class SwiftLang(umake.frameworks.baseinstaller.BaseInstaller):
         if not sig_url:
             logger.error("Download page changed its syntax or is not parsable")
             UI.return_main_screen(status_code=1)
-        if self.dry_run:
+        if self.dry_run and self.batch is None:
             UI.display(DisplayMessage("Found download URL: " + sig_url))
             UI.return_main_screen(status_code=0)
-        DownloadCenter(urls=[DownloadItem(sig_url, None), DownloadItem(self.asc_url, None)],
-                       on_done=self.check_gpg_and_start_download, download=False)
 
-    @MainLoop.in_mainloop_thread
-    def check_gpg_and_start_download(self, download_result):
-        asc_content = download_result.pop(self.asc_url).buffer.getvalue().decode('utf-8')
-        sig_url = list(download_result.keys())[0]
-        res = download_result[sig_url]
-        sig = res.buffer.getvalue().decode('utf-8').split()[0]
-
-        # When we install new packages, we are executing as root and then dropping
-        # as the user for extracting and such. However, for signature verification,
-        # we use gpg. This one doesn't like privilege drop (if uid = 0 and
-        # euid = 1000) and asserts if uid != euid.
-        # Importing the key as root as well creates new gnupg files owned as root if
-        # new keys weren't imported first.
-        # Consequently, run gpg as root if we needed root access or as the user
-        # otherwise. We store the gpg public key in a temporary gnupg directory that
-        # will be removed under the same user rights (this directory needs to be owned
-        # by the same user id to not be rejected by gpg).Z
-        if self.need_root_access:
-            with as_root():
-                with tempfile.TemporaryDirectory() as tmpdirname:
-                    _check_gpg_signature(tmpdirname, asc_content, sig)
-        else:
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                _check_gpg_signature(tmpdirname, asc_content, sig)
-
-        # you get and store self.download_url
-        url = re.sub('.sig', '', sig_url)
-        if url is None:
-            logger.error("Download page changed its syntax or is not parsable (missing url)")
-            UI.return_main_screen(status_code=1)
+        # the signature is downloaded along with the tarball
+        url = sig_url[:-len(".sig")]
         logger.debug("Found download link for {}".format(url))
-        self.download_requests.append(DownloadItem(url, None))
-        self.start_download_and_install()
+        self.check_data_and_start_download(url)
+
+    def get_requests_to_download(self):
+        """Download the tarballs signatures along with them"""
+        return super().get_requests_to_download() + [DownloadItem(download_request.url + ".sig", None)
+                                                     for download_request in self.download_requests]
+
+    def decompress_and_install(self, fds):
+        """Only install once the tarball signature is verified, the signing keys may still be fetched"""
+        self.fds_to_verify = fds
+        if not self.keys_ready:
+            logger.debug("Waiting for Swift signing keys to verify the download")
+            return
+        self.verify_and_install()
+
+    def verify_and_install(self):
+        """Verify the tarball against its signature with the pinned signing keys, then install it"""
+        fds, self.fds_to_verify = self.fds_to_verify, None
+        sig_fds = [fd for fd in fds if fd.name.endswith(".sig")]
+        fds = [fd for fd in fds if fd not in sig_fds]
+
+        verified = len(sig_fds) == 1 and len(fds) == 1 and \
+            self.run_gpg(self.check_gpg_signature, self.keyring_path, sig_fds[0].name, fds[0].name,
+                         self.keys_fingerprints)
+        for sig_fd in sig_fds:
+            sig_fd.close()
+        if not verified:
+            logger.error("Couldn't verify {} download signature".format(self.name))
+            UI.return_main_screen(status_code=1)
+
+        super().decompress_and_install(fds)
 
     def post_install(self):
         """Add swift necessary env variables"""
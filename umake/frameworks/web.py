@@ -29,7 +29,6 @@ import platform
 import re
 import umake.frameworks.baseinstaller
 from umake.interactions import Choice, TextWithChoices, DisplayMessage
-from umake.network.download_center import DownloadItem
 from umake.ui import UI
 from umake.tools import create_launcher, get_application_desktop_file, MainLoop,\
     get_current_arch, add_env_to_user
@@ -60,11 +59,7 @@ class FirefoxDev(umake.frameworks.baseinstaller.BaseInstaller):
     def language_select_callback(self, url):
         url = url.replace("&amp;", "&")
         logger.debug("Found download link for {}".format(url))
-        if self.dry_run:
-            UI.display(DisplayMessage("Found download URL: " + url))
-            UI.return_main_screen(status_code=0)
-        self.download_requests.append(DownloadItem(url, None))
-        self.start_download_and_install()
+        self.check_data_and_start_download(url)
 
     @MainLoop.in_mainloop_thread
     def get_metadata_and_check_license(self, result):
@@ -156,6 +156,7 @@ class DisplayMessage:
 
 
 class UnknownProgress:
-    def __init__(self, iterator):
+    def __init__(self):
+        """Progress without a known end, displayed again on each progress event and once done"""
         self.bar = None
-        self._iterator = iterator
+        self.done = False
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Machine readable inventory of installed frameworks
+
+This only relies on the configuration and the frameworks registry, and doesn't import any framework module if the
+registry is up to date."""
+
+import json
+import logging
+import os
+from umake import registry
+from umake.tools import ConfigHandler, get_user_frameworks_path, launcher_exists
+
+logger = logging.getLogger(__name__)
+
+
+def _get_frameworks_registry():
+    """Return the frameworks registry, refreshing it by loading every framework if needed"""
+    frameworks_registry = registry.load_current(get_user_frameworks_path())
+    if frameworks_registry is None:
+        logger.debug("No valid frameworks registry, loading all frameworks to refresh it")
+        from umake.frameworks import load_frameworks
+        load_frameworks(force_loading=True, args=[])
+        frameworks_registry = registry.load_current(get_user_frameworks_path())
+    return frameworks_registry
+
+
+def _is_installed(install_path, framework_entry):
+    """Return if the framework is installed, only checking the filesystem"""
+    if not os.path.isdir(install_path):
+        return False
+    for required_file_path in framework_entry.get("required_files_path", []):
+        if not os.path.exists(os.path.join(install_path, required_file_path)):
+            return False
+    if framework_entry.get("desktop_filename"):
+        return launcher_exists(framework_entry["desktop_filename"])
+    return True
+
+
+def get_installed_frameworks():
+    """Yield installed frameworks as:
+        {
+            'category_name':
+            'framework_name':
+            'framework_description': None if the framework isn't available anymore
+            'install_path':
+        }
+    """
+    config = ConfigHandler().config
+    try:
+        config_frameworks = config["frameworks"]
+    except (TypeError, KeyError):
+        return
+    frameworks_registry = _get_frameworks_registry()
+    categories = frameworks_registry["categories"] if frameworks_registry else {}
+    # Sort the categories and frameworks to prevent a random list at each new program execution
+    for category_name in sorted(config_frameworks):
+        for framework_name in sorted(config_frameworks[category_name] or {}):
+            try:
+                install_path = config_frameworks[category_name][framework_name]["path"]
+            except (TypeError, KeyError):
+                continue
+            framework_entry = categories.get(category_name, {}).get("frameworks", {}).get(framework_name, {})
+            if not _is_installed(install_path, framework_entry):
+                continue
+            yield {
+                "category_name": category_name,
+                "framework_name": framework_name,
+                "framework_description": framework_entry.get("description"),
+                "install_path": install_path
+            }
+
+
+def dump_installed_frameworks(stream):
+    """Write installed frameworks as a JSON list in stream, one framework at a time"""
+    stream.write("[")
+    for i, framework in enumerate(get_installed_frameworks()):
+        if i > 0:
+            stream.write(",")
+        stream.write("\n  " + json.dumps(framework))
+        stream.flush()
+    stream.write("\n]\n")
+    stream.flush()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Frameworks lock file: resolved download urls and checksums of frameworks
+
+Installing from a lock file skips fetching and parsing the frameworks download pages, and always installs the same
+versions."""
+
+from gettext import gettext as _
+import json
+import logging
+import os
+from urllib.parse import urlparse
+from umake.tools import Checksum, ChecksumType, InputError
+
+logger = logging.getLogger(__name__)
+
+LOCK_FORMAT = 1
+DEFAULT_LOCK_FILENAME = "umake-lock.json"
+ARCHIVE_EXTENSIONS = [".tar.gz", ".tar.xz", ".tar.bz2", ".tgz", ".zip", ".deb", ".sh", ".run"]
+
+
+def get_archive_format(url):
+    """Return the archive format deduced from the url, None if there is no extension"""
+    path = urlparse(url).path
+    for extension in ARCHIVE_EXTENSIONS:
+        if path.endswith(extension):
+            return extension[1:]
+    return os.path.splitext(path)[1][1:] or None
+
+
+def get_downloads_lock(download_requests):
+    """Return the list of locked downloads of those download requests"""
+    downloads = []
+    for download_request in download_requests:
+        checksum = download_request.checksum
+        downloads.append({
+            "url": download_request.url,
+            "checksum_type": checksum.checksum_type.value if checksum and checksum.checksum_type else None,
+            "checksum": checksum.checksum_value if checksum else None,
+            "archive_format": get_archive_format(download_request.url)
+        })
+    return downloads
+
+
+def is_same_downloads(downloads, other_downloads):
+    """Return if both lists of locked downloads have the same urls and checksums"""
+    def _key(download):
+        return (download["url"], download["checksum_type"], download["checksum"])
+    return [_key(download) for download in downloads] == [_key(download) for download in other_downloads]
+
+
+def get_framework_lock(framework, command_line, license_txt):
+    """Return the lock of an installer framework, once its download requests are resolved
+
+    command_line is the list of arguments selecting the framework and its options. The lock is in the form of:
+    {
+        'category': category name
+        'framework': framework name
+        'command_line': [] of arguments to select the same framework with the same options
+        'downloads': [
+            {
+                'url':
+                'checksum_type': None or a ChecksumType value
+                'checksum': None or the checksum value
+                'archive_format': None or the archive format deduced from the url
+            }
+        ]
+        'dir_to_decompress_in_tarball':
+        'required_files_path': [] of files relative to the install path, as they can depend on the version
+        'license': None or license text to accept
+    }"""
+    return {
+        "category": framework.category.prog_name,
+        "framework": framework.prog_name,
+        "command_line": command_line,
+        "downloads": get_downloads_lock(framework.download_requests),
+        "dir_to_decompress_in_tarball": framework.dir_to_decompress_in_tarball,
+        "required_files_path": framework.required_files_path,
+        "license": license_txt or None
+    }
+
+
+def get_download_requests(framework_lock):
+    """Return the list of DownloadItems of a framework lock"""
+    # the network stack isn't needed to complete or parse lock commands
+    from umake.network.download_center import DownloadItem
+    download_requests = []
+    for download in framework_lock["downloads"]:
+        checksum_type = ChecksumType(download["checksum_type"]) if download["checksum_type"] else None
+        download_requests.append(DownloadItem(download["url"], Checksum(checksum_type, download["checksum"])))
+    return download_requests
+
+
+def save(lock_path, frameworks_locks):
+    """Save the frameworks locks to lock_path"""
+    logger.debug("Saving frameworks lock file in {}".format(lock_path))
+    with open(lock_path + ".new", "w", encoding="utf-8") as f:
+        json.dump({"format": LOCK_FORMAT, "frameworks": frameworks_locks}, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.rename(lock_path + ".new", lock_path)
+
+
+def load(lock_path):
+    """Return the list of frameworks locks from lock_path
+
+    Raise an InputError if the lock file isn't valid."""
+    try:
+        with open(lock_path, encoding="utf-8") as f:
+            lock = json.load(f)
+        if lock["format"] != LOCK_FORMAT:
+            raise InputError(_("{} lock file format isn't supported").format(lock_path))
+        # check every framework lock, to error out before installing anything
+        for framework_lock in lock["frameworks"]:
+            get_download_requests(framework_lock)
+            if not isinstance(framework_lock["command_line"], list):
+                raise TypeError("command_line isn't a list")
+        return lock["frameworks"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise InputError(_("{} isn't a valid lock file: {}").format(lock_path, e))
@@ -27,14 +27,15 @@ from io import BytesIO
 import logging
 import os
 import tempfile
+from threading import Lock
 
-import requests
-import requests.exceptions
-from umake.network.ftp_adapter import FTPAdapter
 from umake.tools import ChecksumType, root_lock
 
 logger = logging.getLogger(__name__)
 
+# response headers to pass back to only get a page if it changed, with the corresponding request header
+VALIDATORS_CONDITIONAL_HEADERS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+
 
 class DownloadItem(namedtuple('DownloadItem', ['url', 'checksum', 'headers', 'ignore_encoding', 'cookies'])):
     """An individual item to be downloaded and checked.
@@ -46,19 +47,36 @@ class DownloadItem(namedtuple('DownloadItem', ['url', 'checksum', 'headers', 'ig
         return super().__new__(cls, url, checksum, headers, ignore_encoding, cookies)
 
 
+def get_conditional_headers(validators):
+    """Return the request headers to only get a page if it changed since it returned those validators"""
+    return {VALIDATORS_CONDITIONAL_HEADERS[validator]: value for validator, value in validators.items()
+            if validator in VALIDATORS_CONDITIONAL_HEADERS}
+
+
 class DownloadCenter:
     """Read or download requested urls in separate threads."""
 
     BLOCK_SIZE = 1024 * 8  # from urlretrieve code
-    DownloadResult = namedtuple("DownloadResult", ["buffer", "error", "fd", "final_url", "cookies"])
+    DownloadResult = namedtuple("DownloadResult", ["buffer", "error", "fd", "final_url", "cookies", "validators",
+                                                   "not_modified"])
 
-    def __init__(self, urls, on_done, download=True, report=lambda x: None):
+    # pages being read in memory, with the other DownloadCenters waiting for the same page
+    _pages_in_flight = {}
+    _pages_in_flight_lock = Lock()
+
+    def __init__(self, urls, on_done, download=True, report=lambda x: None, max_parallel=None, line_reader=None):
         """Generate a threaded download machine.
 
         urls is a list of DownloadItems to download or read from.
         on_done is the callback that will be called once all those urls are downloaded.
         report, if not None, will be called once any download is in progress, reporting
         a dict of current download with current/size parameters
+        max_parallel, if not None, limits the number of simultaneous downloads to share the bandwidth between them.
+        Pages read in memory (download set to False) which are already being read by another DownloadCenter, with
+        the same headers, aren't fetched again: the in-flight request serves all of them.
+        line_reader, if not None, is called with each line of the content while it's being downloaded, until it
+        returns True. The whole content is still downloaded. Pages served by another in-flight request aren't read
+        line by line.
 
         The callback will get a dictionary parameter like:
         {
@@ -68,13 +86,17 @@ class DownloadCenter:
                                error=string detailing the error which occurred (path and content would be empty),
                                fd=temporary file descriptor. close() will delete it from disk,
                                final_url=the final url, which may be different from the start if there were redirects,
-                               cookies=a dictionary of cookies after the request
+                               cookies=a dictionary of cookies after the request,
+                               validators=a dictionary of the ETag and Last-Modified response headers, if any,
+                               not_modified=True if the page didn't change since the validators sent as conditional
+                                            headers (see get_conditional_headers), and so is empty
                 )
         }
         """
 
         self._done_callback = on_done
         self._wired_report = report
+        self._line_reader = line_reader
         self._download_to_file = download
 
         self._urls = urls
@@ -82,7 +104,10 @@ class DownloadCenter:
 
         self._download_progress = {}
 
-        executor = futures.ThreadPoolExecutor(max_workers=len(urls))
+        max_workers = len(urls)
+        if max_parallel is not None:
+            max_workers = min(max_workers, max_parallel)
+        executor = futures.ThreadPoolExecutor(max_workers=max_workers)
         for url_request in self._urls:
             # grab the md5sum if any
             # switch between inline memory and temp file
@@ -97,19 +122,36 @@ class DownloadCenter:
                 root_lock.release()
                 logger.info("Start downloading {} to a temp file".format(url_request))
             else:
+                page_key = self._get_page_key(url_request)
+                if page_key is not None:
+                    with DownloadCenter._pages_in_flight_lock:
+                        if page_key in DownloadCenter._pages_in_flight:
+                            logger.info("{} is already being downloaded, waiting for it".format(url_request))
+                            DownloadCenter._pages_in_flight[page_key].append(self)
+                            continue
+                        DownloadCenter._pages_in_flight[page_key] = []
                 dest = BytesIO()
                 logger.info("Start downloading {} in memory".format(url_request))
             future = executor.submit(self._fetch, url_request, dest)
             future.tag_url = url_request.url
             future.tag_download = download
             future.tag_dest = dest
+            future.tag_page_key = None if download else page_key
             future.add_done_callback(self._one_done)
 
+    @staticmethod
+    def _get_page_key(download_item):
+        """Return what identifies the same page request, None if it can't be shared"""
+        if download_item.cookies:
+            return None
+        return (download_item.url, tuple(sorted((download_item.headers or {}).items())),
+                download_item.ignore_encoding)
+
     def _fetch(self, download_item, dest):
         """Get an url content and close the connexion.
 
         This will write the content to dest and check for md5sum.
-        Return a tuple of (dest, final_url, cookies)
+        Return a tuple of (dest, final_url, cookies, validators, not_modified)
         """
         url = download_item.url
         checksum = download_item.checksum
@@ -126,6 +168,10 @@ class DownloadCenter:
 
         # Requests support redirection out of the box.
         # Create a session so we can mount our own FTP adapter.
+        # requests is slow to import, only do it when we are actually downloading.
+        import requests
+        import requests.exceptions
+        from umake.network.ftp_adapter import FTPAdapter
         session = requests.Session()
         session.mount('ftp://', FTPAdapter())
 
@@ -139,12 +185,26 @@ class DownloadCenter:
                 # read in chunk and send report updates
                 block_num = 0
                 _report(block_num, self.BLOCK_SIZE, content_size)
+                reading_lines = self._line_reader is not None
+                pending_line = b""
                 for data in r.raw.stream(amt=self.BLOCK_SIZE, decode_content=not download_item.ignore_encoding):
                     dest.write(data)
                     block_num += 1
                     _report(block_num, self.BLOCK_SIZE, content_size)
+                    if reading_lines:
+                        lines = (pending_line + data).split(b"\n")
+                        pending_line = lines.pop()
+                        for line in lines:
+                            if self._line_reader(line + b"\n"):
+                                reading_lines = False
+                                break
+                if reading_lines and pending_line:
+                    self._line_reader(pending_line)
                 final_url = r.url
                 cookies = session.cookies
+                validators = {validator: r.headers[validator] for validator in VALIDATORS_CONDITIONAL_HEADERS
+                              if validator in r.headers}
+                not_modified = r.status_code == 304
         except requests.exceptions.InvalidSchema as exc:
             # Wrap this for a nicer error message.
             raise BaseException("Protocol not supported.") from exc
@@ -173,7 +233,7 @@ class DownloadCenter:
                 msg = ("The checksum of {} doesn't match. Corrupted download? "
                        "Aborting.").format(url)
                 raise BaseException(msg)
-        return dest, final_url, cookies
+        return dest, final_url, cookies, validators, not_modified
 
     def _one_done(self, future):
         """Callback that will be called once the download finishes.
@@ -184,18 +244,31 @@ class DownloadCenter:
         if future.exception():
             logger.error("{} couldn't finish download: {}".format(future.tag_url, future.exception()))
             result = self.DownloadResult(buffer=None, error=str(future.exception()), fd=None, final_url=None,
-                                         cookies=None)
+                                         cookies=None, validators={}, not_modified=False)
             # cleaned unusable temp file as something bad happened
             future.tag_dest.close()
         else:
             logger.info("{} download finished".format(future.tag_url))
-            fd, final_url, cookies = future.result()
+            fd, final_url, cookies, validators, not_modified = future.result()
             fd.seek(0)
             if future.tag_download:
-                result = self.DownloadResult(buffer=None, error=None, fd=fd, final_url=final_url, cookies=cookies)
+                result = self.DownloadResult(buffer=None, error=None, fd=fd, final_url=final_url, cookies=cookies,
+                                             validators=validators, not_modified=not_modified)
             else:
-                result = self.DownloadResult(buffer=fd, error=None, fd=None, final_url=final_url, cookies=cookies)
-        self._downloaded_content[future.tag_url] = result
+                result = self.DownloadResult(buffer=fd, error=None, fd=None, final_url=final_url, cookies=cookies,
+                                             validators=validators, not_modified=not_modified)
+
+        if future.tag_page_key is not None:
+            with DownloadCenter._pages_in_flight_lock:
+                waiting_download_centers = DownloadCenter._pages_in_flight.pop(future.tag_page_key)
+            for download_center in waiting_download_centers:
+                # each one reads its own copy of the page
+                buffer = BytesIO(result.buffer.getvalue()) if result.buffer else None
+                download_center._add_result(future.tag_url, result._replace(buffer=buffer))
+        self._add_result(future.tag_url, result)
+
+    def _add_result(self, url, result):
+        self._downloaded_content[url] = result
         if len(self._urls) == len(self._downloaded_content):
             self._done()
 
@@ -24,13 +24,16 @@ import apt.progress
 import apt.progress.base
 from collections import namedtuple
 from concurrent import futures
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 import fcntl
+import hashlib
 import logging
 import os
 import re
+import shutil
 import subprocess
 import tempfile
+from threading import RLock
 import time
 from umake.tools import Singleton, add_foreign_arch, get_foreign_archs, get_current_arch, as_root
 
@@ -42,81 +45,137 @@ class RequirementsHandler(object, metaclass=Singleton):
 
     STATUS_DOWNLOADING, STATUS_INSTALLING = range(2)
 
+    # dpkg frontend lock, held by apt/unattended-upgrades while they are modifying the system
+    DPKG_LOCK_FILE = "/var/lib/dpkg/lock-frontend"
+    PROC_LOCKS_FILE = "/proc/locks"
+    # backoff (in seconds) between two attempts of reopening the apt cache
+    RELOAD_BACKOFF_START = 0.1
+    RELOAD_BACKOFF_MAX = 5
+
     RequirementsResult = namedtuple("RequirementsResult", ["bucket", "error"])
+    RequirementsPlan = namedtuple("RequirementsPlan", ["packages_count", "download_size", "installed_size"])
 
     def __init__(self):
         logger.info("Create a new apt cache")
         self.cache = apt.Cache()
+        self._cache_lock = RLock()
+        # buckets states evaluated at once, answered without the lock while checking many buckets in parallel
+        self._buckets_states = None
         self.executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._prefetch_dir = None
 
         # Set defaults for openjdk override
         self.jre_installed_version = None
         self.jdk_installed_version = None
 
+    @contextmanager
+    def buckets_states_snapshot(self, buckets):
+        """Evaluate once the installed and available states of those buckets, and answer them from that snapshot
+
+        The apt cache isn't thread safe, so every lookup takes the cache lock: checking all buckets upfront lets
+        frameworks be checked in parallel without waiting for each other on the lock."""
+        buckets_states = {}
+        with self._cache_lock:
+            for bucket in buckets:
+                # checking a bucket can replace its alternatives by the found package: answer for both
+                key = tuple(bucket)
+                buckets_states[key] = (self.is_bucket_installed(bucket), self.is_bucket_available(bucket))
+                buckets_states.setdefault(tuple(bucket), buckets_states[key])
+        self._buckets_states = buckets_states
+        try:
+            yield
+        finally:
+            self._buckets_states = None
+
+    def _get_bucket_state(self, bucket, index):
+        """Return the snapshot state at index of this bucket, None if it's not snapshotted"""
+        buckets_states = self._buckets_states
+        if buckets_states is None:
+            return None
+        with suppress(KeyError):
+            return buckets_states[tuple(bucket)][index]
+        return None
+
     def is_bucket_installed(self, bucket):
         """Check if the bucket is installed
 
         The bucket is a list of packages to check if installed."""
-        logger.debug("Check if {} is installed".format(bucket))
-        is_installed = True
-        for pkg_name in bucket:
-            if ' | ' in pkg_name:
-                for package in pkg_name.split(' | '):
-                    if self.is_bucket_installed([package]):
-                        bucket.remove(pkg_name)
-                        bucket.append(package)
-                        pkg_name = package
-                        break
-            # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't
-            # understand that. strip :arch then
-            if ":" in pkg_name:
-                (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
-                if arch == get_current_arch():
-                    pkg_name = pkg_without_arch_name
-            if pkg_name not in self.cache or not self.cache[pkg_name].is_installed:
-                if "openjdk" in pkg_name:
-                    is_installed = self.check_java_equiv(pkg_name)
-                else:
-                    logger.info("{} isn't installed".format(pkg_name))
-                    is_installed = False
-        return is_installed
+        is_installed = self._get_bucket_state(bucket, 0)
+        if is_installed is not None:
+            return is_installed
+        # apt cache isn't thread safe, and we can check frameworks in parallel
+        with self._cache_lock:
+            logger.debug("Check if {} is installed".format(bucket))
+            is_installed = True
+            for pkg_name in bucket:
+                if ' | ' in pkg_name:
+                    for package in pkg_name.split(' | '):
+                        if self.is_bucket_installed([package]):
+                            bucket.remove(pkg_name)
+                            bucket.append(package)
+                            pkg_name = package
+                            break
+                # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't
+                # understand that. strip :arch then
+                if ":" in pkg_name:
+                    (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
+                    if arch == get_current_arch():
+                        pkg_name = pkg_without_arch_name
+                if pkg_name not in self.cache or not self.cache[pkg_name].is_installed:
+                    if "openjdk" in pkg_name:
+                        is_installed = self.check_java_equiv(pkg_name)
+                    else:
+                        logger.info("{} isn't installed".format(pkg_name))
+                        is_installed = False
+            return is_installed
 
     def is_bucket_available(self, bucket):
         """Check if bucket available on the platform"""
-        all_in_cache = True
-        for pkg_name in bucket:
-            if ' | ' in pkg_name:
-                for package in pkg_name.split(' | '):
-                    if self.is_bucket_available([package]):
-                        bucket.remove(pkg_name)
-                        bucket.append(package)
-                        pkg_name = package
-                        break
-            if pkg_name not in self.cache:
-                # this can be also a foo:arch and we don't have <arch> added. Tell is may be available
-                if ":" in pkg_name:
-                    # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't
-                    # understand that. strip :arch then
-                    (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
-                    if arch == get_current_arch() and pkg_without_arch_name in self.cache:  # false positive, available
-                        continue
-                    elif arch not in get_foreign_archs():  # relax the constraint
-                        logger.info("{} isn't available on this platform, but {} isn't enabled. So it may be available "
-                                    "later on".format(pkg_name, arch))
-                        continue
-                if "openjdk" in pkg_name:
-                    if not self.check_java_equiv(pkg_name):
+        is_available = self._get_bucket_state(bucket, 1)
+        if is_available is not None:
+            return is_available
+        # apt cache isn't thread safe, and we can check frameworks in parallel
+        with self._cache_lock:
+            all_in_cache = True
+            for pkg_name in bucket:
+                if ' | ' in pkg_name:
+                    for package in pkg_name.split(' | '):
+                        if self.is_bucket_available([package]):
+                            bucket.remove(pkg_name)
+                            bucket.append(package)
+                            pkg_name = package
+                            break
+                if pkg_name not in self.cache:
+                    # this can be also a foo:arch and we don't have <arch> added. Tell is may be available
+                    if ":" in pkg_name:
+                        # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't
+                        # understand that. strip :arch then
+                        (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
+                        # false positive, available
+                        if arch == get_current_arch() and pkg_without_arch_name in self.cache:
+                            continue
+                        elif arch not in get_foreign_archs():  # relax the constraint
+                            logger.info("{} isn't available on this platform, but {} isn't enabled. So it may be "
+                                        "available later on".format(pkg_name, arch))
+                            continue
+                    if "openjdk" in pkg_name:
+                        if not self.check_java_equiv(pkg_name):
+                            all_in_cache = False
+                    else:
+                        logger.info("{} isn't available on this platform".format(pkg_name))
                         all_in_cache = False
-                else:
-                    logger.info("{} isn't available on this platform".format(pkg_name))
-                    all_in_cache = False
-        return all_in_cache
+            return all_in_cache
 
     def is_bucket_uptodate(self, bucket):
         """Check if the bucket is installed and up to date
 
         The bucket is a list of packages to check if installed."""
         logger.debug("Check if {} is up to date".format(bucket))
+        with self._cache_lock:
+            return self._is_bucket_uptodate(bucket)
+
+    def _is_bucket_uptodate(self, bucket):
+        """Check if the bucket is installed and up to date, with the cache lock held"""
         is_installed_and_uptodate = True
         for pkg_name in bucket:
             if ' | ' in pkg_name:
@@ -171,6 +230,154 @@ class RequirementsHandler(object, metaclass=Singleton):
             return True
         return False
 
+    def plan_bucket(self, bucket):
+        """Compute what installing a bucket would require, without installing anything
+
+        The bucket is marked for install in an action group, and the marks are cleared right after, so that the
+        main cache isn't modified.
+        Return a RequirementsPlan with the number of packages to install or upgrade (including dependencies),
+        the download size and the additional installed size in bytes."""
+        logger.debug("Plan installation of {}".format(bucket))
+        # apt cache isn't thread safe, and a prefetch can be marking it meanwhile
+        with self._cache_lock:
+            return self._plan_bucket(bucket)
+
+    def _plan_bucket(self, bucket):
+        """Compute what installing a bucket would require, with the cache lock held"""
+        if self.is_bucket_uptodate(bucket):
+            return self.RequirementsPlan(packages_count=0, download_size=0, installed_size=0)
+
+        try:
+            with self.cache.actiongroup():
+                for pkg_name in bucket:
+                    # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't
+                    # understand that. strip :arch then
+                    if ":" in pkg_name:
+                        (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
+                        if arch == get_current_arch():
+                            pkg_name = pkg_without_arch_name
+                    if pkg_name not in self.cache:
+                        # foreign arch not enabled yet or java equivalent installed: we can't know the cost in advance
+                        logger.debug("Can't plan installation of {} as it's not in the cache".format(pkg_name))
+                        continue
+                    pkg = self.cache[pkg_name]
+                    if pkg.is_installed and not pkg.is_upgradable:
+                        continue
+                    pkg.mark_install()
+            depcache = self.cache._depcache
+            return self.RequirementsPlan(packages_count=depcache.inst_count, download_size=depcache.deb_size,
+                                         installed_size=max(depcache.usr_size, 0))
+        finally:
+            self.cache.clear()
+
+    def prefetch_bucket(self, bucket):
+        """Speculatively download the archives of a bucket, without installing anything
+
+        Archives are downloaded as the current user in a temporary directory while we are still fetching
+        the framework metadata. They are then reused by a following install_bucket(), once the user
+        accepted the installation. The request is queued like any installation."""
+        logger.info("Prefetch {} pending".format(bucket))
+        future = self.executor.submit(self._really_prefetch_bucket, bucket)
+        future.tag_bucket = bucket
+        future.add_done_callback(self._on_prefetch_done)
+
+    def _really_prefetch_bucket(self, bucket):
+        """Really download bucket archives to the prefetch directory"""
+        # only mark the apt cache with the lock held: other lookups can go on while downloading
+        with self._cache_lock:
+            if self.is_bucket_uptodate(bucket):
+                return
+            try:
+                for pkg_name in bucket:
+                    if ":" in pkg_name:
+                        (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
+                        if arch == get_current_arch():
+                            pkg_name = pkg_without_arch_name
+                    # foreign archs not enabled yet are only available once installing
+                    if pkg_name not in self.cache:
+                        continue
+                    pkg = self.cache[pkg_name]
+                    if pkg.is_installed and not pkg.is_upgradable:
+                        continue
+                    pkg.mark_install(auto_fix=False)
+                to_fetch = [(pkg.name, pkg.candidate, self._get_archive_name(pkg))
+                            for pkg in self.cache.get_changes() if not pkg.marked_delete]
+            finally:
+                self.cache.clear()
+        if self._prefetch_dir is None:
+            self._prefetch_dir = tempfile.TemporaryDirectory(prefix="umake-apt-")
+        for (pkg_name, version, archive_name) in to_fetch:
+            logger.debug("Prefetching {} {}".format(pkg_name, version.version))
+            archive_path = version.fetch_binary(destdir=self._prefetch_dir.name)
+            prefetched_path = os.path.join(self._prefetch_dir.name, archive_name)
+            if os.path.islink(archive_path):
+                # archives of local sources are symlinked, which we don't follow once installing: copy them
+                target_path = os.path.realpath(archive_path)
+                os.remove(archive_path)
+                shutil.copyfile(target_path, prefetched_path)
+            else:
+                os.rename(archive_path, prefetched_path)
+
+    @staticmethod
+    def _get_archive_name(pkg):
+        """Return the archive name of the package candidate version, the same way apt names it in its archives"""
+        version = pkg.candidate
+        return "{}_{}_{}.deb".format(pkg.shortname, version.version.replace(":", "%3a"), version.architecture)
+
+    def _on_prefetch_done(self, future):
+        """Prefetching is only an optimization: don't report errors, the installation will refetch"""
+        if future.exception():
+            logger.info("Couldn't prefetch {}: {}".format(future.tag_bucket, future.exception()))
+        else:
+            logger.debug("{} prefetched".format(future.tag_bucket))
+
+    def _use_prefetched_archives(self):
+        """Copy previously prefetched archives of marked packages in the apt archives directory
+
+        The prefetch directory is owned by the user: only archives matching the hash of their candidate version in
+        the apt cache are copied. Need to be called as root, once the packages to install are marked."""
+        if self._prefetch_dir is None:
+            return
+        expected_hashes = {}
+        for pkg in self.cache.get_changes():
+            if not pkg.marked_delete:
+                expected_hashes[self._get_archive_name(pkg)] = pkg.candidate.sha256
+        archives_dir = apt.apt_pkg.config.find_dir("Dir::Cache::Archives")
+        for archive_name in os.listdir(self._prefetch_dir.name):
+            if archive_name not in expected_hashes:
+                logger.debug("Ignore prefetched {}, not to be installed".format(archive_name))
+                continue
+            try:
+                self._copy_verified_archive(os.path.join(self._prefetch_dir.name, archive_name), archives_dir,
+                                            expected_hashes[archive_name])
+            except OSError as e:
+                logger.debug("Discard prefetched {}, it can't be copied: {}".format(archive_name, e))
+        self._prefetch_dir.cleanup()
+        self._prefetch_dir = None
+
+    @staticmethod
+    def _copy_verified_archive(archive_path, archives_dir, sha256):
+        """Copy archive_path in archives_dir only if its content matches sha256
+
+        What is copied is what is hashed, in the apt partial directory, so that the archive can't be replaced
+        between verifying and copying it."""
+        archive_name = os.path.basename(archive_path)
+        partial_path = os.path.join(archives_dir, "partial", archive_name)
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        checksum = hashlib.sha256()
+        with open(os.open(archive_path, os.O_RDONLY | os.O_NOFOLLOW), "rb") as src, open(partial_path, "wb") as dest:
+            for data in iter(lambda: src.read(2 ** 20), b""):
+                checksum.update(data)
+                dest.write(data)
+        if checksum.hexdigest() != sha256:
+            logger.warning("Prefetched {} doesn't match its expected hash, it will be downloaded again".format(
+                archive_name))
+            os.remove(partial_path)
+            return False
+        logger.debug("Use prefetched {}".format(archive_name))
+        os.rename(partial_path, os.path.join(archives_dir, archive_name))
+        return True
+
     def install_bucket(self, bucket, progress_callback, installed_callback):
         """Install a specific bucket. If any other bucket is in progress, queue the request
 
@@ -200,51 +407,54 @@ class RequirementsHandler(object, metaclass=Singleton):
         self.apt_fd = tempfile.NamedTemporaryFile(delete=False)
         self.apt_fd.close()
 
-        if self.is_bucket_uptodate(bucket):
-            return True
+        # the apt cache is shared with the requirements checks of other threads while marking and committing
+        with self._cache_lock:
+            if self.is_bucket_uptodate(bucket):
+                return True
 
-        need_cache_reload = False
-        for pkg_name in bucket:
-            if ":" in pkg_name:
-                arch = pkg_name.split(":", -1)[-1]
-                need_cache_reload = need_cache_reload or add_foreign_arch(arch)
+            need_cache_reload = False
+            for pkg_name in bucket:
+                if ":" in pkg_name:
+                    arch = pkg_name.split(":", -1)[-1]
+                    need_cache_reload = need_cache_reload or add_foreign_arch(arch)
 
-        if need_cache_reload:
-            with as_root():
+            if need_cache_reload:
+                with as_root():
+                    self._force_reload_apt_cache()
+                    self.cache.update()
                 self._force_reload_apt_cache()
-                self.cache.update()
-            self._force_reload_apt_cache()
 
-        # mark for install and so on
-        for pkg_name in bucket:
-            # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't understand that
-            # strip :arch then
-            if ":" in pkg_name:
-                (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
-                if arch == get_current_arch():
-                    pkg_name = pkg_without_arch_name
-            try:
-                pkg = self.cache[pkg_name]
-                if pkg.is_installed and pkg.is_upgradable:
-                    logger.debug("Marking {} for upgrade".format(pkg_name))
-                    pkg.mark_upgrade()
-                else:
-                    logger.debug("Marking {} for install".format(pkg_name))
-                    pkg.mark_install(auto_fix=False)
-            except Exception as msg:
-                message = "Can't mark for install {}: {}".format(pkg_name, msg)
-                raise BaseException(message)
-
-        # this can raise on installedArchives() exception if the commit() fails
-        with as_root():
-            self.cache.commit(fetch_progress=self._FetchProgress(current_bucket,
-                                                                 self.STATUS_DOWNLOADING,
-                                                                 current_bucket["progress_callback"]),
-                              install_progress=self._InstallProgress(current_bucket,
-                                                                     self.STATUS_INSTALLING,
-                                                                     current_bucket["progress_callback"],
-                                                                     self._force_reload_apt_cache,
-                                                                     self.apt_fd.name))
+            # mark for install and so on
+            for pkg_name in bucket:
+                # /!\ danger: if current arch == ':appended_arch', on a non multiarch system, dpkg doesn't understand
+                # that strip :arch then
+                if ":" in pkg_name:
+                    (pkg_without_arch_name, arch) = pkg_name.split(":", -1)
+                    if arch == get_current_arch():
+                        pkg_name = pkg_without_arch_name
+                try:
+                    pkg = self.cache[pkg_name]
+                    if pkg.is_installed and pkg.is_upgradable:
+                        logger.debug("Marking {} for upgrade".format(pkg_name))
+                        pkg.mark_upgrade()
+                    else:
+                        logger.debug("Marking {} for install".format(pkg_name))
+                        pkg.mark_install(auto_fix=False)
+                except Exception as msg:
+                    message = "Can't mark for install {}: {}".format(pkg_name, msg)
+                    raise BaseException(message)
+
+            # this can raise on installedArchives() exception if the commit() fails
+            with as_root():
+                self._use_prefetched_archives()
+                self.cache.commit(fetch_progress=self._FetchProgress(current_bucket,
+                                                                     self.STATUS_DOWNLOADING,
+                                                                     current_bucket["progress_callback"]),
+                                  install_progress=self._InstallProgress(current_bucket,
+                                                                         self.STATUS_INSTALLING,
+                                                                         current_bucket["progress_callback"],
+                                                                         self._force_reload_apt_cache,
+                                                                         self.apt_fd.name))
 
         return True
 
@@ -266,12 +476,50 @@ class RequirementsHandler(object, metaclass=Singleton):
         future.tag_bucket["installed_callback"](result)
 
     def _force_reload_apt_cache(self):
-        """Loop on loading apt cache in case something else is updating"""
+        """Loop on loading apt cache in case something else is updating
+
+        We wait for the dpkg lock to be released and use an exponential backoff between attempts
+        instead of hammering apt while another process holds it."""
+        delay = self.RELOAD_BACKOFF_START
+        while True:
+            self._wait_for_dpkg_lock(delay)
+            try:
+                self.cache.open()
+                return
+            except SystemError:
+                logger.debug("apt cache is locked, retrying in {}s".format(delay))
+                time.sleep(delay)
+                delay = min(delay * 2, self.RELOAD_BACKOFF_MAX)
+
+    def _is_dpkg_locked(self):
+        """Check if another process holds the dpkg frontend lock
+
+        We don't open the lock file ourself: closing any fd on it would release the locks that our own
+        process may hold during a commit(). Instead, we look for it in /proc/locks.
+        Return False if we can't probe it (no lock file, no /proc)."""
         try:
-            self.cache.open()
-        except SystemError:
-            time.sleep(1)
-            self._force_reload_apt_cache()
+            st = os.stat(self.DPKG_LOCK_FILE)
+            with open(self.PROC_LOCKS_FILE) as f:
+                locks = f.readlines()
+        except OSError:
+            return False
+        lock_id = "{:02x}:{:02x}:{}".format(os.major(st.st_dev), os.minor(st.st_dev), st.st_ino)
+        for lock in locks:
+            fields = lock.split()
+            # 1: POSIX  ADVISORY  WRITE 1234 08:01:131090 0 EOF (blocked locks have an extra "->" field)
+            if "->" in fields:
+                continue
+            with suppress(IndexError, ValueError):
+                if fields[5] == lock_id and int(fields[4]) != os.getpid():
+                    return True
+        return False
+
+    def _wait_for_dpkg_lock(self, delay):
+        """Wait, with an exponential backoff starting at delay, for the dpkg lock to be released"""
+        while self._is_dpkg_locked():
+            logger.info("dpkg is locked by another process, waiting {}s".format(delay))
+            time.sleep(delay)
+            delay = min(delay * 2, self.RELOAD_BACKOFF_MAX)
 
     class _FetchProgress(apt.progress.base.AcquireProgress):
         """Progress handler for downloading a bucket"""
@@ -295,19 +543,27 @@ class RequirementsHandler(object, metaclass=Singleton):
             self._bucket = bucket
             self._status = status
             self._progress_callback = progress_callback
-            self._force_reload_apt_cache = force_load_apt_cache
+            self._force_load_apt_cache = force_load_apt_cache
             self._exchange_filename = exchange_filename
+            self._cache_reloaded = False
+
+        def _reload_apt_cache_once(self):
+            """Reload the apt cache only once per transaction, even if we get multiple errors"""
+            if self._cache_reloaded:
+                return
+            self._cache_reloaded = True
+            self._force_load_apt_cache()
 
         def error(self, pkg, msg):
             logger.error("{} installation finished with an error: {}".format(self._bucket['bucket'], msg))
-            self._force_reload_apt_cache()  # reload apt cache
+            self._reload_apt_cache_once()
             raise BaseException(msg)
 
         def finish_update(self):
             # warning: this function can be called even if dpkg failed (it raised an exception around commit()
             # DO NOT CALL directly the callbacks from there.
             logger.debug("Install for {} ended.".format(self._bucket['bucket']))
-            self._force_reload_apt_cache()  # reload apt cache
+            self._reload_apt_cache_once()
 
         def status_change(self, pkg, percent, status):
             logger.debug("{} install update: {}".format(self._bucket['bucket'], percent))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Facts about the current platform: dpkg architectures and distribution
+
+Those are read from files rather than by forking dpkg, as they are checked for nearly every framework. Results are
+cached by umake.tools for the whole process. dpkg is still asked when it may not use the default database, like a
+wrapper running it with another --root."""
+
+from glob import glob
+import logging
+import os
+from shutil import which
+import subprocess
+import sysconfig
+
+logger = logging.getLogger(__name__)
+
+DPKG_ARCH_FILE = "/var/lib/dpkg/arch"
+DPKG_CONFIG_FILES = ["/etc/dpkg/dpkg.cfg", "/etc/dpkg/dpkg.cfg.d/*"]
+SYSTEM_DPKG_PATHS = ["/usr/bin/dpkg", "/bin/dpkg"]
+
+# interpreter multiarch tuple to dpkg architecture
+MULTIARCH_TO_DPKG_ARCH = {
+    "x86_64-linux-gnu": "amd64",
+    "i386-linux-gnu": "i386",
+    "aarch64-linux-gnu": "arm64",
+    "arm-linux-gnueabihf": "armhf",
+    "arm-linux-gnueabi": "armel",
+    "powerpc64le-linux-gnu": "ppc64el",
+    "s390x-linux-gnu": "s390x",
+    "riscv64-linux-gnu": "riscv64"
+}
+
+
+def get_native_arch():
+    """Return dpkg native architecture
+
+    This is deduced from the interpreter multiarch tuple, only falling back to ask dpkg if we don't know it."""
+    arch = MULTIARCH_TO_DPKG_ARCH.get(sysconfig.get_config_var("MULTIARCH"))
+    if arch is None:
+        logger.debug("Unknown interpreter multiarch tuple, asking dpkg for native architecture")
+        arch = subprocess.check_output(["dpkg", "--print-architecture"], universal_newlines=True).rstrip("\n")
+    return arch
+
+
+def get_foreign_archs(native_arch):
+    """Return foreign architectures enabled in dpkg database and configuration files"""
+    dpkg_path = which("dpkg")
+    if dpkg_path is not None and os.path.realpath(dpkg_path) not in SYSTEM_DPKG_PATHS:
+        logger.debug("{} may not use the default dpkg database, asking it for foreign architectures".format(dpkg_path))
+        return subprocess.check_output(["dpkg", "--print-foreign-architectures"],
+                                       universal_newlines=True).rstrip("\n").split()
+    arch_path = DPKG_ARCH_FILE
+    if "DPKG_ADMINDIR" in os.environ:
+        arch_path = os.path.join(os.environ["DPKG_ADMINDIR"], "arch")
+    archs = []
+    try:
+        with open(arch_path) as f:
+            archs.extend(line.strip() for line in f)
+    except FileNotFoundError:
+        logger.debug("No dpkg architectures file, no foreign architecture added with dpkg --add-architecture")
+    # older dpkg versions were declaring them in configuration files
+    for pattern in DPKG_CONFIG_FILES:
+        for config_path in sorted(glob(pattern)):
+            try:
+                with open(config_path) as f:
+                    for line in f:
+                        words = line.split()
+                        if len(words) == 2 and words[0] == "foreign-architecture":
+                            archs.append(words[1])
+            except (IsADirectoryError, PermissionError):
+                continue
+    foreign_archs = []
+    for arch in archs:
+        if arch and arch != native_arch and arch not in foreign_archs:
+            foreign_archs.append(arch)
+    return foreign_archs
+
+
+def read_os_release(os_release_path):
+    """Return a dict of os-release file keys and their unquoted values"""
+    os_release = {}
+    try:
+        with open(os_release_path) as os_release_file:
+            for line in os_release_file:
+                key, sep, value = line.strip().partition("=")
+                if sep:
+                    os_release[key] = value.strip('"\'')
+    except (FileNotFoundError, IOError) as e:
+        message = "Can't open os-release file: {}".format(e)
+        logger.error(message)
+        raise BaseException(message)
+    return os_release
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2014 Canonical
+#
+# Authors:
+#  Didier Roche
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Cached registry of available categories and frameworks
+
+This enables finding which module to import for a given command line without importing and instantiating every
+framework. This module should stay cheap to import: no apt, GLib or network modules here."""
+
+import argparse
+from contextlib import suppress
+import json
+import logging
+import os
+import pkgutil
+from umake import settings
+from xdg import BaseDirectory
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FORMAT = 3
+FRAMEWORKS_PATH = os.path.join(os.path.dirname(__file__), "frameworks")
+FRAMEWORKS_PACKAGE = "umake.frameworks"
+
+
+def get_registry_path():
+    """Return the frameworks registry cache file path"""
+    return os.path.join(BaseDirectory.xdg_cache_home, settings.CACHE_DIRNAME, settings.FRAMEWORKS_REGISTRY_FILENAME)
+
+
+def get_local_frameworks_paths(user_frameworks_path=None):
+    """Return local frameworks paths, by order of preference (1. environment path, 2. user path if any)"""
+    local_paths = []
+    if user_frameworks_path:
+        local_paths.append(user_frameworks_path)
+    environment_path = os.environ.get(settings.UMAKE_FRAMEWORKS_ENVIRON_VARIABLE)
+    if environment_path:
+        local_paths.insert(0, environment_path)
+    return local_paths
+
+
+def get_frameworks_modules(frameworks_path, frameworks_package, local_paths):
+    """Return the ordered list of (module_name, module_path) of frameworks modules
+
+    Local modules are listed first, then the system ones from frameworks_path. Local modules are top level
+    ones while system ones are in frameworks_package."""
+    modules = []
+    for loader, module_name, ispkg in pkgutil.iter_modules(path=local_paths):
+        modules.append((module_name, _get_module_path(loader, module_name, ispkg)))
+    for loader, module_name, ispkg in pkgutil.iter_modules(path=[frameworks_path]):
+        modules.append(("{}.{}".format(frameworks_package, module_name), _get_module_path(loader, module_name, ispkg)))
+    return modules
+
+
+def _get_module_path(loader, module_name, ispkg):
+    """Return module source path from its pkgutil loader, or None if we can't find it"""
+    with suppress(AttributeError):
+        if ispkg:
+            return os.path.join(loader.path, module_name, "__init__.py")
+        return os.path.join(loader.path, module_name + ".py")
+    return None
+
+
+def get_modules_state(modules):
+    """Return the current state of frameworks modules, to invalidate the registry when they change
+
+    modules is a list of (module_name, module_path). Return None if any of them can't be checked."""
+    modules_state = {}
+    for module_name, module_path in modules:
+        try:
+            modules_state[module_name] = [module_path, os.stat(module_path).st_mtime]
+        except (TypeError, OSError):
+            logger.debug("Can't get state of {} module".format(module_name))
+            return None
+    return modules_state
+
+
+def _get_locale():
+    """Descriptions are translated, so the registry depends on the locale settings"""
+    return [os.environ.get(var) for var in ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")]
+
+
+def load(modules_state):
+    """Return the registry content if it's still valid for those modules state, None otherwise"""
+    if modules_state is None:
+        return None
+    try:
+        with open(get_registry_path(), encoding="utf-8") as f:
+            registry = json.load(f)
+    except (OSError, ValueError):
+        logger.debug("No valid frameworks registry found")
+        return None
+    try:
+        # new releases change modules path or mtime
+        if registry["format"] != REGISTRY_FORMAT or registry["locale"] != _get_locale() or\
+           registry["modules"] != modules_state:
+            logger.debug("Frameworks registry is outdated")
+            return None
+        if not isinstance(registry["categories"], dict):
+            raise TypeError
+    except (TypeError, KeyError):
+        logger.debug("Invalid frameworks registry")
+        return None
+    return registry
+
+
+def load_current(user_frameworks_path=None):
+    """Return the registry content if still valid for currently available frameworks modules, None otherwise
+
+    This doesn't import any framework module."""
+    local_paths = get_local_frameworks_paths(user_frameworks_path)
+    modules = get_frameworks_modules(FRAMEWORKS_PATH, FRAMEWORKS_PACKAGE, local_paths)
+    return load(get_modules_state(modules))
+
+
+def save(modules_state, categories):
+    """Save a new registry for those modules state
+
+    categories is a dict of categories with their frameworks, in the format detailed in get_targeted_framework()"""
+    if modules_state is None:
+        return
+    registry = {
+        "format": REGISTRY_FORMAT,
+        "locale": _get_locale(),
+        "modules": modules_state,
+        "categories": categories
+    }
+    registry_path = get_registry_path()
+    logger.debug("Saving frameworks registry in {}".format(registry_path))
+    try:
+        os.makedirs(os.path.dirname(registry_path), exist_ok=True)
+        with open(registry_path + ".new", "w", encoding="utf-8") as f:
+            json.dump(registry, f)
+        os.rename(registry_path + ".new", registry_path)
+    except OSError as e:
+        # the registry is only a cache, we can live without it
+        logger.info("Couldn't save frameworks registry: {}".format(e))
+        with suppress(OSError):
+            os.remove(registry_path + ".new")
+
+
+def get_targeted_framework(registry, args):
+    """Return (category_name, framework_name) that those command line args target
+
+    Return None if it can't be determined from the registry alone (no or unknown framework, help on a category…)
+
+    registry categories are in the form of:
+    {
+        'category_name': {
+            'description':
+            'is_main_category': True or False
+            'frameworks': {
+                'framework_name': {
+                    'module': module name to import
+                    'class': class name in this module
+                    'description':
+                    'is_category_default': True or False
+                    'only_for_removal': True or False
+                    'only_on_archs': []
+                    'only_ubuntu': True or False
+                    'only_ubuntu_version': []
+                    'required_files_path': [] of files relative to the install path, to check it's installed
+                    'desktop_filename': None or launcher desktop file name, to check it's installed
+                    'arguments': [] of command line arguments, see get_parser_arguments()
+                }
+            }
+        }
+    }"""
+    positional_args = [arg for arg in args if not arg.startswith('-')]
+    help_requested = "--help" in args or "-h" in args
+    if not positional_args:
+        return None
+    categories = registry["categories"]
+    category_name = positional_args[0]
+    category = categories.get(category_name)
+    if category and not category["is_main_category"]:
+        frameworks = category["frameworks"]
+        if len(positional_args) > 1 and positional_args[1] in frameworks:
+            return (category_name, positional_args[1])
+        # default framework, with the same logic than the command line parser
+        if help_requested:
+            return None
+        if len(positional_args) == 1 or os.path.sep in positional_args[1]:
+            for framework_name, framework in frameworks.items():
+                if framework["is_category_default"]:
+                    return (category_name, framework_name)
+        return None
+    for category_name, category in categories.items():
+        if category["is_main_category"] and positional_args[0] in category["frameworks"]:
+            return (category_name, positional_args[0])
+    return None
+
+
+def get_parser_arguments(parser):
+    """Return a serializable list of the arguments of this parser, to be able to recreate it"""
+    arguments = []
+    for action in parser._actions:
+        if isinstance(action, argparse._HelpAction):
+            continue
+        arguments.append({
+            "option_strings": action.option_strings,
+            "dest": action.dest,
+            "nargs": action.nargs,
+            "help": action.help,
+            "store_true": isinstance(action, argparse._StoreTrueAction)
+        })
+    return arguments
+
+
+def add_parser_arguments(parser, arguments):
+    """Add to this parser arguments from get_parser_arguments()"""
+    for argument in arguments:
+        if argument["store_true"]:
+            parser.add_argument(*argument["option_strings"], dest=argument["dest"], action="store_true",
+                                help=argument["help"])
+        elif not argument["option_strings"]:
+            parser.add_argument(argument["dest"], nargs=argument["nargs"], help=argument["help"])
+        else:
+            parser.add_argument(*argument["option_strings"], dest=argument["dest"], nargs=argument["nargs"],
+                                help=argument["help"])
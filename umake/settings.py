@@ -17,18 +17,31 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-import os
-import requests
-import re
+from contextlib import suppress
 import json
+import logging
+import os
+import threading
+import time
+from xdg import BaseDirectory
 from xdg.BaseDirectory import xdg_data_home
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_INSTALL_TOOLS_PATH = os.path.expanduser(os.path.join(xdg_data_home, "umake"))
 DEFAULT_BINARY_LINK_PATH = os.path.expanduser(os.path.join(DEFAULT_INSTALL_TOOLS_PATH, "bin"))
 OLD_CONFIG_FILENAME = "udtc"
 CONFIG_FILENAME = "umake"
+CACHE_DIRNAME = "umake"
+FRAMEWORKS_REGISTRY_FILENAME = "frameworks-registry.json"
+LATEST_VERSION_FILENAME = "latest-version.json"
+LATEST_VERSION_TTL = 24 * 60 * 60
+LATEST_VERSION_TIMEOUT = 5
+BATCH_INSTALL_MAX_PARALLEL_DOWNLOADS = 4
 OS_RELEASE_FILE = "/etc/os-release"
 UMAKE_FRAMEWORKS_ENVIRON_VARIABLE = "UMAKE_FRAMEWORKS"
+UMAKE_NO_VERSION_CHECK_ENVIRON_VARIABLE = "UMAKE_NO_VERSION_CHECK"
+UMAKE_SWIFT_KEYS_ENVIRON_VARIABLE = "UMAKE_SWIFT_KEYS_FINGERPRINTS"
 
 from_dev = False
 
@@ -53,10 +66,66 @@ def get_version():
 
 def get_latest_version():
     '''Get latest available version from github'''
+    import requests
     try:
-        page = requests.get("https://api.github.com/repos/ubuntu/ubuntu-make/releases/latest")
+        page = requests.get("https://api.github.com/repos/ubuntu/ubuntu-make/releases/latest",
+                            timeout=LATEST_VERSION_TIMEOUT)
         page.raise_for_status()
     except Exception as e:
         raise e
     latest = page.json().get("tag_name")
     return latest
+
+
+def get_latest_version_path():
+    '''Return the latest version cache file path'''
+    return os.path.join(BaseDirectory.xdg_cache_home, CACHE_DIRNAME, LATEST_VERSION_FILENAME)
+
+
+def get_cached_latest_version():
+    '''Return the latest available version from the cache, None if not cached or expired
+
+    This never hits the network: the cache is refreshed in background by start_latest_version_check().'''
+    try:
+        with open(get_latest_version_path(), encoding="utf-8") as f:
+            cache = json.load(f)
+        if time.time() - cache["timestamp"] > LATEST_VERSION_TTL:
+            logger.debug("Cached latest version is expired")
+            return None
+        return cache["version"]
+    except (OSError, ValueError, TypeError, KeyError):
+        logger.debug("No valid cached latest version")
+        return None
+
+
+def _refresh_latest_version():
+    '''Fetch latest available version and save it in the cache'''
+    try:
+        cache = {"version": get_latest_version(), "timestamp": time.time()}
+    except Exception as e:
+        logger.debug("Couldn't fetch latest version: {}".format(e))
+        return
+    cache_path = get_latest_version_path()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".new", "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.rename(cache_path + ".new", cache_path)
+    except OSError as e:
+        logger.debug("Couldn't save latest version: {}".format(e))
+        with suppress(OSError):
+            os.remove(cache_path + ".new")
+
+
+def start_latest_version_check():
+    '''Refresh in background the cached latest version if expired, unless disabled by the environment
+
+    Return the started thread, if any. It's a daemon one, so that it never blocks exiting.'''
+    if os.environ.get(UMAKE_NO_VERSION_CHECK_ENVIRON_VARIABLE):
+        logger.debug("Latest version check disabled")
+        return None
+    if get_cached_latest_version() is not None:
+        return None
+    thread = threading.Thread(target=_refresh_latest_version, daemon=True)
+    thread.start()
+    return thread
@@ -17,12 +17,13 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-from collections import namedtuple
+from collections import deque, namedtuple
 from contextlib import contextmanager, suppress
 from enum import unique, Enum
+import fcntl
 from gettext import gettext as _
-from gi.repository import GLib, Gio
 from glob import glob
+import json
 import logging
 import os
 import re
@@ -31,26 +32,26 @@ import signal
 import subprocess
 import sys
 from textwrap import dedent
-from time import sleep
+from time import monotonic, sleep
 from threading import Lock
-from umake import settings
+from umake import platform_facts, settings
 from xdg.BaseDirectory import load_first_config, xdg_config_home, xdg_data_home
-import yaml
-import yaml.scanner
-import yaml.parser
 
 logger = logging.getLogger(__name__)
 
 # cache current arch. Shouldn't change in the life of the process ;)
 _current_arch = None
 _foreign_arch = None
-_version = None
-_id = None
+_os_release = None
 
 profile_tag = _("# Ubuntu make installation of {}\n")
 
 root_lock = Lock()
 
+# verify launcher favorites changes with short retries
+LAUNCHER_PIN_ATTEMPTS = 10
+LAUNCHER_PIN_RETRY_DELAY = 0.1
+
 
 @unique
 class ChecksumType(Enum):
@@ -80,21 +81,29 @@ class ConfigHandler(metaclass=Singleton):
 
     def __init__(self):
         """Load the config"""
-        self._config = {}
+        self._pending_updates = []
+        self._batch_depth = 0
         old_config_file = load_first_config(settings.OLD_CONFIG_FILENAME)
         config_file = load_first_config(settings.CONFIG_FILENAME)
         if old_config_file:
             if not config_file:
                 config_file = old_config_file.replace(settings.OLD_CONFIG_FILENAME, settings.CONFIG_FILENAME)
             os.rename(old_config_file, config_file)
+        self._config = self._load(config_file)
+
+    def _load(self, config_file):
+        """Return config_file content, {} if it doesn't exist or is invalid"""
         logger.debug("Opening {}".format(config_file))
+        import yaml
         try:
             with open(config_file) as f:
-                self._config = yaml.safe_load(f)
+                # prefer the libyaml based loader, way faster than the pure python one
+                return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
         except (TypeError, FileNotFoundError):
             logger.info("No configuration file found")
-        except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
+        except yaml.YAMLError as e:
             logger.error("Invalid configuration file found: {}".format(e))
+        return {}
 
     @property
     def config(self):
@@ -102,12 +111,67 @@ class ConfigHandler(metaclass=Singleton):
 
     @config.setter
     def config(self, config):
+        with self._lock():
+            self._save(config)
+        self._config = config
+
+    def update(self, update_function):
+        """Apply update_function, modifying in place the config dict it receives, and save the result
+
+        The latest saved config is reloaded before applying it, so that we don't lose changes saved meanwhile by
+        concurrent umake processes. In a batch(), the config is only saved once at the end of it."""
+        if self._config is None:
+            self._config = {}
+        update_function(self._config)
+        if self._batch_depth > 0:
+            self._pending_updates.append(update_function)
+            return
+        self._save_updates([update_function])
+
+    @contextmanager
+    def batch(self):
+        """Only save the config once for all update() calls in this context"""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._pending_updates:
+                updates = self._pending_updates
+                self._pending_updates = []
+                self._save_updates(updates)
+
+    def _save_updates(self, update_functions):
+        """Save the latest saved config with update_functions applied"""
+        with self._lock():
+            config = self._load(load_first_config(settings.CONFIG_FILENAME)) or {}
+            for update_function in update_functions:
+                update_function(config)
+            self._save(config)
+        self._config = config
+
+    @contextmanager
+    def _lock(self):
+        """Lock the config between concurrent umake processes"""
         config_file = os.path.join(xdg_config_home, settings.CONFIG_FILENAME)
-        logging.debug("Saving new configuration: {} in {}".format(config, config_file))
         os.makedirs(os.path.dirname(config_file), exist_ok=True)
-        with open(config_file, 'w') as f:
-            yaml.dump(config, f, default_flow_style=False)
-        self._config = config
+        with open(config_file + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, config):
+        """Save atomically config content, the lock being held"""
+        config_file = os.path.join(xdg_config_home, settings.CONFIG_FILENAME)
+        logging.debug("Saving new configuration: {} in {}".format(config, config_file))
+        import yaml
+        with open(config_file + ".new", 'w') as f:
+            yaml.dump(config, f, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper), default_flow_style=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(config_file + ".new", config_file)
 
 
 class NoneDict(dict):
@@ -127,11 +191,47 @@ class classproperty(object):
         return self.f(owner)
 
 
+class DispatchStats(object):
+    """Main loop dispatches statistics: queue depth and latency between scheduling and running a call"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.iterations = 0
+        self.max_queue_depth = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def add_queued(self, queue_depth):
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def add_dispatched(self, latency):
+        self.count += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def __str__(self):
+        average_latency = self.total_latency / self.count if self.count else 0
+        return ("{} calls in {} main loop iterations, max queue depth: {}, average latency: {:.1f} ms, "
+                "max latency: {:.1f} ms".format(self.count, self.iterations, self.max_queue_depth,
+                                                average_latency * 1000, self.max_latency * 1000))
+
+
 class MainLoop(object, metaclass=Singleton):
     """Mainloop simple wrapper"""
 
+    # run all calls pending from other threads in a single main loop iteration, instead of one per iteration
+    batch_dispatches = True
+
     def __init__(self):
+        from gi.repository import GLib
         self.mainloop = GLib.MainLoop()
+        self.dispatch_stats = DispatchStats()
+        self._pending_calls = deque()
+        self._pending_calls_lock = Lock()
+        self._dispatch_source_id = None
         # Glib steals the SIGINT handler and so, causes issue in the callback
         # https://bugzilla.gnome.org/show_bug.cgi?id=622084
         signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -140,15 +240,45 @@ class MainLoop(object, metaclass=Singleton):
         self.mainloop.run()
 
     def quit(self, status_code=0, raise_exception=True):
+        from gi.repository import GLib
         GLib.timeout_add(80, self._clean_up, status_code)
         # only raises exception if not turned down (like in tests, where we are not in the mainloop for sure)
         if raise_exception:
             raise self.ReturnMainLoop()
 
     def _clean_up(self, exit_code):
+        logger.debug("Main loop dispatches: {}".format(self.dispatch_stats))
         self.mainloop.quit()
         sys.exit(exit_code)
 
+    def _schedule_call(self, function, args, kwargs):
+        """Queue function to be called in the main loop thread, and schedule the queue dispatch if needed
+
+        Return the id of the idle source which will dispatch that call."""
+        from gi.repository import GLib
+        with self._pending_calls_lock:
+            self._pending_calls.append((function, args, kwargs, monotonic()))
+            self.dispatch_stats.add_queued(len(self._pending_calls))
+            if self.batch_dispatches and self._dispatch_source_id is not None:
+                return self._dispatch_source_id
+            self._dispatch_source_id = GLib.idle_add(self._dispatch_pending_calls)
+            return self._dispatch_source_id
+
+    def _dispatch_pending_calls(self):
+        """Run pending calls in the main loop thread: all calls queued so far if batching, otherwise the first one"""
+        with self._pending_calls_lock:
+            if self.batch_dispatches:
+                calls = list(self._pending_calls)
+                self._pending_calls.clear()
+            else:
+                calls = [self._pending_calls.popleft()] if self._pending_calls else []
+            self._dispatch_source_id = None
+        self.dispatch_stats.iterations += 1
+        for (function, args, kwargs, queued_time) in calls:
+            self.dispatch_stats.add_dispatched(monotonic() - queued_time)
+            function(*args, **kwargs)
+        return False
+
     @staticmethod
     def in_mainloop_thread(function):
         """Decorator to run a function in a mainloop thread"""
@@ -161,10 +291,11 @@ class MainLoop(object, metaclass=Singleton):
                 pass
             except BaseException:
                 logger.exception("Unhandled exception")
+                from gi.repository import GLib
                 GLib.idle_add(MainLoop().quit, 1, False)
 
         def inner(*args, **kwargs):
-            return GLib.idle_add(wrapper, *args, **kwargs)
+            return MainLoop()._schedule_call(wrapper, args, kwargs)
         return inner
 
     class ReturnMainLoop(BaseException):
@@ -195,7 +326,7 @@ def get_current_arch():
     """
     global _current_arch
     if _current_arch is None:
-        _current_arch = subprocess.check_output(["dpkg", "--print-architecture"], universal_newlines=True).rstrip("\n")
+        _current_arch = platform_facts.get_native_arch()
     return _current_arch
 
 
@@ -203,8 +334,7 @@ def get_foreign_archs():
     """Get foreign architectures that were enabled"""
     global _foreign_arch
     if _foreign_arch is None:
-        _foreign_arch = subprocess.check_output(["dpkg", "--print-foreign-architectures"], universal_newlines=True)\
-            .rstrip("\n").split()
+        _foreign_arch = platform_facts.get_foreign_archs(get_current_arch())
     return _foreign_arch
 
 
@@ -226,46 +356,29 @@ def add_foreign_arch(new_arch):
     return arch_added
 
 
+def _get_os_release():
+    """Return os-release content, parsed once"""
+    global _os_release
+    if _os_release is None:
+        _os_release = platform_facts.read_os_release(settings.OS_RELEASE_FILE)
+    return _os_release
+
+
 def get_current_distro_id():
-    global _id
-    if _id is None:
-        try:
-            with open(settings.OS_RELEASE_FILE) as os_release_file:
-                for line in os_release_file:
-                    line = line.strip()
-                    if line.startswith('ID='):
-                        _id = line.split('=')[1]
-                        break
-        except (FileNotFoundError, IOError) as e:
-            message = "Can't open os-release file: {}".format(e)
-            logger.error(message)
-            raise BaseException(message)
-    return _id
+    return _get_os_release().get("ID")
 
 
 def get_current_distro_version(distro_name="ubuntu"):
     """Return current ubuntu version or raise an error if couldn't find any"""
-    global _version
-    if _version is None:
-        try:
-            with open(settings.OS_RELEASE_FILE) as os_release_file:
-                for line in os_release_file:
-                    line = line.strip()
-                    if line.startswith('ID='):
-                        if line != "ID={}".format(distro_name):
-                            break
-                    if line.startswith('VERSION_ID='):
-                        _version = line.split('=')[1].split('"')[1]
-                        break
-                else:
-                    message = "Couldn't find DISTRIB_RELEASE in {}".format(settings.OS_RELEASE_FILE)
-                    logger.error(message)
-                    raise BaseException(message)
-        except (FileNotFoundError, IOError) as e:
-            message = "Can't open os-release file: {}".format(e)
-            logger.error(message)
-            raise BaseException(message)
-    return _version
+    os_release = _get_os_release()
+    if os_release.get("ID", distro_name) != distro_name:
+        return None
+    try:
+        return os_release["VERSION_ID"]
+    except KeyError:
+        message = "Couldn't find DISTRIB_RELEASE in {}".format(settings.OS_RELEASE_FILE)
+        logger.error(message)
+        raise BaseException(message)
 
 
 def is_completion_mode():
@@ -304,6 +417,7 @@ def launcher_exists_and_is_pinned(desktop_filename):
     if os.environ.get("XDG_CURRENT_DESKTOP") != "Unity":
         logger.debug("Don't check launcher as current environment isn't Unity")
         return True
+    from gi.repository import Gio
     if "com.canonical.Unity.Launcher" not in Gio.Settings.list_schemas():
         logger.debug("In an Unity environment without the Launcher schema file")
         return False
@@ -339,21 +453,63 @@ def create_launcher(desktop_filename, content):
     with open(launcher_path, "w") as f:
         f.write(content)
 
+    launcher_tag = "application://{}".format(desktop_filename)
+    if _batched_launcher_tags is not None:
+        if launcher_tag not in _batched_launcher_tags:
+            _batched_launcher_tags.append(launcher_tag)
+        return
+    _pin_launchers([launcher_tag])
+
+
+_batched_launcher_tags = None
+
+
+@contextmanager
+def batch_launcher_pinning():
+    """Pin all launchers created in this context in the unity launcher at once at the end"""
+    global _batched_launcher_tags
+    if _batched_launcher_tags is not None:
+        yield
+        return
+    _batched_launcher_tags = []
+    try:
+        yield
+    finally:
+        launcher_tags = _batched_launcher_tags
+        _batched_launcher_tags = None
+        if launcher_tags:
+            _pin_launchers(launcher_tags)
+
+
+def _pin_launchers(launcher_tags):
+    """Add launcher_tags in unity launcher favorites, before running apps, with a single settings change"""
+    from gi.repository import Gio
     if "com.canonical.Unity.Launcher" not in Gio.Settings.list_schemas():
         logger.info("Don't create a launcher icon, as we are not under Unity")
         return
     gsettings = Gio.Settings(schema_id="com.canonical.Unity.Launcher", path="/com/canonical/unity/launcher/")
-    launcher_list = gsettings.get_strv("favorites")
-    launcher_tag = "application://{}".format(desktop_filename)
-    if launcher_tag not in launcher_list:
+    for attempt in range(LAUNCHER_PIN_ATTEMPTS + 1):
+        # read the favorites with new settings: the ones which made the previous change read it back, even if it
+        # wasn't applied
+        launcher_list = Gio.Settings(schema_id="com.canonical.Unity.Launcher",
+                                     path="/com/canonical/unity/launcher/").get_strv("favorites")
+        missing_tags = [tag for tag in launcher_tags if tag not in launcher_list]
+        if not missing_tags:
+            return
+        if attempt == LAUNCHER_PIN_ATTEMPTS:
+            break
+        if attempt > 0:
+            # a glib bug can drop a change made right after creating the settings object:
+            # https://bugzilla.gnome.org/show_bug.cgi?id=744030. Retry until it's applied instead of always waiting.
+            logger.debug("Launcher favorites change wasn't applied, retrying")
+            sleep(LAUNCHER_PIN_RETRY_DELAY)
         index = len(launcher_list)
         with suppress(ValueError):
             index = launcher_list.index("unity://running-apps")
-        launcher_list.insert(index, launcher_tag)
-        # FIXME: working around a bug in glib: https://bugzilla.gnome.org/show_bug.cgi?id=744030
-        sleep(1.5)
-        ##########
-        gsettings.set_strv("favorites", launcher_list)
+        gsettings.set_strv("favorites", launcher_list[:index] + missing_tags + launcher_list[index:])
+        # flush the change to the settings backend before checking it
+        Gio.Settings.sync()
+    logger.warning("Couldn't pin {} in the launcher".format(", ".join(launcher_tags)))
 
 
 def add_exec_link(exec_path, destination_name):
@@ -389,6 +545,16 @@ def strip_tags(content):
     return re.sub('<[^<]+?>', '', content)
 
 
+def load_first_json_element(content):
+    """Return the first element of the json array in content, without decoding the following elements
+
+    Raise a json.JSONDecodeError if content isn't a json array or if it's empty."""
+    start = re.match(r'\s*\[\s*', content)
+    if start is None:
+        raise json.JSONDecodeError("Expecting a json array", content, 0)
+    return json.JSONDecoder().raw_decode(content, start.end())[0]
+
+
 def switch_to_current_user():
     """Switch euid and guid to current user if current user is root"""
     if os.geteuid() != 0:
@@ -419,28 +585,104 @@ def _get_shell_profile_file_path():
     return os.path.join(os.path.expanduser('~'), profile_filename)
 
 
-def remove_framework_envs_from_user(framework_tag):
-    """Remove all envs from user if found"""
-    profile_filepath = _get_shell_profile_file_path()
-    content = ""
-    framework_header = profile_tag.format(framework_tag)
-    try:
-        with open(profile_filepath, "r", encoding='utf-8') as f:
-            content = f.read()
-    except FileNotFoundError:
+class ShellProfile():
+    """Shell profile content, parsed once into frameworks env blocks
+
+    Each framework block starts with its profile_tag header and ends with an empty line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._blocks = []
+        try:
+            with open(path, "r", encoding='utf-8') as f:
+                self._initial_content = f.read()
+        except FileNotFoundError:
+            self._initial_content = None
+        self._parse(self._initial_content or "")
+
+    def _parse(self, content):
+        """Split content in a list of (framework_tag, text), framework_tag being None outside of framework blocks"""
+        header_prefix = profile_tag.split("{}")[0]
+        pos = 0
+        while True:
+            start = content.find(header_prefix, pos)
+            if start == -1:
+                self._blocks.append((None, content[pos:]))
+                return
+            header_end = content.find("\n", start)
+            framework_tag = content[start + len(header_prefix):header_end if header_end != -1 else len(content)]
+            end = content.find("\n\n", start)
+            end = len(content) if end == -1 else end + len("\n\n")
+            self._blocks.append((None, content[pos:start]))
+            self._blocks.append((framework_tag, content[start:end]))
+            pos = end
+
+    @property
+    def content(self):
+        return "".join(text for (framework_tag, text) in self._blocks)
+
+    def remove_framework(self, framework_tag):
+        """Remove all envs blocks of this framework"""
+        self._blocks = [block for block in self._blocks if block[0] != framework_tag]
+
+    def set_framework(self, framework_tag, content):
+        """Replace framework envs blocks with a new one at the end of the profile"""
+        self.remove_framework(framework_tag)
+        self._blocks.append((framework_tag, profile_tag.format(framework_tag) + content + "\n"))
+
+    def save(self):
+        """Write atomically the profile if it changed
+
+        A symlinked profile is written through, replacing its target and keeping its mode."""
+        content = self.content
+        if content == (self._initial_content or ""):
+            return
+        path = os.path.realpath(self.path)
+        with open(path + ".new", "w", encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        with suppress(FileNotFoundError):
+            shutil.copymode(path, path + ".new")
+        os.rename(path + ".new", path)
+        self._initial_content = content
+
+
+# shell profile shared by all changes in a batch_shell_profile_changes() context
+_batched_shell_profile = None
+
+
+@contextmanager
+def batch_shell_profile_changes():
+    """Parse the shell profile once, and only save it once at the end for all env changes in this context"""
+    global _batched_shell_profile
+    if _batched_shell_profile is not None:
+        yield
         return
-    if framework_header not in content:
+    _batched_shell_profile = ShellProfile(_get_shell_profile_file_path())
+    try:
+        yield
+    finally:
+        shell_profile = _batched_shell_profile
+        _batched_shell_profile = None
+        shell_profile.save()
+
+
+@contextmanager
+def _edit_shell_profile():
+    """Yield the shell profile to edit, saved at the end unless we are in a batch"""
+    if _batched_shell_profile is not None:
+        yield _batched_shell_profile
         return
+    shell_profile = ShellProfile(_get_shell_profile_file_path())
+    yield shell_profile
+    shell_profile.save()
 
-    while framework_header in content:
-        framework_start_index = content.find(framework_header)
-        framework_end_index = content[framework_start_index:].find("\n\n")
-        content = content[:framework_start_index] + content[framework_start_index + framework_end_index + len("\n\n"):]
 
-    # rewrite .profile and omit framework_tag
-    with open(profile_filepath + ".new", "w", encoding='utf-8') as f:
-        f.write(content)
-    os.rename(profile_filepath + ".new", profile_filepath)
+def remove_framework_envs_from_user(framework_tag):
+    """Remove all envs from user if found"""
+    with _edit_shell_profile() as shell_profile:
+        shell_profile.remove_framework(framework_tag)
 
 
 def add_env_to_user(framework_tag, env_dict):
@@ -453,8 +695,6 @@ def add_env_to_user(framework_tag, env_dict):
     value is either a list (in that case, it's concatenated) or a string
     If keep is set to True, we keep previous values with :$OLDERENV."""
 
-    profile_filepath = _get_shell_profile_file_path()
-    remove_framework_envs_from_user(framework_tag)
     envs_to_insert = {}
     for env in env_dict:
         value = env_dict[env]["value"]
@@ -467,13 +707,13 @@ def add_env_to_user(framework_tag, env_dict):
             os.environ[env] = value
         envs_to_insert[env] = value
 
-    with open(profile_filepath, "a", encoding='utf-8') as f:
-        f.write(profile_tag.format(framework_tag))
-        for env in envs_to_insert:
-            value = envs_to_insert[env]
-            logger.debug("Adding {} to user's {} for {}".format(value, env, framework_tag))
-            export = ""
-            if env != "PATH":
-                export = "export "
-            f.write("{}{}={}\n".format(export, env, value))
-        f.write("\n")
+    content = ""
+    for env in envs_to_insert:
+        value = envs_to_insert[env]
+        logger.debug("Adding {} to user's {} for {}".format(value, env, framework_tag))
+        export = ""
+        if env != "PATH":
+            export = "export "
+        content += "{}{}={}\n".format(export, env, value)
+    with _edit_shell_profile() as shell_profile:
+        shell_profile.set_framework(framework_tag, content)
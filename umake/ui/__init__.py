@@ -20,9 +20,8 @@
 """Abstracted UI interface that will be overridden by different UI types"""
 
 import logging
-from gi.repository import GLib
 from umake.tools import Singleton, MainLoop
-from umake.settings import get_version, get_latest_version
+from umake.settings import get_version, get_cached_latest_version
 
 logger = logging.getLogger(__name__)
 
@@ -37,13 +36,15 @@ class UI(object, metaclass=Singleton):
     @classmethod
     def return_main_screen(cls, status_code=0):
         try:
-            truncated_version = get_version().split("+")[0]
-            if status_code == 1 and not (get_latest_version() == truncated_version):
-                print('''
+            if status_code == 1:
+                # only rely on the cached latest version, to never block exiting on network
+                latest_version = get_cached_latest_version()
+                if latest_version is not None and latest_version != get_version().split("+")[0]:
+                    print('''
 Your currently installed version ({}) differs from the latest release ({})
 Many issues are usually fixed in more up to date versions.
 To get the latest version you can read the instructions at https://github.com/ubuntu/ubuntu-make
-'''.format(get_version(), get_latest_version()))
+'''.format(get_version(), latest_version))
         except Exception as e:
             logger.error(e)
         cls.currentUI._return_main_screen(status_code=status_code)
@@ -58,6 +59,7 @@ To get the latest version you can read the instructions at https://github.com/ub
     @classmethod
     @MainLoop.in_mainloop_thread
     def delayed_display(cls, contentType):
+        from gi.repository import GLib
         GLib.timeout_add(50, cls._one_time_wrapper, cls.currentUI._display, contentType)
 
     @staticmethod
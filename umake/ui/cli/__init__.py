@@ -19,18 +19,20 @@
 
 """Module for loading the command line interface"""
 
-import argcomplete
-from contextlib import suppress
 from gettext import gettext as _
 import logging
 import os
-from progressbar import ProgressBar, BouncingBar
 import readline
+import shlex
 import sys
 from umake.interactions import InputText, TextWithChoices, LicenseAgreement, DisplayMessage, UnknownProgress
 from umake.ui import UI
+from umake import lockfile
+from umake.commands import BATCH_INSTALL_COMMAND, LOCK_COMMAND, install_batch_install_parser, install_lock_parser
 from umake.frameworks import BaseCategory, list_frameworks
-from umake.tools import InputError, MainLoop
+from umake.frameworks.baseinstaller import BaseInstaller
+from umake.frameworks.batchinstaller import BatchInstaller
+from umake.tools import InputError, MainLoop, is_completion_mode
 from umake.settings import get_version
 
 logger = logging.getLogger(__name__)
@@ -69,13 +71,13 @@ class CliUI(UI):
                     print(contentType.text)
                 elif isinstance(contentType, UnknownProgress):
                     if not contentType.bar:
-                        contentType.bar = ProgressBar(widgets=[BouncingBar()])
-                    with suppress(StopIteration, AttributeError):
-                        # pulse and add a timeout callback
-                        contentType.bar(contentType._iterator()).next()
-                        UI.delayed_display(contentType)
-                    # don't recall the callback
-                    return False
+                        from progressbar import ProgressBar, BouncingBar, UnknownLength
+                        contentType.bar = ProgressBar(widgets=[BouncingBar()], maxval=UnknownLength).start()
+                    if contentType.done:
+                        contentType.bar.finish()
+                    else:
+                        # pulse on each progress event
+                        contentType.bar.update(contentType.bar.currval + 1)
                 else:
                     logger.error("Unexcepted content type to display to CLI UI: {}".format(contentType))
                     MainLoop().quit(status_code=1)
@@ -97,6 +99,103 @@ def run_command_for_args(args):
     target.run_for(args)
 
 
+@MainLoop.in_mainloop_thread
+def run_batch_install(frameworks_args, **batch_options):
+    """Install all frameworks from their (framework, args, command line) at once, see BatchInstaller for options"""
+    BatchInstaller(frameworks_args, **batch_options).start()
+
+
+def split_batch_install_args(args):
+    """Split the command line arguments of multiple frameworks to install in one list of arguments per framework
+
+    A framework starts with a category name, optionally followed by one of its framework name, or with a framework
+    of the main category. Other arguments (framework options, installation path) belong to the preceding framework."""
+    frameworks_args = []
+    current_category = None
+    for arg in args:
+        if not arg.startswith('-'):
+            if current_category is not None and arg in current_category.frameworks.keys():
+                frameworks_args[-1].append(arg)
+                # only one framework per category name
+                current_category = None
+                continue
+            category = BaseCategory.categories[arg]
+            if category is not None and not category.is_main_category:
+                frameworks_args.append([arg])
+                current_category = category
+                continue
+            if arg in BaseCategory.main_category.frameworks.keys():
+                frameworks_args.append([arg])
+                current_category = None
+                continue
+            if os.path.sep not in arg:
+                raise InputError(_("{} isn't a category or framework name").format(arg))
+        if not frameworks_args:
+            raise InputError(_("{} isn't attached to any framework to install").format(arg))
+        frameworks_args[-1].append(arg)
+    return frameworks_args
+
+
+def read_batch_install_manifest(path):
+    """Return the command line arguments of frameworks to install listed in this manifest file
+
+    Each line lists one or more frameworks with their options, as on the command line. # starts a comment."""
+    frameworks_args = []
+    with open(path) as f:
+        for line in f:
+            frameworks_args.extend(split_batch_install_args(shlex.split(line, comments=True)))
+    return frameworks_args
+
+
+def get_batch_install_frameworks(parser, frameworks_args):
+    """Return a list of (framework, args, command line) from each framework command line arguments"""
+    frameworks = []
+    for framework_args in frameworks_args:
+        args = parser.parse_args(mangle_args_for_default_framework(framework_args))
+        category = BaseCategory.categories[args.category]
+        if category is None:
+            framework = BaseCategory.main_category.frameworks[args.category]
+        elif args.framework:
+            framework = category.frameworks[args.framework]
+        else:
+            framework = category.default_framework
+        if framework is None:
+            raise InputError(_("A default framework for category {} was requested where there is none").format(
+                args.category))
+        if args.remove or args.dry_run or args.plan:
+            raise InputError(_("{} can only be installed with other frameworks").format(framework.name))
+        if not isinstance(framework, BaseInstaller):
+            raise InputError(_("{} can't be installed with other frameworks").format(framework.name))
+        if framework not in [selected_framework for (selected_framework, *selected_args) in frameworks]:
+            frameworks.append((framework, args, framework_args))
+    return frameworks
+
+
+def get_locked_frameworks(parser, lock_path):
+    """Return a list of (framework, args, command line) from the lock file, each framework having its lock attached"""
+    frameworks = []
+    for framework_lock in lockfile.load(lock_path):
+        for framework, args, command_line in get_batch_install_frameworks(parser, [framework_lock["command_line"]]):
+            if (framework.category.prog_name, framework.prog_name) != (framework_lock["category"],
+                                                                       framework_lock["framework"]):
+                raise InputError(_("{} lock doesn't match its command line {}").format(
+                    framework_lock["framework"], " ".join(command_line)))
+            framework.locked_metadata = framework_lock
+            frameworks.append((framework, args, command_line))
+    return frameworks
+
+
+def get_installed_frameworks(parser):
+    """Return a list of (framework, args, command line) of installed frameworks which can be updated"""
+    frameworks_args = []
+    for category in BaseCategory.categories.values():
+        for framework in category.frameworks.values():
+            if isinstance(framework, BaseInstaller) and not framework.only_for_removal and framework.is_installed:
+                frameworks_args.append([framework.prog_name] if category.is_main_category
+                                       else [category.prog_name, framework.prog_name])
+    return get_batch_install_frameworks(parser, frameworks_args)
+
+
 def mangle_args_for_default_framework(args):
     """return the potentially changed args_to_parse for the parser for handling default frameworks
 
@@ -225,8 +324,12 @@ def main(parser):
     categories_parser = parser.add_subparsers(help='Developer environment', dest="category")
     for category in BaseCategory.categories.values():
         category.install_category_parser(categories_parser)
+    batch_parser = install_batch_install_parser(categories_parser)
+    lock_parser = install_lock_parser(categories_parser)
 
-    argcomplete.autocomplete(parser)
+    if is_completion_mode():
+        import argcomplete
+        argcomplete.autocomplete(parser)
     # autocomplete will stop there. Can start more expensive operations now.
 
     arg_to_parse = sys.argv[1:]
@@ -235,6 +338,9 @@ def main(parser):
         arg_to_parse = mangle_args_for_default_framework(arg_to_parse)
     args = parser.parse_args(arg_to_parse)
 
+    if args.json and not args.list_installed:
+        parser.error(_("--json can only be used with --list-installed"))
+
     if args.list or args.list_installed or args.list_available:
         print(get_frameworks_list_output(args))
         sys.exit(0)
@@ -243,9 +349,41 @@ def main(parser):
         print(get_version())
         sys.exit(0)
 
+    if args.outdated or args.upgrade_all:
+        frameworks = get_installed_frameworks(parser)
+        if not frameworks:
+            print(_("No frameworks are currently installed"))
+            sys.exit(0)
+        CliUI()
+        run_batch_install(frameworks, check_outdated=True, upgrade=args.upgrade_all)
+        return
+
     if not args.category:
         parser.print_help()
         sys.exit(0)
 
+    if args.category in (BATCH_INSTALL_COMMAND, LOCK_COMMAND):
+        command_parser = batch_parser if args.category == BATCH_INSTALL_COMMAND else lock_parser
+        lock_path = args.output if args.category == LOCK_COMMAND else None
+        try:
+            if args.from_lock:
+                if args.frameworks or args.from_file:
+                    raise InputError(_("Frameworks can't be listed while installing from a lock file"))
+                frameworks = get_locked_frameworks(parser, args.from_lock)
+            else:
+                frameworks_args = split_batch_install_args(args.frameworks)
+                if args.from_file:
+                    frameworks_args.extend(read_batch_install_manifest(args.from_file))
+                if not frameworks_args:
+                    raise InputError(_("No framework to install"))
+                frameworks = get_batch_install_frameworks(parser, frameworks_args)
+        except InputError as e:
+            command_parser.error(e.value)
+        except OSError as e:
+            command_parser.error(str(e))
+        CliUI()
+        run_batch_install(frameworks, auto_accept_license=args.accept_license, lock_path=lock_path)
+        return
+
     CliUI()
     run_command_for_args(args)